@@ -0,0 +1,75 @@
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class AliasMatcher:
+    """
+    Автомат Ахо-Корасик для поиска всех алиасов за один проход по тексту.
+    Строится один раз по списку пар (алиас, нормализованное значение); порядок пар задаёт приоритет
+    (чем раньше пара, тем выше приоритет). При нескольких совпадениях выигрывает самый длинный алиас,
+    затем более приоритетный, затем найденный раньше в тексте.
+    """
+
+    def __init__(self, aliases):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        self._patterns = []
+        for priority, (alias, value) in enumerate(aliases):
+            if not alias:
+                continue
+            self._add(alias, value, priority)
+        self._build_failure_links()
+
+    def __len__(self):
+        return len(self._patterns)
+
+    def _add(self, alias, value, priority):
+        state = 0
+        for char in alias:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(len(self._patterns))
+        self._patterns.append((alias, value, priority))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find_all(self, text):
+        """Возвращает список совпадений (start, alias, value, priority) в порядке их окончания в тексте."""
+        matches = []
+        state = 0
+        goto, fail, output = self._goto, self._fail, self._output
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                alias, value, priority = self._patterns[index]
+                matches.append((position - len(alias) + 1, alias, value, priority))
+        return matches
+
+    def best_match(self, text):
+        """Возвращает (alias, value) лучшего совпадения или None, если алиасов в тексте нет."""
+        matches = self.find_all(text)
+        if not matches:
+            return None
+        start, alias, value, priority = min(matches, key=lambda m: (-len(m[1]), m[3], m[0]))
+        return alias, value
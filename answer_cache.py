@@ -0,0 +1,143 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from lemmatizer import get_stop_words
+
+logger = logging.getLogger(__name__)
+
+# Максимальное число закэшированных ответов и время их жизни (в секундах).
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Отвечать напрямую из строки Bible (FAQ/Answers), если вопрос совпадает с FAQ после лемматизации.
+ANSWER_FAQ_FAST_PATH = os.getenv("ANSWER_FAQ_FAST_PATH", "1") == "1"
+# Ответы OpenAI кэшируются (и выдаются из кэша) только для вопросов, в которых не меньше стольких
+# значимых слов: короткие реплики («да?», «спасибо», «а для фуры?») понятны только в контексте
+# переписки конкретного клиента, и ответ на них нельзя показывать другим клиентам.
+ANSWER_CACHE_MIN_TOKENS = int(os.getenv("ANSWER_CACHE_MIN_TOKENS", "3"))
+# Строки Bible с такими отметками Verification не используются как готовые ответы.
+FAQ_EXCLUDED_VERIFICATION = {"RULE", "CHECK"}
+
+class AnswerCache:
+    """LRU-кэш ответов с ограничением по времени жизни записей."""
+
+    def __init__(self, maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats["misses"] += 1
+                return None
+            value, expires_at = item
+            if time.monotonic() >= expires_at:
+                del self._data[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._data)
+        stats["maxsize"] = self.maxsize
+        stats["ttl_seconds"] = self.ttl
+        return stats
+
+_cache = AnswerCache()
+_faq_index = {"version": None, "answers": {}}
+_faq_stats = {"hits": 0, "context_dependent": 0, "with_history": 0}
+
+def content_tokens(normalized_question):
+    """Значимые слова лемматизированного вопроса: без знаков препинания и стоп-слов."""
+    stop_words = get_stop_words()
+    return [
+        token for token in (normalized_question or "").split()
+        if any(ch.isalnum() for ch in token) and token not in stop_words
+    ]
+
+def is_context_free(normalized_question):
+    """Можно ли считать ответ на вопрос не зависящим от переписки клиента (см. ANSWER_CACHE_MIN_TOKENS)."""
+    return len(content_tokens(normalized_question)) >= ANSWER_CACHE_MIN_TOKENS
+
+def _get_faq_index(bible_df, bible_version, normalize_many):
+    """Словарь лемматизированный FAQ -> ответ; перестраивается только при изменении версии Bible."""
+    global _faq_index
+    index = _faq_index
+    if bible_version is not None and bible_version == index["version"]:
+        return index["answers"]
+    pairs = []
+    if bible_df is not None and not bible_df.empty:
+        for _, row in bible_df.iterrows():
+            question = (row.get("FAQ") or "").strip()
+            answer = (row.get("Answers") or "").strip()
+            verification = (row.get("Verification") or "").strip().upper()
+            if question and answer and verification not in FAQ_EXCLUDED_VERIFICATION:
+                pairs.append((question, answer))
+    answers = {}
+    for normalized_question, (_, answer) in zip(normalize_many([q for q, _ in pairs]), pairs):
+        answers.setdefault(normalized_question, answer)
+    _faq_index = {"version": bible_version, "answers": answers}
+    logger.info(f"Индекс FAQ перестроен: {len(answers)} вопросов, версия Bible {bible_version}")
+    return answers
+
+def lookup_answer(normalized_question, bible_df, bible_version, normalize_many, history=None):
+    """
+    Ищет готовый ответ на вопрос: сначала в строках FAQ из Bible (если включён ANSWER_FAQ_FAST_PATH),
+    затем в кэше ответов OpenAI для текущей версии Bible. Кэш ответов OpenAI общий для всех клиентов,
+    поэтому он используется только для клиентов без истории переписки (history).
+    Возвращает текст ответа или None.
+    """
+    if not content_tokens(normalized_question):
+        return None
+    if ANSWER_FAQ_FAST_PATH:
+        answer = _get_faq_index(bible_df, bible_version, normalize_many).get(normalized_question)
+        if answer:
+            _faq_stats["hits"] += 1
+            return answer
+    if history:
+        _faq_stats["with_history"] += 1
+        return None
+    if not is_context_free(normalized_question):
+        _faq_stats["context_dependent"] += 1
+        return None
+    return _cache.get((normalized_question, bible_version))
+
+def store_answer(normalized_question, bible_version, answer, history=None):
+    """
+    Запоминает ответ OpenAI на вопрос для текущей версии Bible. Ответ, построенный с учётом
+    истории переписки клиента (history), и ответы на короткие реплики (см. is_context_free)
+    не запоминаются: их нельзя показывать другим клиентам.
+    """
+    if answer and not history and is_context_free(normalized_question):
+        _cache.put((normalized_question, bible_version), answer)
+
+def get_answer_cache_stats():
+    stats = _cache.get_stats()
+    stats["faq_hits"] = _faq_stats["hits"]
+    stats["context_dependent_skipped"] = _faq_stats["context_dependent"]
+    stats["with_history_skipped"] = _faq_stats["with_history"]
+    stats["min_tokens"] = ANSWER_CACHE_MIN_TOKENS
+    stats["faq_fast_path"] = ANSWER_FAQ_FAST_PATH
+    return stats
@@ -0,0 +1,334 @@
+"""
+Локальные заглушки внешних сервисов для бенчмарков: Google Sheets/Drive (в памяти процесса),
+OpenAI Chat Completions и страница тарифов (локальный HTTP-сервер).
+У каждой заглушки настраиваются задержка и доля ошибок; все обращения подсчитываются.
+"""
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import tracing
+
+class FakeServiceError(Exception):
+    """Ошибка, внесённая заглушкой (error injection)."""
+
+class CallCounter:
+    """Потокобезопасные счётчики обращений к внешним сервисам."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def add(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return Counter(self._counts)
+
+class Latency:
+    """Задержка (среднее ± jitter, в секундах) и доля ошибок для одной заглушки."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def apply(self, name):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            raise FakeServiceError(f"Ошибка, внесённая заглушкой: {name}")
+
+# --- Google Sheets / Drive -------------------------------------------------
+
+_A1_RE = re.compile(r"^(?:(?P<sheet>[^!]+)!)?(?P<c1>[A-Z]+)(?P<r1>\d*)(?::(?P<c2>[A-Z]+)(?P<r2>\d*))?$")
+
+def _column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+def parse_a1(a1_range):
+    """'Sheet1!A2:G' -> (первая строка, последняя строка или None, первый столбец, последний столбец)."""
+    match = _A1_RE.match(a1_range)
+    if not match:
+        raise FakeServiceError(f"Неподдерживаемый диапазон: {a1_range}")
+    first_row = int(match.group("r1") or 1)
+    last_row = int(match.group("r2")) if match.group("r2") else (first_row if match.group("c2") is None else None)
+    first_col = _column_index(match.group("c1"))
+    last_col = _column_index(match.group("c2") or match.group("c1"))
+    return first_row, last_row, first_col, last_col
+
+class _Request:
+    def __init__(self, backend, name, func):
+        self._backend = backend
+        self._name = name
+        self._func = func
+
+    def execute(self, num_retries=0):
+        # Как и настоящие запросы (google_clients.TracedHttpRequest), учитываются в tracing по имени метода API.
+        with tracing.span(self._name):
+            self._backend.counter.add(self._name)
+            self._backend.latency.apply(self._name)
+            with self._backend.lock:
+                return self._func()
+
+class FakeGoogleBackend:
+    """Хранилище таблиц и файлов Drive в памяти: {spreadsheetId: {"title": ..., "rows": [[...], ...]}}."""
+
+    def __init__(self, counter, latency):
+        self.counter = counter
+        self.latency = latency
+        self.lock = threading.RLock()
+        self.spreadsheets = {}
+        self._next_id = 0
+
+    def add_spreadsheet(self, title, rows, spreadsheet_id=None):
+        with self.lock:
+            if spreadsheet_id is None:
+                self._next_id += 1
+                spreadsheet_id = f"fake-{self._next_id}"
+            self.spreadsheets[spreadsheet_id] = {"title": title, "rows": [list(row) for row in rows]}
+            return spreadsheet_id
+
+    def rows(self, spreadsheet_id):
+        sheet = self.spreadsheets.get(spreadsheet_id)
+        if sheet is None:
+            raise FakeServiceError(f"Таблица {spreadsheet_id} не найдена")
+        return sheet["rows"]
+
+class _Values:
+    def __init__(self, backend):
+        self._b = backend
+
+    def get(self, spreadsheetId, range, **kwargs):
+        def run():
+            first_row, last_row, first_col, last_col = parse_a1(range)
+            rows = self._b.rows(spreadsheetId)
+            selected = rows[first_row - 1:last_row]
+            return {"range": range, "values": [row[first_col:last_col + 1] for row in selected]}
+        return _Request(self._b, "sheets.spreadsheets.values.get", run)
+
+    def append(self, spreadsheetId, range, body, **kwargs):
+        def run():
+            rows = self._b.rows(spreadsheetId)
+            start = len(rows) + 1
+            rows.extend(list(row) for row in body.get("values", []))
+            sheet = range.split("!")[0] if "!" in range else "Sheet1"
+            return {"updates": {"updatedRange": f"{sheet}!A{start}:G{len(rows)}", "updatedRows": len(rows) - start + 1}}
+        return _Request(self._b, "sheets.spreadsheets.values.append", run)
+
+    def _write(self, spreadsheet_id, a1_range, values):
+        first_row, _, first_col, _ = parse_a1(a1_range)
+        rows = self._b.rows(spreadsheet_id)
+        for offset, values_row in enumerate(values):
+            index = first_row - 1 + offset
+            while len(rows) <= index:
+                rows.append([])
+            row = rows[index]
+            for col_offset, value in enumerate(values_row):
+                while len(row) <= first_col + col_offset:
+                    row.append("")
+                row[first_col + col_offset] = value
+
+    def update(self, spreadsheetId, range, body, **kwargs):
+        def run():
+            self._write(spreadsheetId, range, body.get("values", []))
+            return {"updatedRange": range}
+        return _Request(self._b, "sheets.spreadsheets.values.update", run)
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        def run():
+            for item in body.get("data", []):
+                self._write(spreadsheetId, item["range"], item.get("values", []))
+            return {"totalUpdatedCells": len(body.get("data", []))}
+        return _Request(self._b, "sheets.spreadsheets.values.batchUpdate", run)
+
+class _Spreadsheets:
+    def __init__(self, backend):
+        self._b = backend
+
+    def values(self):
+        return _Values(self._b)
+
+    def create(self, body, **kwargs):
+        def run():
+            rows = []
+            for sheet in body.get("sheets", []):
+                for data in sheet.get("data", []):
+                    for row_data in data.get("rowData", []):
+                        rows.append([cell.get("userEnteredValue", {}).get("stringValue", "") for cell in row_data.get("values", [])])
+            spreadsheet_id = self._b.add_spreadsheet(body.get("properties", {}).get("title", ""), rows)
+            return {"spreadsheetId": spreadsheet_id}
+        return _Request(self._b, "sheets.spreadsheets.create", run)
+
+    def get(self, spreadsheetId, **kwargs):
+        return _Request(self._b, "sheets.spreadsheets.get", lambda: {"sheets": [{"properties": {"sheetId": 0}}]})
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        return _Request(self._b, "sheets.spreadsheets.batchUpdate", lambda: {"replies": []})
+
+class FakeSheetsService:
+    def __init__(self, backend):
+        self._b = backend
+
+    def spreadsheets(self):
+        return _Spreadsheets(self._b)
+
+_NAME_EQ_RE = re.compile(r"name\s*=\s*'([^']*)'")
+_NAME_CONTAINS_RE = re.compile(r"name contains '([^']*)'")
+
+class _Files:
+    def __init__(self, backend):
+        self._b = backend
+
+    def list(self, q="", pageSize=100, pageToken=None, **kwargs):
+        def run():
+            equals = _NAME_EQ_RE.search(q)
+            contains = _NAME_CONTAINS_RE.search(q)
+            files = []
+            for spreadsheet_id, sheet in self._b.spreadsheets.items():
+                title = sheet["title"]
+                if equals and title != equals.group(1):
+                    continue
+                if contains and contains.group(1) not in title:
+                    continue
+                files.append({"id": spreadsheet_id, "name": title})
+            start = int(pageToken or 0)
+            page = files[start:start + pageSize]
+            response = {"files": page}
+            if start + pageSize < len(files):
+                response["nextPageToken"] = str(start + pageSize)
+            return response
+        return _Request(self._b, "drive.files.list", run)
+
+    def update(self, fileId, **kwargs):
+        return _Request(self._b, "drive.files.update", lambda: {"id": fileId})
+
+class FakeDriveService:
+    def __init__(self, backend):
+        self._b = backend
+
+    def files(self):
+        return _Files(self._b)
+
+# --- OpenAI и страница тарифов ------------------------------------------------
+
+def render_tariff_html(tariffs):
+    """tariffs – список (тип ТС, цена Ro->Ge, цена Ge->Ro, примечание, условие)."""
+    rows = "".join(
+        "<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>" for row in tariffs
+    )
+    return (
+        "<html><body><table><tr><th>Vehicle</th><th>Romania-Georgia</th><th>Georgia-Romania</th>"
+        f"<th>Remark</th><th>Condition</th></tr>{rows}</table></body></html>"
+    )
+
+class StubHTTPServer:
+    """
+    Локальный HTTP-сервер с заглушками OpenAI (POST /v1/chat/completions, в том числе stream=true)
+    и страницы тарифов (GET /tariff.html, с поддержкой ETag / 304).
+    """
+
+    def __init__(self, counter, openai_latency, tariff_latency, tariff_html, reply_words=40):
+        self.counter = counter
+        self.openai_latency = openai_latency
+        self.tariff_latency = tariff_latency
+        self.tariff_html = tariff_html.encode("utf-8")
+        self.tariff_etag = '"' + hashlib.sha1(self.tariff_html).hexdigest()[:12] + '"'
+        self.reply_words = reply_words
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="bench-stubs", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body=b"", content_type="application/json", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/tariff.html":
+                    return self._send(404, b"{}")
+                stub.counter.add("tariff.get")
+                try:
+                    stub.tariff_latency.apply("tariff.get")
+                except FakeServiceError:
+                    return self._send(503, b"unavailable", "text/plain")
+                if self.headers.get("If-None-Match") == stub.tariff_etag:
+                    return self._send(304, headers={"ETag": stub.tariff_etag})
+                self._send(200, stub.tariff_html, "text/html; charset=utf-8", {"ETag": stub.tariff_etag})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.split("?")[0] != "/v1/chat/completions":
+                    return self._send(404, b"{}")
+                stub.counter.add("openai.chat")
+                try:
+                    stub.openai_latency.apply("openai.chat")
+                except FakeServiceError:
+                    error = {"error": {"message": "stub overloaded", "type": "server_error"}}
+                    return self._send(503, json.dumps(error).encode())
+                question = payload.get("messages", [{}])[-1].get("content", "")
+                words = [f"ответ{i}" for i in range(stub.reply_words)]
+                if payload.get("stream"):
+                    return self._stream(words)
+                reply = {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": payload.get("model"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": f"{question}: " + " ".join(words)},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+                }
+                self._send(200, json.dumps(reply, ensure_ascii=False).encode("utf-8"))
+
+            def _stream(self, words):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for word in words:
+                    chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk",
+                             "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+        return Handler
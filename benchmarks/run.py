@@ -0,0 +1,243 @@
+"""
+Сквозной бенчмарк server.app на локальных заглушках Google Sheets/Drive, OpenAI и сайта тарифов.
+
+    python -m benchmarks.run
+    python -m benchmarks.run --requests 500 --concurrency 16 --google-latency-ms 120 --openai-latency-ms 800
+    python -m benchmarks.run --workloads chat_llm,chat_price --error-rate 0.05 --json results.json
+
+Для каждого сценария выводятся p50/p95/p99 задержки, пропускная способность, доля ошибок
+и число обращений к внешним сервисам в расчёте на запрос (включая работу фоновых потоков
+во время сценария). Сценарии выполняются по очереди.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import (
+    CallCounter, Latency, FakeGoogleBackend, FakeSheetsService, FakeDriveService,
+    StubHTTPServer, render_tariff_html,
+)
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT_SPREADSHEET_ID = "1eGpB0hiRxXPpYN75-UKyXoar7yh-zne8r8ox-hXrS1I"
+BIBLE_SPREADSHEET_ID = "bench-bible"
+
+TARIFFS = [
+    ("Легковой автомобиль", "700 EUR", "650 EUR", "", ""),
+    ("Микроавтобус", "900 EUR", "850 EUR", "", ""),
+    ("Грузовик до 10 т", "1 500 EUR", "1 400 EUR", "", "Водитель обязателен"),
+    ("Фура 20 т", "2 300 EUR", "2 100 EUR", "ADR +20%", ""),
+    ("Мотоцикл", "250 EUR", "230 EUR", "", ""),
+]
+BIBLE_ROWS = [
+    ["FAQ", "Answers", "Verification", "rule"],
+    ["Как забронировать место на пароме?", "Напишите нам дату и тип транспорта.", "", ""],
+    ["Сколько длится рейс?", "Около 48 часов.", "", ""],
+    ["", "легковушка, машина, авто = легковой автомобиль\nфура, тягач = фура 20 т", "Rule", ""],
+    ["", "Отвечай кратко и вежливо.", "Rule", ""],
+]
+CHAT_QUESTIONS = [
+    "Какие документы нужны для перевозки?",
+    "Можно ли взять собаку на паром?",
+    "Есть ли на пароме каюты?",
+    "Как оплатить билет?",
+]
+
+WORKLOADS = ("chat_llm", "chat_price", "get_price", "register_client", "verify_code")
+
+def percentile(values, p):
+    """Перцентиль методом ближайшего ранга (values отсортированы)."""
+    if not values:
+        return None
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+def prepare_environment(workdir, stub_url, args):
+    """Переменные окружения, которые должны быть заданы до импорта server."""
+    os.environ.update({
+        "LOCAL_DB_PATH": os.path.join(workdir, "bench.db"),
+        "TELEGRAM_BOT_TOKEN": "bench",
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_API_BASE": f"{stub_url}/v1",
+        "TARIFF_URL": f"{stub_url}/tariff.html",
+        "BIBLE_SPREADSHEET_ID": BIBLE_SPREADSHEET_ID,
+        "STARTUP_WARMUP": "off",
+        "NLTK_DOWNLOAD": "0",
+        "GUIDING_SESSION_STORE": "sqlite",
+        "ANSWER_CACHE_TTL": str(args.answer_cache_ttl),
+    })
+    os.environ.pop("TELEGRAM_CHAT_ID", None)  # уведомления в Telegram не отправляются
+
+def seed_google(backend, clients):
+    """Заполняет заглушку Google: реестр клиентов, Bible и файлы переписки клиентов."""
+    header = ["Client Code", "Name", "Phone", "Email", "Created Date", "Last Visit", "Activity Status"]
+    rows = [header]
+    for i in range(clients):
+        rows.append([f"BENCH{i:05d}", f"Client {i}", f"+995{i:08d}", f"client{i}@example.com",
+                     "2024-01-01 00:00:00", "2024-01-01 00:00:00", "Active"])
+    backend.add_spreadsheet("ClientData", rows, CLIENT_SPREADSHEET_ID)
+    backend.add_spreadsheet("Bible", BIBLE_ROWS, BIBLE_SPREADSHEET_ID)
+    for i in range(clients):
+        history = [["Client", "Assistant", "Client Code", "Name", "Phone", "Email", "Created Date"]]
+        history += [[f"01.01.24 10:0{k} - вопрос {k}", f"01.01.24 10:0{k} - ответ {k}"] for k in range(5)]
+        backend.add_spreadsheet(f"Client_BENCH{i:05d}.xlsx", history)
+
+def install_fakes(backend):
+    import google_clients
+    google_clients.override_service("sheets", "v4", FakeSheetsService(backend))
+    google_clients.override_service("drive", "v3", FakeDriveService(backend))
+    import bible
+    if not hasattr(bible, "get_rule"):
+        # Тексты правил берутся из Bible; в этой версии модуля их нет, поэтому для бенчмарка
+        # подставляется ключ правила – на измеряемые пути это не влияет.
+        logging.warning("bible.get_rule не найден, для бенчмарка используются ключи правил.")
+        bible.get_rule = lambda key: key
+
+def build_workloads(args):
+    counter = {"next": 0}
+    lock = threading.Lock()
+
+    def next_id():
+        with lock:
+            counter["next"] += 1
+            return counter["next"]
+
+    def client_code():
+        return f"BENCH{random.randrange(args.clients):05d}"
+
+    return {
+        "chat_llm": lambda client: client.post("/chat", json={
+            "message": f"{random.choice(CHAT_QUESTIONS)} #{random.randrange(args.distinct_questions)}",
+            "client_code": client_code(),
+        }),
+        "chat_price": lambda client: client.post("/chat", json={
+            "message": random.choice(["цена на легковушку из Поти в Констанцу", "прайс для фуры", "цена мотоцикл"]),
+            "client_code": client_code(),
+        }),
+        "get_price": lambda client: client.post("/get-price", json={
+            "vehicle": random.choice(["легковой автомобиль", "микроавтобус", "грузовик до 10 т"]),
+            "direction": random.choice(["Ro_Ge", "Ge_Ro"]),
+        }),
+        "register_client": lambda client: client.post("/register-client", json={
+            "name": "Bench",
+            "email": f"new{next_id()}@example.com" if random.random() < 0.5 else f"client{random.randrange(args.clients)}@example.com",
+            "phone": "",
+        }),
+        "verify_code": lambda client: client.post("/verify-code", json={"code": client_code()}),
+    }
+
+def run_workload(app, name, request, args, calls):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(_):
+        nonlocal errors
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        started = time.perf_counter()
+        try:
+            response = request(local.client)
+            failed = response.status_code >= 400
+            response.close()
+        except Exception:
+            failed = True
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            errors += failed
+
+    for _ in range(args.warmup):
+        one(None)
+    latencies.clear()
+    errors = 0
+    before = calls.snapshot()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one, range(args.requests)))
+    duration = time.perf_counter() - started
+    # Даём фоновым потокам (журнал переписки, Last Visit) завершить работу, вызванную сценарием.
+    time.sleep(args.settle)
+    delta = calls.snapshot() - before
+    latencies.sort()
+    return {
+        "workload": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(latencies) / duration, 1) if duration else None,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "external_calls_per_request": {key: round(value / len(latencies), 3) for key, value in sorted(delta.items())},
+    }
+
+def print_report(results):
+    print(f"{'workload':<16}{'req':>6}{'err':>5}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  external calls / request")
+    for r in results:
+        calls = ", ".join(f"{key}={value}" for key, value in r["external_calls_per_request"].items()) or "-"
+        print(f"{r['workload']:<16}{r['requests']:>6}{r['errors']:>5}{r['throughput_rps']:>9}"
+              f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}  {calls}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк server.app на локальных заглушках внешних сервисов.")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS), help=f"Сценарии через запятую: {', '.join(WORKLOADS)}")
+    parser.add_argument("--requests", type=int, default=200, help="Запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=8, help="Одновременных запросов")
+    parser.add_argument("--warmup", type=int, default=5, help="Прогревочных запросов перед замером")
+    parser.add_argument("--clients", type=int, default=200, help="Клиентов в заглушке реестра")
+    parser.add_argument("--distinct-questions", type=int, default=50, help="Разных вопросов в сценарии chat_llm")
+    parser.add_argument("--answer-cache-ttl", type=float, default=3600, help="ANSWER_CACHE_TTL (0 – без кэша ответов)")
+    parser.add_argument("--google-latency-ms", type=float, default=80)
+    parser.add_argument("--openai-latency-ms", type=float, default=600)
+    parser.add_argument("--tariff-latency-ms", type=float, default=150)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Разброс задержки (доля от задержки)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ошибок, вносимых заглушками")
+    parser.add_argument("--settle", type=float, default=1.0, help="Пауза после сценария для фоновых потоков (с)")
+    parser.add_argument("--json", help="Сохранить результаты в JSON-файл")
+    parser.add_argument("--verbose", action="store_true", help="Не подавлять логи приложения")
+    args = parser.parse_args(argv)
+
+    def latency(ms):
+        return Latency(ms / 1000, ms / 1000 * args.jitter, args.error_rate)
+
+    calls = CallCounter()
+    stubs = StubHTTPServer(calls, latency(args.openai_latency_ms), latency(args.tariff_latency_ms), render_tariff_html(TARIFFS)).start()
+    workdir = tempfile.mkdtemp(prefix="caec-bench-")
+    prepare_environment(workdir, stubs.base_url, args)
+    # Приложение пишет логи и локальные файлы относительно текущего каталога.
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(workdir)
+    backend = FakeGoogleBackend(calls, latency(args.google_latency_ms))
+    seed_google(backend, args.clients)
+    try:
+        install_fakes(backend)
+        import server
+        if not args.verbose:
+            logging.disable(logging.WARNING)
+        workloads = build_workloads(args)
+        results = []
+        for name in [w.strip() for w in args.workloads.split(",") if w.strip()]:
+            if name not in workloads:
+                parser.error(f"Неизвестный сценарий: {name}")
+            results.append(run_workload(server.app, name, workloads[name], args, calls))
+        print_report(results)
+        if args.json:
+            with open(os.path.join(REPO_ROOT, args.json) if not os.path.isabs(args.json) else args.json, "w") as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
+        return results
+    finally:
+        stubs.stop()
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,184 @@
 import os
+import time
+import json
+import hashlib
+import threading
 import pandas as pd
 import logging
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+import google_clients
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 BIBLE_SPREADSHEET_ID = os.getenv("BIBLE_SPREADSHEET_ID")
+BIBLE_RANGE = "Bible!A2:D"
+BIBLE_COLUMNS = ["FAQ", "Answers", "Verification", "rule"]
+
+# Время (в секундах), в течение которого закэшированная Bible считается свежей.
+BIBLE_CACHE_TTL = float(os.getenv("BIBLE_CACHE_TTL", "300"))
+# Сколько ещё секунд после истечения TTL можно отдавать устаревшие данные,
+# пока в фоне идёт обновление (stale-while-revalidate).
+BIBLE_CACHE_STALE_TTL = float(os.getenv("BIBLE_CACHE_STALE_TTL", "3600"))
+# Через сколько секунд повторить загрузку, если Google Sheets недоступен (до этого отдаются прежние данные).
+BIBLE_RETRY_INTERVAL = float(os.getenv("BIBLE_RETRY_INTERVAL", "30"))
+
+_cache_lock = threading.Lock()
+_load_lock = threading.Lock()
+_cache = {
+    "data": None,
+    "version": None,
+    "loaded_at": 0.0,
+    "generation": 0,
+    "refreshing": False,
+    "invalidated": False,
+    "retry_at": 0.0,
+}
+_cache_stats = {
+    "hits": 0,
+    "stale_hits": 0,
+    "misses": 0,
+    "refreshes": 0,
+    "refresh_errors": 0,
+    "invalidations": 0,
+    "backoff_skips": 0,
+}
 
 def get_sheets_service():
     try:
-        credentials = Credentials.from_service_account_file(
-            os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-        )
-        service = build('sheets', 'v4', credentials=credentials)
-        return service
+        return google_clients.get_sheets_service()
     except Exception as e:
         logger.error(f"Ошибка инициализации Google Sheets API: {e}")
         raise
 
+def _fetch_bible_data():
+    """Скачивает лист Bible из Google Sheets. Возвращает (DataFrame, версия)."""
+    service = get_sheets_service()
+    result = service.spreadsheets().values().get(
+        spreadsheetId=BIBLE_SPREADSHEET_ID, range=BIBLE_RANGE
+    ).execute()
+    values = result.get("values", [])
+    version = hashlib.sha1(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+    return pd.DataFrame(values, columns=BIBLE_COLUMNS), version
+
+def _store(df, version, generation):
+    """Сохраняет данные в кэш, если кэш не был инвалидирован во время загрузки."""
+    with _cache_lock:
+        if generation != _cache["generation"]:
+            return False
+        _cache["data"] = df
+        _cache["version"] = version
+        _cache["loaded_at"] = time.monotonic()
+        _cache["invalidated"] = False
+        _cache["retry_at"] = 0.0
+        return True
+
+def _background_refresh(generation):
+    try:
+        df, version = _fetch_bible_data()
+        if _store(df, version, generation):
+            logger.info(f"Bible обновлена в фоне (версия {version}).")
+            with _cache_lock:
+                _cache_stats["refreshes"] += 1
+    except Exception as e:
+        logger.error(f"Ошибка фонового обновления Bible: {e}")
+        with _cache_lock:
+            _cache_stats["refresh_errors"] += 1
+            _cache["retry_at"] = time.monotonic() + BIBLE_RETRY_INTERVAL
+    finally:
+        with _cache_lock:
+            _cache["refreshing"] = False
+
+def load_bible_snapshot():
+    """
+    Возвращает пару (DataFrame, версия) из общего кэша процесса.
+    В течение BIBLE_CACHE_TTL данные считаются свежими, затем ещё BIBLE_CACHE_STALE_TTL
+    отдаются устаревшие данные, пока в фоне идёт обновление.
+    Возвращаемый DataFrame общий для всех потоков – изменять его нельзя.
+    """
+    with _cache_lock:
+        df = _cache["data"]
+        now = time.monotonic()
+        age = now - _cache["loaded_at"]
+        if df is not None and not _cache["invalidated"]:
+            if age < BIBLE_CACHE_TTL:
+                _cache_stats["hits"] += 1
+                return df, _cache["version"]
+            if age < BIBLE_CACHE_TTL + BIBLE_CACHE_STALE_TTL:
+                _cache_stats["stale_hits"] += 1
+                if not _cache["refreshing"] and now >= _cache["retry_at"]:
+                    _cache["refreshing"] = True
+                    threading.Thread(
+                        target=_background_refresh, args=(_cache["generation"],), daemon=True
+                    ).start()
+                return df, _cache["version"]
+        if now < _cache["retry_at"]:
+            # Недавняя загрузка не удалась: не ждём Google Sheets в каждом запросе, отдаём что есть.
+            _cache_stats["backoff_skips"] += 1
+            return df, _cache["version"]
+
+    # Синхронная загрузка: одновременно Bible скачивает только один поток.
+    with _load_lock:
+        with _cache_lock:
+            now = time.monotonic()
+            stale = (_cache["data"], _cache["version"])
+            if stale[0] is not None and not _cache["invalidated"] and now - _cache["loaded_at"] < BIBLE_CACHE_TTL:
+                _cache_stats["hits"] += 1
+                return stale
+            if now < _cache["retry_at"]:
+                # Пока поток ждал блокировку, загрузка не удалась – повторять её сразу не нужно.
+                _cache_stats["backoff_skips"] += 1
+                return stale
+            _cache_stats["misses"] += 1
+            generation = _cache["generation"]
+        try:
+            df, version = _fetch_bible_data()
+            _store(df, version, generation)
+            return df, version
+        except Exception as e:
+            logger.error(f"Ошибка загрузки Bible.xlsx: {e}")
+            with _cache_lock:
+                _cache["retry_at"] = time.monotonic() + BIBLE_RETRY_INTERVAL
+            return stale
+
 def load_bible_data():
+    """Возвращает содержимое листа Bible в виде DataFrame (см. load_bible_snapshot)."""
+    return load_bible_snapshot()[0]
+
+def invalidate_bible_cache():
+    """
+    Помечает кэш Bible устаревшим: следующий вызов load_bible_data() скачает лист заново.
+    Прежние данные сохраняются и отдаются, если загрузка не удастся.
+    """
+    with _cache_lock:
+        _cache["invalidated"] = True
+        _cache["retry_at"] = 0.0
+        _cache["generation"] += 1
+        _cache_stats["invalidations"] += 1
+    logger.info("Кэш Bible помечен устаревшим.")
+
+def get_bible_cache_stats():
+    """Возвращает счётчики кэша Bible (попадания, промахи, обновления) и возраст данных."""
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats["version"] = _cache["version"]
+        stats["age_seconds"] = round(time.monotonic() - _cache["loaded_at"], 1) if _cache["data"] is not None else None
+        stats["ttl_seconds"] = BIBLE_CACHE_TTL
+    return stats
+
+def save_bible_pair(question, answer):
+    """
+    Добавляет в лист Bible новую пару вопрос-ответ с отметкой 'Check' и сразу сбрасывает кэш Bible.
+    """
     try:
         service = get_sheets_service()
-        range_name = "Bible!A2:D"
-        result = service.spreadsheets().values().get(
-            spreadsheetId=BIBLE_SPREADSHEET_ID, range=range_name
+        body = {"values": [[question, answer, "Check", ""]]}
+        service.spreadsheets().values().append(
+            spreadsheetId=BIBLE_SPREADSHEET_ID,
+            range="Bible!A:D",
+            valueInputOption="RAW",
+            insertDataOption="INSERT_ROWS",
+            body=body
         ).execute()
-        values = result.get("values", [])
-        return pd.DataFrame(values, columns=["FAQ", "Answers", "Verification", "rule"])
-    except Exception as e:
-        logger.error(f"Ошибка загрузки Bible.xlsx: {e}")
-        return None
+        logger.info(f"Пара вопрос-ответ добавлена в Bible: {question}")
+    finally:
+        invalidate_bible_cache()
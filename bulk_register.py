@@ -0,0 +1,62 @@
+"""
+Массовая регистрация клиентов из CSV или JSON.
+
+    python bulk_register.py clients.csv
+    python bulk_register.py clients.json --workers 4 --no-files
+
+CSV – с заголовком, столбцы name, email, phone (регистр не важен).
+JSON – список объектов {"name": ..., "email": ..., "phone": ...}.
+Итог (созданные, уже существующие и пропущенные записи) выводится в формате JSON.
+"""
+import io
+import os
+import csv
+import sys
+import json
+import argparse
+
+CLIENT_FIELDS = ("name", "email", "phone")
+
+def parse_clients(text, fmt):
+    """Разбирает пачку клиентов из текста CSV или JSON в список словарей name/email/phone."""
+    if fmt == "json":
+        items = json.loads(text)
+        if isinstance(items, dict):
+            items = items.get("clients", [])
+        if not isinstance(items, list):
+            raise ValueError("JSON должен содержать список клиентов.")
+    else:
+        items = list(csv.DictReader(io.StringIO(text)))
+    clients = []
+    for item in items:
+        fields = {str(key).strip().lower(): value for key, value in item.items() if key is not None}
+        clients.append({field: fields.get(field) or "" for field in CLIENT_FIELDS})
+    return clients
+
+def detect_format(path):
+    return "json" if os.path.splitext(path)[1].lower() == ".json" else "csv"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Массовая регистрация клиентов из CSV/JSON.")
+    parser.add_argument("path", help="Файл с клиентами (.csv или .json)")
+    parser.add_argument("--format", choices=("csv", "json"), help="Формат файла (по умолчанию – по расширению)")
+    parser.add_argument("--workers", type=int, default=None, help="Сколько файлов клиентов создавать параллельно")
+    parser.add_argument("--no-files", action="store_true", help="Не создавать файлы переписки клиентов")
+    args = parser.parse_args(argv)
+
+    from logging_setup import setup_logging
+    setup_logging()
+    from clientdata import register_clients_bulk, BULK_FILE_WORKERS
+    with open(args.path, encoding="utf-8-sig") as f:
+        clients = parse_clients(f.read(), args.format or detect_format(args.path))
+    result = register_clients_bulk(
+        clients,
+        create_files=not args.no_files,
+        max_workers=args.workers or BULK_FILE_WORKERS
+    )
+    json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    return 1 if result["files"]["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
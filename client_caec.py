@@ -5,31 +5,19 @@ import logging
 from io import BytesIO
 from openpyxl import Workbook, load_workbook
 from openpyxl.styles import Alignment, numbers
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+import google_clients
+import client_index
+import notifier
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
 from config import CLIENT_DATA_PATH, CLIENT_FILES_DIR  # Импортируем константы из config
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("client_caec.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-# Функция для отправки уведомлений через Telegram
+# Функция для отправки уведомлений через Telegram: отправку (с дедупликацией и сводками) выполняет фоновый поток notifier
 def send_notification(message):
     try:
-        import requests
-        telegram_bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
-        telegram_chat_id = os.getenv("TELEGRAM_CHAT_ID")
-        if telegram_bot_token and telegram_chat_id:
-            url = f"https://api.telegram.org/bot{telegram_bot_token}/sendMessage"
-            payload = {"chat_id": telegram_chat_id, "text": message, "parse_mode": "HTML"}
-            requests.post(url, json=payload)
+        notifier.notify(message)
     except Exception as ex:
         logger.error(f"Ошибка при отправке уведомления: {ex}")
 
@@ -47,11 +35,7 @@ GOOGLE_DRIVE_FOLDER_ID = "11cQYLDGKlu2Rn_9g8R_4xNA59ikhvJpS"
 
 def get_drive_service():
     try:
-        credentials = Credentials.from_service_account_file(
-            os.getenv("GOOGLE_APPLICATION_CREDENTIALS"),
-            scopes=["https://www.googleapis.com/auth/drive"]
-        )
-        return build("drive", "v3", credentials=credentials)
+        return google_clients.get_drive_service()
     except Exception as e:
         logger.error(f"Ошибка инициализации Google Drive API: {e}")
         send_notification(f"Ошибка инициализации Google Drive API: {e}")
@@ -59,8 +43,7 @@ def get_drive_service():
 
 def get_sheets_service():
     try:
-        credentials = Credentials.from_service_account_file(os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
-        return build('sheets', 'v4', credentials=credentials)
+        return google_clients.get_sheets_service()
     except Exception as e:
         logger.error(f"Ошибка инициализации Google Sheets API: {e}")
         send_notification(f"Ошибка инициализации Google Sheets API: {e}")
@@ -97,17 +80,29 @@ def find_file_id(drive_service, file_name):
 
 def find_client_file_id(client_code):
     """
-    Ищет Google Sheets файл для клиента по имени, содержащий "Client_{client_code}".
+    Возвращает spreadsheetId Google Sheets файла клиента Client_{client_code}.
+    Сначала проверяется локальный индекс client_index; поиск на Google Drive выполняется
+    только при промахе, а найденный файл сохраняется в индекс.
     Возвращает spreadsheetId, если найден, иначе None.
     """
+    try:
+        spreadsheet_id = client_index.get_spreadsheet_id(client_code)
+        if spreadsheet_id:
+            return spreadsheet_id
+    except Exception as e:
+        logger.error(f"Ошибка чтения локального индекса файлов клиентов: {e}")
     file_name_fragment = f"Client_{client_code}"
     drive_service = get_drive_service()
     try:
-        query = f"name contains '{file_name_fragment}' and '{GOOGLE_DRIVE_FOLDER_ID}' in parents and mimeType='application/vnd.google-apps.spreadsheet'"
+        query = f"name contains '{file_name_fragment}' and '{GOOGLE_DRIVE_FOLDER_ID}' in parents and mimeType='application/vnd.google-apps.spreadsheet' and trashed=false"
         response = drive_service.files().list(q=query, fields="files(id, name)").execute()
         files = response.get("files", [])
+        # "name contains" находит и файлы с более длинным кодом (Client_CAEC12 для CAEC1), поэтому
+        # принимаем только точное совпадение кода: чужой файл попал бы в индекс навсегда.
+        files = [f for f in files if client_index.client_code_from_file_name(f["name"]) == str(client_code)]
         if files:
             logger.info(f"Найден файл для клиента {client_code}: {files[0]['name']}")
+            _remember_client_file(client_code, files[0]["id"], files[0]["name"])
             return files[0]["id"]
         logger.info(f"Файл для клиента {client_code} не найден на Google Drive.")
         return None
@@ -116,6 +111,56 @@ def find_client_file_id(client_code):
         send_notification(f"Ошибка при поиске файла для клиента {client_code}: {e}")
         raise
 
+def _remember_client_file(client_code, spreadsheet_id, file_name=None):
+    try:
+        client_index.remember(client_code, spreadsheet_id, file_name)
+    except Exception as e:
+        logger.error(f"Ошибка записи в локальный индекс файлов клиентов: {e}")
+
+def warm_client_file_index():
+    """
+    Заполняет локальный индекс файлов клиентов одним постраничным листингом папки на Google Drive.
+    Вызывается при старте каждого воркера, но листинг выполняет только один процесс и не чаще
+    раза за CLIENT_INDEX_WARM_INTERVAL (см. client_index.claim_warm_up).
+    Возвращает количество проиндексированных файлов (0, если прогрев не понадобился).
+    """
+    try:
+        if not client_index.claim_warm_up():
+            logger.info("Индекс файлов клиентов уже прогрет другим процессом, листинг Google Drive пропущен.")
+            return 0
+    except Exception as e:
+        logger.error(f"Ошибка чтения локального индекса файлов клиентов: {e}")
+        return 0
+    success = False
+    try:
+        drive_service = get_drive_service()
+        query = f"'{GOOGLE_DRIVE_FOLDER_ID}' in parents and mimeType='application/vnd.google-apps.spreadsheet' and trashed=false"
+        indexed = 0
+        page_token = None
+        while True:
+            response = drive_service.files().list(
+                q=query,
+                fields="nextPageToken, files(id, name)",
+                pageSize=1000,
+                pageToken=page_token
+            ).execute()
+            indexed += client_index.remember_many(response.get("files", []))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+        success = True
+        logger.info(f"Индекс файлов клиентов прогрет: {indexed} файлов.")
+        return indexed
+    except Exception as e:
+        logger.error(f"Ошибка прогрева индекса файлов клиентов: {e}")
+        send_notification(f"Ошибка прогрева индекса файлов клиентов: {e}")
+        return 0
+    finally:
+        try:
+            client_index.finish_warm_up(success)
+        except Exception as e:
+            logger.error(f"Ошибка записи в локальный индекс файлов клиентов: {e}")
+
 def create_client_file(client_code, client_data):
     """
     Создает новый Google Sheets файл для клиента с начальными данными.
@@ -147,6 +192,7 @@ def create_client_file(client_code, client_data):
         result = sheets_service.spreadsheets().create(body=body, fields="spreadsheetId").execute()
         spreadsheet_id = result.get("spreadsheetId")
         logger.info(f"Создан файл клиента {file_title} с spreadsheetId: {spreadsheet_id}")
+        _remember_client_file(client_code, spreadsheet_id, file_title)
         # Перемещаем файл в нужную папку через Drive API
         drive_service = get_drive_service()
         drive_service.files().update(
@@ -228,6 +274,58 @@ def set_text_wrap(spreadsheet_id, start_column_index, end_column_index):
         logger.error(f"Ошибка при установке переноса текста в столбцах {start_column_index} - {end_column_index - 1}: {e}")
         send_notification(f"Ошибка при установке переноса текста в столбцах {start_column_index} - {end_column_index - 1}: {e}")
 
+def ensure_client_file(client_code):
+    """Возвращает spreadsheetId файла клиента, создавая файл, если его ещё нет."""
+    spreadsheet_id = find_client_file_id(client_code)
+    if not spreadsheet_id:
+        from clientdata import verify_client_code
+        client_data = verify_client_code(client_code)
+        if not client_data:
+            raise Exception(f"Данные клиента {client_code} не найдены.")
+        spreadsheet_id = create_client_file(client_code, client_data)
+    return spreadsheet_id
+
+def call_with_client_file(client_code, operation, create=True):
+    """
+    Выполняет operation(spreadsheet_id) с файлом клиента и возвращает её результат.
+    Если Sheets отвечает 404 (файл удалён или в корзине), запись удаляется из локального
+    индекса, файл ищется (или создаётся) заново и вызов повторяется один раз.
+    При create=False и отсутствии файла возвращает None, не вызывая operation.
+    """
+    locate = ensure_client_file if create else find_client_file_id
+    spreadsheet_id = locate(client_code)
+    if not spreadsheet_id:
+        return None
+    try:
+        return operation(spreadsheet_id)
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+        logger.warning(f"Файл клиента {client_code} ({spreadsheet_id}) не найден в Google Sheets, ищем заново.")
+        client_index.forget(client_code)
+        spreadsheet_id = locate(client_code)
+        if not spreadsheet_id:
+            return None
+        return operation(spreadsheet_id)
+
+def format_conversation_row(user_message, assistant_message, timestamp):
+    """Строка переписки: вопрос клиента в столбце A, ответ ассистента в столбце B."""
+    row = [f"{timestamp} - {user_message}", f"{timestamp} - {assistant_message}"]
+    while len(row) < 7:
+        row.append("")
+    return row
+
+def append_conversation_rows(spreadsheet_id, rows):
+    """Добавляет в файл клиента сразу несколько строк переписки одним запросом append."""
+    sheets_service = get_sheets_service()
+    sheets_service.spreadsheets().values().append(
+        spreadsheetId=spreadsheet_id,
+        range="Sheet1!A:G",
+        valueInputOption="RAW",
+        insertDataOption="INSERT_ROWS",
+        body={"values": rows}
+    ).execute()
+
 def add_message_to_client_file(client_code, message, is_assistant=False):
     """
     Добавляет новое сообщение в Google Sheets файл клиента Client_{client_code}.xlsx.
@@ -239,23 +337,14 @@ def add_message_to_client_file(client_code, message, is_assistant=False):
     чтобы найти последнюю строку, в которой записан вопрос без ответа, и затем
     обновляется ячейка столбца B именно в этой строке.
     """
-    try:
+    current_time = datetime.now().strftime("%d.%m.%y %H:%M")
+
+    def write(spreadsheet_id):
         sheets_service = get_sheets_service()
-        spreadsheet_id = find_client_file_id(client_code)
-        if not spreadsheet_id:
-            from clientdata import verify_client_code
-            client_data = verify_client_code(client_code)
-            if not client_data:
-                raise Exception(f"Данные клиента {client_code} не найдены.")
-            spreadsheet_id = create_client_file(client_code, client_data)
-        
         # Убираем установку ширины столбцов и настройки переноса текста
         # set_column_width(spreadsheet_id, 0, 650)
         # set_column_width(spreadsheet_id, 1, 650)
         # set_text_wrap(spreadsheet_id, 0, 2)
-        
-        current_time = datetime.now().strftime("%d.%m.%y %H:%M")
-        
         if not is_assistant:
             # Добавляем новую строку: в столбце A записываем вопрос, в столбце B оставляем пустым.
             new_row = [f"{current_time} - {message}", ""]
@@ -298,6 +387,9 @@ def add_message_to_client_file(client_code, message, is_assistant=False):
                 logger.info(f"Ответ ассистента обновлен в строке {target_row} файла клиента {client_code}.")
             else:
                 logger.error("Не найдена строка с вопросом без ответа для обновления.")
+
+    try:
+        call_with_client_file(client_code, write)
     except Exception as e:
         logger.error(f"Ошибка при добавлении сообщения в файл клиента {client_code}: {e}")
         send_notification(f"Ошибка при добавлении сообщения в файл клиента {client_code}: {e}")
@@ -306,17 +398,16 @@ def add_message_to_client_file(client_code, message, is_assistant=False):
 def handle_client(client_code):
     try:
         logger.info(f"Обработка клиента с кодом: {client_code}")
-        from clientdata import load_client_data as load_cd
-        df = load_cd()
-        client_data = df[df["Client Code"] == client_code]
-        if client_data.empty:
+        from clientdata import verify_client_code
+        client_data = verify_client_code(client_code)
+        if not client_data:
             logger.warning(f"Клиент с кодом {client_code} не найден в ClientData.xlsx.")
             send_notification(f"Клиент с кодом {client_code} не найден в ClientData.xlsx.")
         else:
             spreadsheet_id = find_client_file_id(client_code)
             if not spreadsheet_id:
                 logger.info(f"Файл для клиента {client_code} не найден на Google Drive. Создаем новый файл.")
-                spreadsheet_id = create_client_file(client_code, client_data.iloc[0].to_dict())
+                spreadsheet_id = create_client_file(client_code, client_data)
             else:
                 logger.info(f"Файл для клиента {client_code} найден на Google Drive.")
     except Exception as e:
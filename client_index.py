@@ -0,0 +1,115 @@
+import os
+import re
+import time
+import logging
+from local_db import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# Полный листинг папки клиентов на Google Drive повторяется не чаще раза за это время (с),
+# сколько бы воркеров ни запускалось и ни перезапускалось.
+CLIENT_INDEX_WARM_INTERVAL = float(os.getenv("CLIENT_INDEX_WARM_INTERVAL", "21600"))
+# Сколько секунд другие процессы ждут завершения начатого листинга, прежде чем начать свой.
+CLIENT_INDEX_WARM_LEASE = float(os.getenv("CLIENT_INDEX_WARM_LEASE", "600"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS client_files (
+    client_code TEXT PRIMARY KEY,
+    spreadsheet_id TEXT NOT NULL,
+    file_name TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS client_index_warm_up (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    warmed_at REAL NOT NULL,
+    claimed_at REAL NOT NULL
+);
+"""
+
+CLIENT_FILE_NAME_RE = re.compile(r"^Client_(.+?)(?:\.xlsx)?$")
+
+def _conn():
+    return ensure_schema("client_index", _SCHEMA)
+
+def client_code_from_file_name(file_name):
+    """Извлекает код клиента из имени файла вида Client_{client_code}.xlsx (или None)."""
+    match = CLIENT_FILE_NAME_RE.match(file_name or "")
+    return match.group(1) if match else None
+
+def get_spreadsheet_id(client_code):
+    """Возвращает spreadsheetId файла клиента из локального индекса или None."""
+    row = _conn().execute(
+        "SELECT spreadsheet_id FROM client_files WHERE client_code = ?", (str(client_code),)
+    ).fetchone()
+    return row[0] if row else None
+
+def remember(client_code, spreadsheet_id, file_name=None):
+    """Сохраняет в индексе соответствие кода клиента и spreadsheetId."""
+    _conn().execute(
+        "INSERT OR REPLACE INTO client_files (client_code, spreadsheet_id, file_name, updated_at) VALUES (?, ?, ?, ?)",
+        (str(client_code), spreadsheet_id, file_name, time.time())
+    )
+
+def remember_many(files):
+    """
+    Массово заполняет индекс по списку файлов Drive ({"id": ..., "name": ...}).
+    Файлы, имя которых не соответствует шаблону Client_{client_code}, пропускаются.
+    Возвращает количество проиндексированных файлов.
+    """
+    now = time.time()
+    rows = []
+    for f in files:
+        client_code = client_code_from_file_name(f.get("name"))
+        if client_code:
+            rows.append((client_code, f["id"], f.get("name"), now))
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Существующие записи не перезаписываем: в индексе уже может быть файл, найденный точным поиском.
+        conn.executemany(
+            "INSERT OR IGNORE INTO client_files (client_code, spreadsheet_id, file_name, updated_at) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return len(rows)
+
+def forget(client_code):
+    """Удаляет запись клиента из индекса (например, если файл был удалён с Drive)."""
+    _conn().execute("DELETE FROM client_files WHERE client_code = ?", (str(client_code),))
+
+def count():
+    return _conn().execute("SELECT COUNT(*) FROM client_files").fetchone()[0]
+
+def claim_warm_up():
+    """
+    Решает, нужен ли полный листинг папки клиентов: True получает только один процесс, и только если
+    индекс не прогревался CLIENT_INDEX_WARM_INTERVAL секунд и листинг не выполняется другим процессом.
+    Получивший True должен вызвать finish_warm_up.
+    """
+    now = time.time()
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT warmed_at, claimed_at FROM client_index_warm_up WHERE id = 1").fetchone()
+        warmed_at, claimed_at = row or (0.0, 0.0)
+        claimed = now - warmed_at >= CLIENT_INDEX_WARM_INTERVAL and now - claimed_at >= CLIENT_INDEX_WARM_LEASE
+        if claimed:
+            conn.execute(
+                "INSERT OR REPLACE INTO client_index_warm_up (id, warmed_at, claimed_at) VALUES (1, ?, ?)",
+                (warmed_at, now)
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return claimed
+
+def finish_warm_up(success):
+    """Снимает отметку о выполняемом листинге; при успехе запоминает время прогрева."""
+    if success:
+        _conn().execute("UPDATE client_index_warm_up SET warmed_at = ?, claimed_at = 0 WHERE id = 1", (time.time(),))
+    else:
+        _conn().execute("UPDATE client_index_warm_up SET claimed_at = 0 WHERE id = 1")
@@ -0,0 +1,206 @@
+import os
+import sys
+import time
+import logging
+import threading
+import pandas as pd
+from config import CLIENT_DATA_PATH
+from local_db import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в секундах) локальное зеркало выгружается в ClientData.xlsx, если в нём были изменения
+# (0 – только по запросу, см. export_xlsx).
+CLIENT_MIRROR_EXPORT_INTERVAL = float(os.getenv("CLIENT_MIRROR_EXPORT_INTERVAL", "3600"))
+
+# Столбцы ClientData.xlsx и соответствующие им столбцы таблицы client_mirror_rows.
+MIRROR_COLUMNS = (
+    ("Client Code", "client_code"),
+    ("Name", "name"),
+    ("Phone", "phone"),
+    ("Email", "email"),
+    ("Created Date", "created_date"),
+    ("Last Visit", "last_visit"),
+    ("Activity Status", "activity_status"),
+)
+
+# Строки зеркала соответствуют строкам листа Google Sheets (sheet_row): у клиента, сменившего
+# email или телефон, в листе несколько строк с одним кодом, и в ClientData.xlsx они сохраняются все.
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS client_mirror_rows (
+    sheet_row INTEGER PRIMARY KEY,
+    client_code TEXT NOT NULL,
+    name TEXT,
+    phone TEXT,
+    email TEXT,
+    created_date TEXT,
+    last_visit TEXT,
+    activity_status TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS client_mirror_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    deleted_at REAL NOT NULL
+);
+"""
+
+_DB_COLUMNS = [db_column for _, db_column in MIRROR_COLUMNS]
+_UPSERT_SQL = (
+    f"INSERT INTO client_mirror_rows (sheet_row, {', '.join(_DB_COLUMNS)}, updated_at) "
+    f"VALUES (?, {', '.join('?' for _ in _DB_COLUMNS)}, ?) "
+    f"ON CONFLICT(sheet_row) DO UPDATE SET "
+    + ", ".join(f"{column} = excluded.{column}" for column in _DB_COLUMNS + ["updated_at"])
+    # Неизменившиеся записи не трогаем, чтобы полная синхронизация с Google Sheets не помечала зеркало изменённым.
+    + " WHERE " + " OR ".join(f"{column} IS NOT excluded.{column}" for column in _DB_COLUMNS)
+)
+
+_exporter_lock = threading.Lock()
+_exporter = {"pid": None, "thread": None}
+_stats_lock = threading.Lock()
+_stats = {"upserts": 0, "full_syncs": 0, "exports": 0, "last_export_rows": None}
+
+def _conn():
+    return ensure_schema("client_mirror", _SCHEMA)
+
+def _write(statements):
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for sql, params in statements:
+            if isinstance(params, list):
+                conn.executemany(sql, params)
+            else:
+                conn.execute(sql, params)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def _rows(records, now):
+    return [
+        (int(record["_row"]),) + tuple(str(record.get(column, "") or "") for column, _ in MIRROR_COLUMNS) + (now,)
+        for record in records
+        if record.get("_row") is not None
+    ]
+
+def upsert_clients(records):
+    """
+    Записывает (или обновляет по номеру строки листа) записи в локальное зеркало ClientData.
+    records – словари со столбцами ClientData.xlsx и номером строки '_row'; записи без номера
+    строки пропускаются (их добавит следующая полная синхронизация). Каждая запись – O(1).
+    """
+    rows = _rows(records, time.time())
+    if not rows:
+        return
+    _write([(_UPSERT_SQL, rows)])
+    with _stats_lock:
+        _stats["upserts"] += len(rows)
+    start_mirror_exporter()
+
+def sync_clients(records):
+    """
+    Полная синхронизация с листом Google Sheets: все строки листа (с '_row') записываются
+    в зеркало, а строки за концом листа удаляются. Вызывается только из фоновых загрузок реестра.
+    """
+    now = time.time()
+    rows = _rows(records, now)
+    last_row = max((row[0] for row in rows), default=1)
+    _write([
+        (_UPSERT_SQL, rows),
+        ("DELETE FROM client_mirror_rows WHERE sheet_row > ?", (last_row,)),
+        # Удалённые строки не оставляют updated_at, поэтому время удаления запоминается отдельно (см. is_dirty).
+        ("INSERT OR REPLACE INTO client_mirror_meta (id, deleted_at) SELECT 1, ? WHERE changes() > 0", (now,)),
+    ])
+    with _stats_lock:
+        _stats["upserts"] += len(rows)
+        _stats["full_syncs"] += 1
+    start_mirror_exporter()
+
+def set_last_visits(visits):
+    """Обновляет Last Visit в зеркале; visits – словарь {номер строки листа: дата/время}."""
+    now = time.time()
+    _write([(
+        "UPDATE client_mirror_rows SET last_visit = ?, updated_at = ? WHERE sheet_row = ?",
+        [(last_visit, now, int(row)) for row, last_visit in visits.items()]
+    )])
+    start_mirror_exporter()
+
+def load_clients():
+    """Возвращает содержимое зеркала в виде DataFrame со столбцами ClientData.xlsx."""
+    rows = _conn().execute(
+        f"SELECT {', '.join(_DB_COLUMNS)} FROM client_mirror_rows ORDER BY sheet_row"
+    ).fetchall()
+    return pd.DataFrame(rows, columns=[column for column, _ in MIRROR_COLUMNS])
+
+def export_xlsx(path=CLIENT_DATA_PATH):
+    """
+    Выгружает зеркало в xlsx. Файл сначала пишется во временный, а затем атомарно заменяет
+    прежний, поэтому читатели никогда не видят недописанный файл. Возвращает число строк.
+    """
+    df = load_clients()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.xlsx"
+    try:
+        df.to_excel(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    with _stats_lock:
+        _stats["exports"] += 1
+        _stats["last_export_rows"] = len(df)
+    logger.info(f"Зеркало клиентов выгружено в {path}: {len(df)} строк.")
+    return len(df)
+
+def is_dirty(path=CLIENT_DATA_PATH):
+    """Есть ли в зеркале изменения (в том числе удалённые строки), которых ещё нет в xlsx-файле."""
+    last_update = _conn().execute(
+        "SELECT MAX(changed_at) FROM ("
+        "SELECT MAX(updated_at) AS changed_at FROM client_mirror_rows "
+        "UNION ALL SELECT deleted_at FROM client_mirror_meta)"
+    ).fetchone()[0]
+    if last_update is None:
+        return False
+    return not os.path.exists(path) or last_update > os.path.getmtime(path)
+
+def compact():
+    """Переносит WAL в основной файл базы и усекает его."""
+    _conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+def _run_exporter():
+    while True:
+        time.sleep(CLIENT_MIRROR_EXPORT_INTERVAL)
+        try:
+            if is_dirty():
+                export_xlsx()
+                compact()
+        except Exception as e:
+            logger.error(f"Ошибка выгрузки зеркала клиентов: {e}")
+
+def start_mirror_exporter():
+    """Запускает периодическую выгрузку зеркала в текущем процессе (один раз; после fork – заново)."""
+    if CLIENT_MIRROR_EXPORT_INTERVAL <= 0 or _exporter["pid"] == os.getpid():
+        return
+    with _exporter_lock:
+        if _exporter["pid"] == os.getpid():
+            return
+        thread = threading.Thread(target=_run_exporter, name="client-mirror-export", daemon=True)
+        thread.start()
+        _exporter["thread"] = thread
+        _exporter["pid"] = os.getpid()
+
+def get_mirror_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["rows"] = _conn().execute("SELECT COUNT(*) FROM client_mirror_rows").fetchone()[0]
+    stats["dirty"] = is_dirty()
+    stats["export_interval_seconds"] = CLIENT_MIRROR_EXPORT_INTERVAL
+    return stats
+
+if __name__ == "__main__":
+    # Выгрузка по запросу: python client_mirror.py [путь к xlsx]
+    from logging_setup import setup_logging
+    setup_logging()
+    print(export_xlsx(sys.argv[1] if len(sys.argv) > 1 else CLIENT_DATA_PATH))
@@ -1,19 +1,16 @@
 import os
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+import re
+import time
+import atexit
+import threading
+import google_clients
+import client_mirror
 import pandas as pd
 from datetime import datetime, timedelta
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from config import CLIENT_DATA_PATH, CLIENT_FILES_DIR  # Импортируем константы из config.py
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("app.log"),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
 # Если директория для CLIENT_DATA_PATH не существует, создаём её
@@ -25,92 +22,339 @@ SPREADSHEET_ID = "1eGpB0hiRxXPpYN75-UKyXoar7yh-zne8r8ox-hXrS1I"
 
 def get_sheets_service():
     try:
-        credentials = Credentials.from_service_account_file(os.getenv("GOOGLE_APPLICATION_CREDENTIALS"))
-        return build('sheets', 'v4', credentials=credentials)
+        return google_clients.get_sheets_service()
     except Exception as e:
         logger.error(f"Ошибка инициализации Google Sheets API: {e}")
         return None
 
-def load_client_data():
-    try:
+CLIENT_COLUMNS = ["Client Code", "Name", "Phone", "Email", "Created Date", "Last Visit", "Activity Status"]
+CLIENT_DATA_RANGE = "Sheet1!A2:G"
+# Как часто (в секундах) реестр клиентов перечитывается из Google Sheets целиком.
+CLIENT_REGISTRY_TTL = float(os.getenv("CLIENT_REGISTRY_TTL", "300"))
+# Не чаще чем раз в столько секунд перечитывать реестр, если клиент не найден
+# (его мог только что зарегистрировать другой воркер).
+CLIENT_REGISTRY_MISS_RELOAD = float(os.getenv("CLIENT_REGISTRY_MISS_RELOAD", "5"))
+# Как часто (в секундах) накопленные отметки Last Visit записываются в Google Sheets.
+LAST_VISIT_FLUSH_INTERVAL = float(os.getenv("LAST_VISIT_FLUSH_INTERVAL", "60"))
+# Сколько файлов клиентов создаётся параллельно при массовой регистрации.
+BULK_FILE_WORKERS = int(os.getenv("BULK_FILE_WORKERS", "8"))
+
+def _row_number_from_range(updated_range):
+    """Возвращает номер строки из диапазона вида 'Sheet1!A12:G12' (или None)."""
+    match = re.search(r"![A-Z]+(\d+)", updated_range or "")
+    return int(match.group(1)) if match else None
+
+class ClientRegistry:
+    """
+    Реестр клиентов в памяти процесса с хэш-индексами по коду, email и телефону.
+    Для каждой записи хранится номер строки в Google Sheets. Реестр загружается один раз
+    (и перечитывается в фоне раз в CLIENT_REGISTRY_TTL), а изменения записываются в Google Sheets
+    и в реестр одновременно (write-through).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._records = []
+        self._by_code = {}
+        self._by_email = {}
+        self._by_phone = {}
+        self._loaded_at = None
+        # Загрузку из Google Sheets одновременно выполняет только один поток (single-flight).
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        self._failed_at = None
+
+    def _index(self, position):
+        record = self._records[position]
+        self._by_code.setdefault(record["Client Code"], position)
+        if record["Email"]:
+            self._by_email.setdefault(record["Email"], position)
+        if record["Phone"]:
+            self._by_phone.setdefault(record["Phone"], position)
+
+    def load(self, sync_mirror=True):
+        """
+        Перечитывает всех клиентов из Google Sheets и перестраивает индексы. При sync_mirror
+        локальное зеркало ClientData синхронизируется со всем листом (O(клиентов) записей в SQLite),
+        поэтому так загружают реестр только фоновые потоки (прогрев, обновление по TTL).
+        """
+        with self._load_lock:
+            self._load_locked(sync_mirror)
+
+    def _load_locked(self, sync_mirror):
         logger.info("Загрузка данных из Google Sheets...")
-        sheets_service = get_sheets_service()
-        if not sheets_service:
-            raise Exception("Google Sheets API не инициализирован.")
-        range_name = "Sheet1!A2:G1000"
-        result = sheets_service.spreadsheets().values().get(
-            spreadsheetId=SPREADSHEET_ID,
-            range=range_name
-        ).execute()
+        try:
+            sheets_service = get_sheets_service()
+            if not sheets_service:
+                raise Exception("Google Sheets API не инициализирован.")
+            result = sheets_service.spreadsheets().values().get(
+                spreadsheetId=SPREADSHEET_ID,
+                range=CLIENT_DATA_RANGE
+            ).execute()
+        except Exception:
+            with self._lock:
+                self._failed_at = time.monotonic()
+            raise
         values = result.get('values', [])
-        if not values:
-            logger.info("Данные не найдены.")
-            return pd.DataFrame(columns=["Client Code", "Name", "Phone", "Email", "Created Date", "Last Visit", "Activity Status"])
-        df = pd.DataFrame(values, columns=["Client Code", "Name", "Phone", "Email", "Created Date", "Last Visit", "Activity Status"])
-        df["Client Code"] = df["Client Code"].astype(str)
-        logger.info(f"Загружены данные: {df}")
-        return df
+        with self._lock:
+            self._records = []
+            self._by_code, self._by_email, self._by_phone = {}, {}, {}
+            for idx, row in enumerate(values):
+                row = list(row) + [""] * (len(CLIENT_COLUMNS) - len(row))
+                record = dict(zip(CLIENT_COLUMNS, row[:len(CLIENT_COLUMNS)]))
+                record["Client Code"] = str(record["Client Code"])
+                record["_row"] = idx + 2  # строка 1 – заголовок
+                self._records.append(record)
+                self._index(len(self._records) - 1)
+            self._loaded_at = time.monotonic()
+            self._failed_at = None
+            records = [dict(record) for record in self._records] if sync_mirror else None
+        logger.info(f"Загружены данные клиентов: {len(values)} строк.")
+        if records is not None:
+            try:
+                client_mirror.sync_clients(records)
+            except Exception as e:
+                logger.error(f"Ошибка обновления локального зеркала клиентов: {e}")
+
+    def _refresh_in_background(self):
+        try:
+            self.load()
+        except Exception as e:
+            logger.error(f"Ошибка фонового обновления реестра клиентов: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _ensure_loaded(self, missed=False):
+        """
+        Загружает реестр при первом обращении. Устаревший (старше CLIENT_REGISTRY_TTL) реестр
+        продолжает использоваться, пока его перечитывает фоновый поток. Если клиент не найден,
+        реестр перечитывается синхронно, но не чаще раза в CLIENT_REGISTRY_MISS_RELOAD секунд:
+        одновременные промахи ждут одну общую загрузку.
+        """
+        now = time.monotonic()
+        with self._lock:
+            loaded_at = self._loaded_at
+            recently_failed = self._failed_at is not None and now - self._failed_at < CLIENT_REGISTRY_MISS_RELOAD
+            if loaded_at is not None:
+                age = now - loaded_at
+                if not (missed and age >= CLIENT_REGISTRY_MISS_RELOAD and not recently_failed):
+                    if age >= CLIENT_REGISTRY_TTL and not self._refreshing:
+                        self._refreshing = True
+                        threading.Thread(
+                            target=self._refresh_in_background, name="client-registry-refresh", daemon=True
+                        ).start()
+                    return
+            elif recently_failed:
+                raise Exception("Реестр клиентов недоступен: недавняя загрузка из Google Sheets не удалась.")
+        with self._load_lock:
+            with self._lock:
+                if self._loaded_at is not None and (loaded_at is None or self._loaded_at > loaded_at):
+                    # Реестр перечитал другой поток, пока этот ждал блокировку.
+                    return
+            try:
+                # Загрузка на пути запроса: зеркало синхронизирует фоновое обновление (записи,
+                # добавленные другими воркерами, они уже сохранили в зеркале сами).
+                self._load_locked(sync_mirror=False)
+            except Exception as e:
+                logger.error(f"Ошибка загрузки данных: {e}")
+                if loaded_at is None:
+                    raise
+
+    @staticmethod
+    def _public(record):
+        return {column: record[column] for column in CLIENT_COLUMNS}
+
+    def _lookup(self, code=None, email=None, phone=None):
+        with self._lock:
+            positions = []
+            if code is not None and code in self._by_code:
+                positions.append(self._by_code[code])
+            if email and email in self._by_email:
+                positions.append(self._by_email[email])
+            if phone and phone in self._by_phone:
+                positions.append(self._by_phone[phone])
+            return dict(self._records[min(positions)]) if positions else None
+
+    def get(self, code=None, email=None, phone=None, reload_on_miss=True):
+        """
+        Возвращает первую (по порядку строк) запись клиента с указанным кодом, email или телефоном
+        вместе со служебным полем '_row' (номер строки в Google Sheets), либо None.
+        При reload_on_miss=False реестр не перечитывается, если клиент не найден (массовые проверки).
+        """
+        self._ensure_loaded()
+        record = self._lookup(code, email, phone)
+        if record is None and reload_on_miss:
+            self._ensure_loaded(missed=True)
+            record = self._lookup(code, email, phone)
+        return record
+
+    def get_by_code(self, code):
+        record = self.get(code=str(code))
+        return self._public(record) if record else None
+
+    def row_number(self, code):
+        record = self.get(code=str(code))
+        return record["_row"] if record else None
+
+    def has_code(self, code):
+        self._ensure_loaded()
+        with self._lock:
+            return str(code) in self._by_code
+
+    def add(self, record, row_number=None):
+        """Добавляет в реестр запись, только что дописанную в Google Sheets. Возвращает номер её строки."""
+        with self._lock:
+            if self._loaded_at is None:
+                return row_number
+            record = {column: record.get(column, "") for column in CLIENT_COLUMNS}
+            record["Client Code"] = str(record["Client Code"])
+            if row_number is None:
+                row_number = max((r["_row"] for r in self._records), default=1) + 1
+            record["_row"] = row_number
+            self._records.append(record)
+            self._index(len(self._records) - 1)
+            return row_number
+
+    def set_field(self, code, column, value):
+        with self._lock:
+            position = self._by_code.get(str(code))
+            if position is not None:
+                self._records[position][column] = value
+
+    def to_dataframe(self):
+        self._ensure_loaded()
+        with self._lock:
+            rows = [self._public(record) for record in self._records]
+        return pd.DataFrame(rows, columns=CLIENT_COLUMNS)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._records)
+
+registry = ClientRegistry()
+
+def load_client_data():
+    """Возвращает всех клиентов в виде DataFrame (из реестра клиентов, без повторной загрузки)."""
+    try:
+        return registry.to_dataframe()
     except Exception as e:
         logger.error(f"Ошибка загрузки данных: {e}")
-        return pd.DataFrame(columns=["Client Code", "Name", "Phone", "Email", "Created Date", "Last Visit", "Activity Status"])
+        return pd.DataFrame(columns=CLIENT_COLUMNS)
 
-def generate_unique_code():
+def generate_unique_code(reserved=()):
+    """Генерирует код клиента, которого нет ни в реестре, ни среди reserved (коды текущей пачки)."""
     try:
-        existing_codes = set(load_client_data()["Client Code"])
         while True:
             code = f"CAEC{str(datetime.now().timestamp()).replace('.', '')[-7:]}"
-            if code not in existing_codes:
+            if code not in reserved and not registry.has_code(code):
                 return code
     except Exception as e:
         logger.error(f"Ошибка генерации уникального кода: {e}")
         raise
 
+_last_visits_lock = threading.Lock()
+_last_visits = {}
+_last_visit_worker = {"pid": None, "thread": None}
+_last_visit_stats = {"recorded": 0, "flushes": 0, "flushed_clients": 0, "flush_errors": 0}
+
 def update_last_visit(client_code):
     """
-    Обновляет дату/время последнего посещения (Last Visit) в файле ClientData.xlsx (Google Sheets)
-    для клиента с указанным кодом. Клиент ищется в колонке A (начиная со второй строки), а обновление
-    производится в колонке F.
+    Отмечает посещение клиента. Дата/время запоминаются в памяти (и сразу видны в реестре),
+    а в колонку F (Last Visit) файла ClientData.xlsx записываются фоновым потоком раз в
+    LAST_VISIT_FLUSH_INTERVAL секунд – одним batchUpdate для всех клиентов, у которых было
+    посещение; для каждого клиента записывается только последняя отметка за интервал.
+    """
+    client_code = str(client_code).strip()
+    last_visit = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with _last_visits_lock:
+        _last_visits[client_code] = last_visit
+        _last_visit_stats["recorded"] += 1
+    registry.set_field(client_code, "Last Visit", last_visit)
+    start_last_visit_flusher()
+    return True
+
+def flush_last_visits():
     """
+    Записывает накопленные отметки Last Visit в Google Sheets одним запросом values().batchUpdate.
+    Номера строк берутся из реестра клиентов. При ошибке отметки возвращаются в очередь
+    (если за это время не появилась более свежая) и будут записаны при следующей попытке.
+    Возвращает количество обновлённых клиентов.
+    """
+    with _last_visits_lock:
+        if not _last_visits:
+            return 0
+        pending = dict(_last_visits)
+        _last_visits.clear()
+    data = []
+    rows = {}
     try:
+        for client_code, last_visit in pending.items():
+            row_number = registry.row_number(client_code)
+            if row_number is None:
+                logger.warning(f"Клиент с кодом {client_code} не найден для обновления Last Visit.")
+                continue
+            data.append({"range": f"Sheet1!F{row_number}", "values": [[last_visit]]})
+            rows[row_number] = last_visit
+        if not data:
+            return 0
         sheets_service = get_sheets_service()
         if not sheets_service:
             raise Exception("Google Sheets API не инициализирован.")
-        last_visit = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        # Получаем данные из колонки A, начиная со второй строки
-        range_name = "Sheet1!A2:A"
-        result = sheets_service.spreadsheets().values().get(
+        sheets_service.spreadsheets().values().batchUpdate(
             spreadsheetId=SPREADSHEET_ID,
-            range=range_name
+            body={"valueInputOption": "USER_ENTERED", "data": data}
         ).execute()
-        values = result.get("values", [])
-        row_number = None
-        client_code = str(client_code).strip()
-        for idx, row in enumerate(values):
-            if row and row[0].strip() == client_code:
-                row_number = idx + 2  # строка 1 – заголовок, затем начинается индексирование
-                break
-        if row_number is None:
-            logger.warning(f"Клиент с кодом {client_code} не найден для обновления Last Visit.")
-        else:
-            # Обновляем ячейку в колонке F (Last Visit) соответствующей строки
-            range_update = f"Sheet1!F{row_number}"
-            body = {"values": [[last_visit]]}
-            sheets_service.spreadsheets().values().update(
-                spreadsheetId=SPREADSHEET_ID,
-                range=range_update,
-                valueInputOption="USER_ENTERED",
-                body=body
-            ).execute()
-            logger.info(f"Last Visit обновлён для клиента {client_code} в строке {row_number}: {last_visit}")
-        return True
     except Exception as e:
-        logger.error(f"Ошибка обновления Last Visit для клиента {client_code}: {e}")
+        with _last_visits_lock:
+            for client_code, last_visit in pending.items():
+                _last_visits.setdefault(client_code, last_visit)
+            _last_visit_stats["flush_errors"] += 1
+        logger.error(f"Ошибка обновления Last Visit для {len(pending)} клиентов: {e}")
         try:
             from client_caec import send_notification
-            send_notification(f"Ошибка обновления Last Visit для клиента {client_code}: {e}")
+            send_notification(f"Ошибка обновления Last Visit для {len(pending)} клиентов: {e}")
         except Exception as ex:
             logger.error(f"Ошибка отправки уведомления об обновлении Last Visit: {ex}")
-        return False
+        return 0
+    try:
+        client_mirror.set_last_visits(rows)
+    except Exception as e:
+        logger.error(f"Ошибка обновления Last Visit в локальном зеркале клиентов: {e}")
+    with _last_visits_lock:
+        _last_visit_stats["flushes"] += 1
+        _last_visit_stats["flushed_clients"] += len(data)
+    logger.info(f"Last Visit обновлён для {len(data)} клиентов.")
+    return len(data)
+
+def _run_last_visit_flusher():
+    while True:
+        time.sleep(LAST_VISIT_FLUSH_INTERVAL)
+        try:
+            flush_last_visits()
+        except Exception as e:
+            logger.error(f"Ошибка фоновой записи Last Visit: {e}")
+
+def start_last_visit_flusher():
+    """Запускает фоновую запись Last Visit в текущем процессе (один раз; после fork – заново)."""
+    if _last_visit_worker["pid"] == os.getpid():
+        return
+    with _last_visits_lock:
+        if _last_visit_worker["pid"] == os.getpid():
+            return
+        thread = threading.Thread(target=_run_last_visit_flusher, name="last-visit-flusher", daemon=True)
+        thread.start()
+        _last_visit_worker["thread"] = thread
+        _last_visit_worker["pid"] = os.getpid()
+    # Отметки, накопленные с последней записи, сохраняются и при остановке процесса.
+    atexit.register(flush_last_visits)
+
+def get_last_visit_stats():
+    with _last_visits_lock:
+        stats = dict(_last_visit_stats)
+        stats["pending"] = len(_last_visits)
+    stats["flush_interval_seconds"] = LAST_VISIT_FLUSH_INTERVAL
+    return stats
 
 def save_client_data(client_code, name, phone, email, created_date, last_visit, activity_status):
     try:
@@ -120,7 +364,7 @@ def save_client_data(client_code, name, phone, email, created_date, last_visit,
             raise Exception("Google Sheets API не инициализирован.")
         values = [[str(client_code), name, phone, email, created_date, last_visit, activity_status]]
         body = {'values': values}
-        logger.info(f"Отправка данных в Google Sheets: {values}")
+        logger.info(f"Отправка данных клиента {client_code} в Google Sheets.")
         response = sheets_service.spreadsheets().values().append(
             spreadsheetId=SPREADSHEET_ID,
             range="Sheet1!A2:G2",
@@ -131,23 +375,22 @@ def save_client_data(client_code, name, phone, email, created_date, last_visit,
     except Exception as e:
         logger.error(f"Ошибка записи в Google Sheets: {e}")
         raise
+    record = {
+        "Client Code": str(client_code),
+        "Name": name,
+        "Phone": phone,
+        "Email": email,
+        "Created Date": created_date,
+        "Last Visit": last_visit,
+        "Activity Status": activity_status
+    }
+    row_number = registry.add(record, _row_number_from_range(response.get("updates", {}).get("updatedRange")))
 
     try:
-        df = load_client_data()
-        new_data = pd.DataFrame([{
-            "Client Code": str(client_code),
-            "Name": name,
-            "Phone": phone,
-            "Email": email,
-            "Created Date": created_date,
-            "Last Visit": last_visit,
-            "Activity Status": activity_status
-        }])
-        df = pd.concat([df, new_data], ignore_index=True)
-        df.astype(str).to_excel(CLIENT_DATA_PATH, index=False)
-        logger.info(f"Данные сохранены в ClientData.xlsx: {client_code}, {name}, {phone}, {email}")
+        client_mirror.upsert_clients([dict(record, _row=row_number)])
+        logger.info(f"Данные клиента {client_code} сохранены в локальное зеркало ClientData.")
     except Exception as e:
-        logger.error(f"Ошибка сохранения в локальный файл: {e}")
+        logger.error(f"Ошибка сохранения в локальное зеркало клиентов: {e}")
 
 # Функция update_activity_status теперь отключена для избежания перебора всех клиентов.
 def update_activity_status():
@@ -156,17 +399,16 @@ def update_activity_status():
 
 def register_or_update_client(data):
     try:
-        df = load_client_data()
         email = data.get("email")
         phone = data.get("phone")
         name = data.get("name", "Unknown")
-        existing_client = df[(df["Email"] == email) | (df["Phone"] == phone)]
-        if not existing_client.empty:
-            client_code = existing_client.iloc[0]["Client Code"]
-            created_date = existing_client.iloc[0]["Created Date"]
+        existing_client = registry.get(email=email, phone=phone)
+        if existing_client:
+            client_code = existing_client["Client Code"]
+            created_date = existing_client["Created Date"]
             last_visit = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             activity_status = "Active"
-            if email != existing_client.iloc[0]["Email"] or phone != existing_client.iloc[0]["Phone"]:
+            if email != existing_client["Email"] or phone != existing_client["Phone"]:
                 save_client_data(
                     client_code=client_code,
                     name=name,
@@ -178,8 +420,6 @@ def register_or_update_client(data):
                 )
             else:
                 update_last_visit(client_code)
-                df.loc[df["Client Code"] == str(client_code), "Last Visit"] = last_visit
-                df.astype(str).to_excel(CLIENT_DATA_PATH, index=False)
             try:
                 from client_caec import handle_client
                 handle_client(client_code)
@@ -225,14 +465,94 @@ def register_or_update_client(data):
         logger.error(f"Ошибка при регистрации/обновлении клиента: {e}")
         raise
 
+def _create_client_files(records, max_workers):
+    """Параллельно (не более max_workers одновременно) создаёт файлы переписки новых клиентов."""
+    from client_caec import create_client_file, send_notification
+
+    def create(record):
+        try:
+            create_client_file(record["Client Code"], record)
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка создания файла клиента {record['Client Code']}: {e}")
+            return record["Client Code"]
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="client-files") as executor:
+        failed = [code for code in executor.map(create, records) if code]
+    if failed:
+        send_notification(f"Не удалось создать файлы для {len(failed)} клиентов: {', '.join(failed[:20])}")
+    return {"created": len(records) - len(failed), "failed": failed}
+
+def register_clients_bulk(clients, create_files=True, max_workers=BULK_FILE_WORKERS):
+    """
+    Массовая регистрация клиентов. clients – список словарей с ключами name, email, phone.
+    Клиенты, уже известные по email или телефону (в реестре или выше в той же пачке), не добавляются.
+    Все новые клиенты записываются в Google Sheets одним запросом append, локальный ClientData.xlsx
+    одной транзакцией в локальном зеркале, а файлы переписки создаются параллельно.
+    Возвращает {"created": [...], "existing": [...], "skipped": [...], "files": {...}}.
+    """
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    registry.load(sync_mirror=False)
+    created, existing, skipped = [], [], []
+    new_records = []
+    batch_by_email, batch_by_phone, reserved_codes = {}, {}, set()
+    for position, item in enumerate(clients):
+        email = str(item.get("email") or "").strip()
+        phone = str(item.get("phone") or "").strip()
+        name = str(item.get("name") or "").strip() or "Unknown"
+        if not email and not phone:
+            skipped.append({"index": position, "reason": "Не указаны email и телефон."})
+            continue
+        known = registry.get(email=email or None, phone=phone or None, reload_on_miss=False)
+        if known is None:
+            known = batch_by_email.get(email) or batch_by_phone.get(phone)
+        if known is not None:
+            existing.append({"index": position, "uniqueCode": known["Client Code"], "email": email, "phone": phone})
+            continue
+        client_code = generate_unique_code(reserved_codes)
+        reserved_codes.add(client_code)
+        record = {
+            "Client Code": client_code,
+            "Name": name,
+            "Phone": phone,
+            "Email": email,
+            "Created Date": now,
+            "Last Visit": now,
+            "Activity Status": "Active"
+        }
+        new_records.append(record)
+        if email:
+            batch_by_email.setdefault(email, record)
+        if phone:
+            batch_by_phone.setdefault(phone, record)
+        created.append({"index": position, "uniqueCode": client_code, "name": name, "email": email, "phone": phone})
+
+    files = {"created": 0, "failed": []}
+    if new_records:
+        sheets_service = get_sheets_service()
+        if not sheets_service:
+            raise Exception("Google Sheets API не инициализирован.")
+        response = sheets_service.spreadsheets().values().append(
+            spreadsheetId=SPREADSHEET_ID,
+            range="Sheet1!A2:G2",
+            valueInputOption="RAW",
+            body={"values": [[record[column] for column in CLIENT_COLUMNS] for record in new_records]}
+        ).execute()
+        first_row = _row_number_from_range(response.get("updates", {}).get("updatedRange"))
+        for offset, record in enumerate(new_records):
+            record["_row"] = registry.add(record, first_row + offset if first_row is not None else None)
+        logger.info(f"Массовая регистрация: добавлено {len(new_records)} клиентов одним запросом.")
+        try:
+            client_mirror.upsert_clients(new_records)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения в локальное зеркало клиентов: {e}")
+        if create_files:
+            files = _create_client_files(new_records, max_workers)
+    return {"created": created, "existing": existing, "skipped": skipped, "files": files}
+
 def verify_client_code(code):
     try:
-        df = load_client_data()
-        code = str(code)
-        client_data = df[df["Client Code"] == code]
-        if not client_data.empty:
-            return client_data.iloc[0].to_dict()
-        return None
+        return registry.get_by_code(str(code))
     except Exception as e:
         logger.error(f"Ошибка при верификации кода клиента: {e}")
         return None
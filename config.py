@@ -1,3 +1,5 @@
 # config.py
 CLIENT_DATA_PATH = "./CAEC_API_Data/BIG_DATA/ClientData.xlsx"
 CLIENT_FILES_DIR = "./CAEC_API_Data/BIG_DATA/Data_CAEC_client/"
+# Локальная SQLite-база для индексов, очередей и истории переписки
+LOCAL_DB_PATH = "./CAEC_API_Data/BIG_DATA/caec_local.db"
@@ -0,0 +1,231 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime
+from local_db import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# Как часто (в секундах) фоновый воркер сбрасывает журнал в Google Sheets.
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", "2"))
+# Сколько строк журнала забирать за один проход.
+JOURNAL_BATCH_SIZE = int(os.getenv("JOURNAL_BATCH_SIZE", "500"))
+# Через сколько секунд захваченные, но не записанные строки снова становятся доступны (упал воркер).
+JOURNAL_CLAIM_TIMEOUT = float(os.getenv("JOURNAL_CLAIM_TIMEOUT", "300"))
+# Максимальная пауза между повторными попытками записи для одного клиента.
+JOURNAL_MAX_RETRY_DELAY = float(os.getenv("JOURNAL_MAX_RETRY_DELAY", "300"))
+# После стольких неудачных попыток строки клиента переносятся в conversation_journal_dead
+# и больше не повторяются (например, неизвестный код клиента или удалённый файл).
+JOURNAL_MAX_ATTEMPTS = int(os.getenv("JOURNAL_MAX_ATTEMPTS", "10"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversation_journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_code TEXT NOT NULL,
+    user_message TEXT NOT NULL,
+    assistant_message TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    claimed_at REAL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_conversation_journal_client
+    ON conversation_journal (client_code, id);
+CREATE TABLE IF NOT EXISTS conversation_journal_dead (
+    id INTEGER PRIMARY KEY,
+    client_code TEXT NOT NULL,
+    user_message TEXT NOT NULL,
+    assistant_message TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    dead_at REAL NOT NULL
+);
+"""
+
+_worker_lock = threading.Lock()
+_worker = {"thread": None, "pid": None}
+_wakeup = threading.Event()
+_stats_lock = threading.Lock()
+_stats = {"enqueued": 0, "flushed_rows": 0, "flush_batches": 0, "flush_errors": 0, "dead_lettered_rows": 0}
+
+def _conn():
+    return ensure_schema("conversation_journal", _SCHEMA)
+
+def enqueue_turn(client_code, user_message, assistant_message):
+    """
+    Записывает пару вопрос клиента / ответ ассистента в локальный журнал (одна строка файла клиента).
+    Запись в Google Sheets выполняет фоновый воркер, поэтому вызов не ждёт сетевых запросов.
+    """
+    timestamp = datetime.now().strftime("%d.%m.%y %H:%M")
+    _conn().execute(
+        "INSERT INTO conversation_journal (client_code, user_message, assistant_message, timestamp, enqueued_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (str(client_code), user_message, assistant_message, timestamp, time.time())
+    )
+    with _stats_lock:
+        _stats["enqueued"] += 1
+    start_journal_worker()
+    _wakeup.set()
+
+def _claim_batch(worker_id):
+    """Атомарно захватывает пачку строк журнала для записи текущим воркером."""
+    now = time.time()
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Клиентов, чьи строки ждут повторной попытки или пишутся другим воркером, пропускаем целиком,
+        # чтобы строки каждого клиента попадали в файл в исходном порядке.
+        rows = conn.execute(
+            "SELECT id, client_code, user_message, assistant_message, timestamp, attempts FROM conversation_journal "
+            "WHERE (claimed_at IS NULL OR claimed_at < ?) AND client_code NOT IN ("
+            "    SELECT client_code FROM conversation_journal "
+            "    WHERE next_attempt_at > ? OR (claimed_at IS NOT NULL AND claimed_at >= ?)"
+            ") ORDER BY id LIMIT ?",
+            (now - JOURNAL_CLAIM_TIMEOUT, now, now - JOURNAL_CLAIM_TIMEOUT, JOURNAL_BATCH_SIZE)
+        ).fetchall()
+        if rows:
+            conn.executemany(
+                "UPDATE conversation_journal SET claimed_by = ?, claimed_at = ? WHERE id = ?",
+                [(worker_id, now, row[0]) for row in rows]
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return rows
+
+def flush_journal(worker_id=None):
+    """
+    Записывает накопленные строки журнала в файлы клиентов: один append на каждый spreadsheet.
+    Строки клиента, для которого запись не удалась, остаются в журнале и повторяются позже.
+    Возвращает количество записанных строк.
+    """
+    from client_caec import call_with_client_file, append_conversation_rows, format_conversation_row, send_notification
+    worker_id = worker_id or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    rows = _claim_batch(worker_id)
+    if not rows:
+        return 0
+    by_client = {}
+    for row in rows:
+        by_client.setdefault(row[1], []).append(row)
+
+    conn = _conn()
+    flushed = 0
+    for client_code, client_rows in by_client.items():
+        ids = [(row[0],) for row in client_rows]
+        try:
+            rows_to_append = [format_conversation_row(row[2], row[3], row[4]) for row in client_rows]
+            call_with_client_file(client_code, lambda spreadsheet_id: append_conversation_rows(spreadsheet_id, rows_to_append))
+            conn.executemany("DELETE FROM conversation_journal WHERE id = ?", ids)
+            flushed += len(client_rows)
+            logger.info(f"Переписка клиента {client_code} записана в файл: {len(client_rows)} строк.")
+        except Exception as e:
+            attempts = max(row[5] for row in client_rows) + 1
+            if attempts >= JOURNAL_MAX_ATTEMPTS:
+                _dead_letter(conn, ids, str(e))
+                logger.error(f"Переписка клиента {client_code} не записана после {attempts} попыток и отложена: {e}")
+                with _stats_lock:
+                    _stats["flush_errors"] += 1
+                    _stats["dead_lettered_rows"] += len(ids)
+                send_notification(
+                    f"Переписка клиента {client_code} ({len(ids)} строк) не записана после {attempts} попыток "
+                    f"и больше не повторяется: {e}"
+                )
+                continue
+            delay = min(JOURNAL_MAX_RETRY_DELAY, JOURNAL_FLUSH_INTERVAL * (2 ** attempts))
+            conn.executemany(
+                "UPDATE conversation_journal SET claimed_by = NULL, claimed_at = NULL, attempts = attempts + 1, "
+                "next_attempt_at = ?, last_error = ? WHERE id = ?",
+                [(time.time() + delay, str(e), row_id) for (row_id,) in ids]
+            )
+            logger.error(f"Ошибка записи переписки клиента {client_code} (попытка {attempts}): {e}")
+            with _stats_lock:
+                _stats["flush_errors"] += 1
+            if attempts == 1:
+                send_notification(f"Ошибка записи переписки клиента {client_code}: {e}")
+    with _stats_lock:
+        _stats["flushed_rows"] += flushed
+        _stats["flush_batches"] += 1
+    return flushed
+
+def _dead_letter(conn, ids, error):
+    """Переносит строки журнала в conversation_journal_dead, чтобы они не блокировали клиента."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(
+            "INSERT OR REPLACE INTO conversation_journal_dead (id, client_code, user_message, assistant_message, "
+            "timestamp, enqueued_at, attempts, last_error, dead_at) "
+            "SELECT id, client_code, user_message, assistant_message, timestamp, enqueued_at, attempts + 1, ?, ? "
+            "FROM conversation_journal WHERE id = ?",
+            [(error, time.time(), row_id) for (row_id,) in ids]
+        )
+        conn.executemany("DELETE FROM conversation_journal WHERE id = ?", ids)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def requeue_dead_letters(client_code=None):
+    """
+    Возвращает отложенные строки (всех клиентов или одного) в журнал для новой попытки записи,
+    например после восстановления файла клиента. Возвращает количество строк.
+    """
+    conn = _conn()
+    where, params = ("WHERE client_code = ?", (str(client_code),)) if client_code is not None else ("", ())
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        moved = conn.execute(
+            "INSERT INTO conversation_journal (id, client_code, user_message, assistant_message, timestamp, enqueued_at) "
+            f"SELECT id, client_code, user_message, assistant_message, timestamp, enqueued_at FROM conversation_journal_dead {where}",
+            params
+        ).rowcount
+        conn.execute(f"DELETE FROM conversation_journal_dead {where}", params)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if moved:
+        start_journal_worker()
+        _wakeup.set()
+    return moved
+
+def _run_worker():
+    worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    while True:
+        _wakeup.wait(JOURNAL_FLUSH_INTERVAL)
+        _wakeup.clear()
+        try:
+            # Небольшая пауза, чтобы собрать в одну пачку сообщения, пришедшие почти одновременно.
+            time.sleep(0.2)
+            while flush_journal(worker_id) >= JOURNAL_BATCH_SIZE:
+                pass
+        except Exception as e:
+            logger.error(f"Ошибка фонового воркера журнала переписки: {e}")
+
+def start_journal_worker():
+    """Запускает фоновый воркер журнала в текущем процессе (один раз; после fork – заново)."""
+    if _worker["pid"] == os.getpid() and _worker["thread"] is not None:
+        return
+    with _worker_lock:
+        if _worker["pid"] == os.getpid() and _worker["thread"] is not None:
+            return
+        thread = threading.Thread(target=_run_worker, name="conversation-journal", daemon=True)
+        thread.start()
+        _worker["thread"] = thread
+        _worker["pid"] = os.getpid()
+        logger.info("Фоновый воркер журнала переписки запущен.")
+
+def get_journal_stats():
+    """Возвращает счётчики журнала и количество строк, ожидающих записи."""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["pending"] = _conn().execute("SELECT COUNT(*) FROM conversation_journal").fetchone()[0]
+    stats["dead_letters"] = _conn().execute("SELECT COUNT(*) FROM conversation_journal_dead").fetchone()[0]
+    return stats
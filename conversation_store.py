@@ -0,0 +1,132 @@
+import os
+import re
+import time
+import logging
+from local_db import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних пар вопрос/ответ максимум попадает в контекст OpenAI.
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "20"))
+# Бюджет токенов на историю переписки в контексте OpenAI (оценка, без токенизатора).
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversation_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    client_code TEXT NOT NULL,
+    position REAL NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_conversation_history_client
+    ON conversation_history (client_code, position);
+CREATE TABLE IF NOT EXISTS conversation_history_clients (
+    client_code TEXT PRIMARY KEY,
+    seeded_at REAL NOT NULL
+);
+"""
+
+TIMESTAMP_PREFIX_RE = re.compile(r'^\d{2}\.\d{2}\.\d{2}\s+\d{2}:\d{2}\s*-\s*')
+
+def _conn():
+    return ensure_schema("conversation_store", _SCHEMA)
+
+def estimate_tokens(text):
+    """Грубая оценка числа токенов: ~3 символа на токен для смешанного русского/английского текста."""
+    return len(text) // 3 + 4
+
+def _is_seeded(client_code):
+    row = _conn().execute(
+        "SELECT 1 FROM conversation_history_clients WHERE client_code = ?", (client_code,)
+    ).fetchone()
+    return row is not None
+
+def _load_history_from_sheet(client_code):
+    """Читает переписку клиента из его Google Sheets файла (строки с 3-й, столбцы A:B)."""
+    from client_caec import call_with_client_file, get_sheets_service
+    result = call_with_client_file(
+        client_code,
+        lambda spreadsheet_id: get_sheets_service().spreadsheets().values().get(
+            spreadsheetId=spreadsheet_id,
+            range="Sheet1!A:B"
+        ).execute(),
+        create=False
+    )
+    if result is None:
+        return []
+    messages = []
+    for row in result.get("values", [])[2:]:
+        if len(row) >= 1 and row[0].strip():
+            messages.append(("user", TIMESTAMP_PREFIX_RE.sub("", row[0].strip())))
+        if len(row) >= 2 and row[1].strip():
+            messages.append(("assistant", TIMESTAMP_PREFIX_RE.sub("", row[1].strip())))
+    return messages
+
+def ensure_seeded(client_code):
+    """
+    Один раз для каждого клиента переносит историю из его файла Google Sheets в локальное хранилище.
+    Перенесённые сообщения получают позиции меньше любых новых, поэтому порядок не нарушается.
+    """
+    client_code = str(client_code)
+    if _is_seeded(client_code):
+        return
+    messages = _load_history_from_sheet(client_code)
+    conn = _conn()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute(
+            "SELECT 1 FROM conversation_history_clients WHERE client_code = ?", (client_code,)
+        ).fetchone() is None:
+            conn.executemany(
+                "INSERT INTO conversation_history (client_code, position, role, content) VALUES (?, ?, ?, ?)",
+                [(client_code, float(i), role, content) for i, (role, content) in enumerate(messages)]
+            )
+            conn.execute(
+                "INSERT INTO conversation_history_clients (client_code, seeded_at) VALUES (?, ?)",
+                (client_code, time.time())
+            )
+            logger.info(f"История клиента {client_code} перенесена в локальное хранилище: {len(messages)} сообщений.")
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+def append_turn(client_code, user_message, assistant_message):
+    """Добавляет пару вопрос/ответ в конец локальной истории клиента."""
+    client_code = str(client_code)
+    ensure_seeded(client_code)
+    position = time.time()
+    _conn().executemany(
+        "INSERT INTO conversation_history (client_code, position, role, content) VALUES (?, ?, ?, ?)",
+        [
+            (client_code, position, "user", user_message),
+            (client_code, position + 1e-6, "assistant", assistant_message),
+        ]
+    )
+
+def get_context_messages(client_code, max_turns=HISTORY_MAX_TURNS, token_budget=HISTORY_TOKEN_BUDGET):
+    """
+    Возвращает последние сообщения клиента в формате OpenAI ({"role": ..., "content": ...}),
+    не больше max_turns пар и не больше token_budget токенов (самые новые сообщения в приоритете).
+    """
+    client_code = str(client_code)
+    ensure_seeded(client_code)
+    rows = _conn().execute(
+        "SELECT role, content FROM conversation_history WHERE client_code = ? "
+        "ORDER BY position DESC LIMIT ?",
+        (client_code, max_turns * 2)
+    ).fetchall()
+    selected = []
+    used = 0
+    for role, content in rows:
+        cost = estimate_tokens(content)
+        if used + cost > token_budget:
+            break
+        used += cost
+        selected.append({"role": role, "content": content})
+    selected.reverse()
+    # Контекст не должен начинаться с ответа ассистента без вопроса
+    while selected and selected[0]["role"] == "assistant":
+        selected.pop(0)
+    return selected
@@ -0,0 +1,63 @@
+import re
+from collections import defaultdict
+
+WORD_RE = re.compile(r"\w+")
+
+def word_trigrams(text):
+    """Множество триграмм символов текста; каждое слово дополняется пробелами по краям."""
+    grams = set()
+    for word in WORD_RE.findall(text.lower()):
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class TrigramIndex:
+    """
+    Нечёткий поиск по небольшому словарю (например, типам ТС из тарифов) по триграммам символов.
+    У каждой записи может быть несколько форм написания (исходная, лемматизированная и т.п.).
+    Оценка формы – доля её триграмм, найденных в запросе, поэтому длинное сообщение клиента
+    не «размывает» совпадение, как при сравнении строк целиком.
+    """
+
+    def __init__(self, entries):
+        """entries – последовательность пар (ключ, [формы написания])."""
+        self._keys = []
+        self._form_sizes = []
+        self._form_keys = []
+        self._postings = defaultdict(list)
+        for key, forms in entries:
+            self._keys.append(key)
+            for form in dict.fromkeys(f for f in forms if f):
+                grams = word_trigrams(form)
+                if not grams:
+                    continue
+                form_id = len(self._form_sizes)
+                self._form_sizes.append(len(grams))
+                self._form_keys.append(key)
+                for gram in grams:
+                    self._postings[gram].append(form_id)
+
+    def search(self, *texts, limit=5, min_score=0.5):
+        """
+        Возвращает до limit пар (ключ, оценка от 0 до 1), отсортированных по убыванию оценки.
+        Запросом служит объединение триграмм всех переданных текстов.
+        """
+        query = set()
+        for text in texts:
+            if text:
+                query |= word_trigrams(text)
+        shared = defaultdict(int)
+        for gram in query:
+            for form_id in self._postings.get(gram, ()):
+                shared[form_id] += 1
+        best = {}
+        for form_id, count in shared.items():
+            score = count / self._form_sizes[form_id]
+            key = self._form_keys[form_id]
+            if score >= min_score and (key not in best or score > best[key][0]):
+                best[key] = (score, count)
+        ranked = sorted(best.items(), key=lambda item: (-item[1][0], -item[1][1]))
+        return [(key, round(score, 4)) for key, (score, _) in ranked[:limit]]
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,138 @@
+import os
+import json
+import queue
+import logging
+import threading
+import httplib2
+import google_auth_httplib2
+from google.oauth2.service_account import Credentials
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest
+import tracing
+
+logger = logging.getLogger(__name__)
+
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
+# Таймаут одного HTTP-запроса к Google API (в секундах).
+GOOGLE_HTTP_TIMEOUT = float(os.getenv("GOOGLE_HTTP_TIMEOUT", "60"))
+# Сколько keep-alive соединений держать в пуле между запросами.
+GOOGLE_HTTP_POOL_SIZE = int(os.getenv("GOOGLE_HTTP_POOL_SIZE", "16"))
+
+_lock = threading.Lock()
+_credentials = None
+_http = None
+_discovery_docs = {}
+_services = {}
+
+class PooledHttp:
+    """
+    Потокобезопасная замена httplib2.Http для клиентов googleapiclient.
+    Каждый запрос выполняется на свободном AuthorizedHttp из пула; соединения (keep-alive)
+    и общие учётные данные переиспользуются между запросами и потоками.
+    """
+
+    def __init__(self, credentials, pool_size=GOOGLE_HTTP_POOL_SIZE, timeout=GOOGLE_HTTP_TIMEOUT):
+        self.credentials = credentials
+        self._timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._refresh_lock = threading.Lock()
+
+    def _new_http(self):
+        return google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self._timeout))
+
+    def _ensure_token(self):
+        # Обновляем токен под блокировкой, чтобы параллельные запросы не обновляли его одновременно.
+        if not self.credentials.valid:
+            with self._refresh_lock:
+                if not self.credentials.valid:
+                    self.credentials.refresh(google_auth_httplib2.Request(httplib2.Http(timeout=self._timeout)))
+
+    def request(self, *args, **kwargs):
+        self._ensure_token()
+        try:
+            http = self._pool.get_nowait()
+        except queue.Empty:
+            http = self._new_http()
+        try:
+            return http.request(*args, **kwargs)
+        finally:
+            try:
+                self._pool.put_nowait(http)
+            except queue.Full:
+                http.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+class TracedHttpRequest(HttpRequest):
+    """HttpRequest, время выполнения которого учитывается в tracing под именем метода API (methodId)."""
+
+    def execute(self, *args, **kwargs):
+        with tracing.span(self.methodId or "google.request"):
+            return super().execute(*args, **kwargs)
+
+def get_credentials():
+    """Загружает учётные данные сервисного аккаунта один раз на процесс."""
+    global _credentials
+    with _lock:
+        if _credentials is None:
+            _credentials = Credentials.from_service_account_file(
+                os.getenv("GOOGLE_APPLICATION_CREDENTIALS"), scopes=SCOPES
+            )
+        return _credentials
+
+def _get_http():
+    global _http
+    credentials = get_credentials()
+    with _lock:
+        if _http is None:
+            _http = PooledHttp(credentials)
+        return _http
+
+def _get_discovery_doc(api, version):
+    """Возвращает discovery-документ API: из пакета googleapiclient или, если его там нет, из сети (один раз)."""
+    with _lock:
+        doc = _discovery_docs.get((api, version))
+    if doc is None:
+        doc = get_static_doc(api, version)
+        if doc is None:
+            service = build(api, version, credentials=get_credentials(), static_discovery=False)
+            doc = json.dumps(service._rootDesc)
+        with _lock:
+            _discovery_docs[(api, version)] = doc
+    return doc
+
+def get_service(api, version):
+    """
+    Возвращает общий (на процесс) клиент Google API.
+    Клиент строится один раз; безопасен для использования из нескольких потоков.
+    """
+    with _lock:
+        service = _services.get((api, version))
+    if service is None:
+        service = build_from_document(
+            _get_discovery_doc(api, version), http=_get_http(), requestBuilder=TracedHttpRequest
+        )
+        with _lock:
+            service = _services.setdefault((api, version), service)
+        logger.info(f"Клиент Google API {api} {version} инициализирован.")
+    return service
+
+def override_service(api, version, service):
+    """Подменяет клиент Google API в текущем процессе (например, локальной заглушкой в бенчмарках)."""
+    with _lock:
+        _services[(api, version)] = service
+
+def get_sheets_service():
+    return get_service("sheets", "v4")
+
+def get_drive_service():
+    return get_service("drive", "v3")
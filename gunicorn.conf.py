@@ -0,0 +1,56 @@
+# Конфигурация gunicorn для запуска в несколько процессов:
+#     gunicorn -c gunicorn.conf.py server:app
+# Общее состояние (сессии уточняющих вопросов и диалога /bible, журнал и история переписки, индекс файлов клиентов)
+# хранится в локальной SQLite-базе, поэтому воркеры могут обслуживать любого клиента.
+import os
+import multiprocessing
+import requests
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_class = "gthread"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+# Приложение импортируется в каждом воркере отдельно: фоновые потоки и циклы событий
+# создаются уже после fork.
+preload_app = False
+# Каждый воркер пишет в свой файл лога с ротацией (см. logging_setup). "{slot}" – номер места воркера:
+# перезапущенный воркер занимает место умершего и продолжает его файл, поэтому общий объём логов
+# ограничен workers * LOG_MAX_BYTES * (LOG_BACKUP_COUNT + 1), сколько бы раз воркеры ни перезапускались.
+os.environ.setdefault("LOG_FILE", "server.{slot}.log")
+
+def when_ready(server):
+    """Устанавливает webhook Telegram один раз – в мастер-процессе, до запуска воркеров."""
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if not token or not webhook_url:
+        server.log.error("TELEGRAM_BOT_TOKEN или WEBHOOK_URL не заданы – webhook не установлен.")
+        return
+    try:
+        response = requests.post(
+            f"https://api.telegram.org/bot{token}/setWebhook",
+            json={"url": webhook_url},
+            timeout=15
+        )
+        response.raise_for_status()
+        server.log.info(f"Webhook установлен: {webhook_url}")
+    except Exception as e:
+        server.log.error(f"Ошибка установки webhook: {e}")
+
+def pre_fork(server, worker):
+    """Назначает воркеру наименьший свободный номер места (в мастер-процессе, до fork)."""
+    used = {getattr(w, "slot", None) for w in server.WORKERS.values()}
+    worker.slot = next(slot for slot in range(len(used) + 1) if slot not in used)
+
+def post_fork(server, worker):
+    """Передаёт номер места воркера в logging_setup до импорта приложения."""
+    os.environ["LOG_SLOT"] = str(worker.slot)
+
+def post_worker_init(worker):
+    """Прогрев ресурсов и запуск фонового воркера журнала в каждом процессе."""
+    import server as chat_server
+    import startup
+    startup.start_warm_up(chat_server.get_warm_up_tasks())
+    chat_server.start_journal_worker()
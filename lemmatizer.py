@@ -0,0 +1,137 @@
+import os
+import re
+import inspect
+import logging
+import threading
+from functools import lru_cache
+import tracing
+
+# Monkey-patch для pymorphy2: определяем getargspec, возвращающую ровно 4 значения.
+def getargspec(func):
+    fas = inspect.getfullargspec(func)
+    return fas.args, fas.varargs, fas.varkw, fas.defaults
+if not hasattr(inspect, 'getargspec'):
+    inspect.getargspec = getargspec
+
+logger = logging.getLogger(__name__)
+
+# Размер LRU-кэша токен -> лемма.
+LEMMA_CACHE_SIZE = int(os.getenv("LEMMA_CACHE_SIZE", "50000"))
+
+# Слова (в том числе через дефис) и отдельные знаки препинания – как у nltk.word_tokenize.
+TOKEN_RE = re.compile(r"\w+(?:-\w+)*|[^\w\s]")
+
+# Слова из списка стоп-слов NLTK, которые меняют смысл вопроса («можно ли …» / «нельзя ли …»)
+# и поэтому остаются в лемматизированном тексте.
+KEPT_STOP_WORDS = frozenset({"не", "нет", "ни", "нельзя", "можно", "без", "никогда", "ничего"})
+
+# Скачивать ли корпус стоп-слов NLTK, если его нет локально (в Docker-образе он уже есть).
+NLTK_DOWNLOAD = os.getenv("NLTK_DOWNLOAD", "1") == "1"
+
+# pymorphy2 и стоп-слова NLTK загружаются при первом обращении (или при прогреве – см. warm_up),
+# а не при импорте модуля.
+_init_lock = threading.Lock()
+_resources = {"morph": None, "morph_loaded": False, "stop_words": None}
+
+def get_morph():
+    """Возвращает pymorphy2.MorphAnalyzer (или None, если pymorphy2 недоступен)."""
+    if not _resources["morph_loaded"]:
+        with _init_lock:
+            if not _resources["morph_loaded"]:
+                try:
+                    import pymorphy2
+                    _resources["morph"] = pymorphy2.MorphAnalyzer()
+                except Exception as e:
+                    logging.error(f"Ошибка инициализации pymorphy2: {e}")
+                _resources["morph_loaded"] = True
+    return _resources["morph"]
+
+def _load_stop_words():
+    try:
+        import nltk
+        from nltk.corpus import stopwords
+    except ImportError:
+        logging.error("NLTK не установлен. Используется токенизация без стоп-слов.")
+        return frozenset()
+    try:
+        return frozenset(stopwords.words('russian')) - KEPT_STOP_WORDS
+    except LookupError:
+        if not NLTK_DOWNLOAD:
+            logging.error("Корпус стоп-слов NLTK не найден, скачивание отключено (NLTK_DOWNLOAD=0).")
+            return frozenset()
+    try:
+        nltk.download('stopwords', quiet=True)
+        return frozenset(stopwords.words('russian')) - KEPT_STOP_WORDS
+    except Exception as e:
+        logging.error(f"Не удалось загрузить стоп-слова NLTK: {e}")
+        return frozenset()
+
+def get_stop_words():
+    if _resources["stop_words"] is None:
+        with _init_lock:
+            if _resources["stop_words"] is None:
+                _resources["stop_words"] = _load_stop_words()
+    return _resources["stop_words"]
+
+def warm_up():
+    """Загружает pymorphy2 и стоп-слова заранее, чтобы первый запрос не ждал их инициализации."""
+    get_stop_words()
+    get_morph()
+
+_stats_lock = threading.Lock()
+_stats = {"texts": 0, "tokens": 0}
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize_token(token):
+    """Возвращает нормальную форму токена (результат кэшируется)."""
+    return get_morph().parse(token)[0].normal_form
+
+def tokenize(text):
+    """Разбивает текст в нижнем регистре на токены и убирает стоп-слова (кроме KEPT_STOP_WORDS)."""
+    stop_words = get_stop_words()
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in stop_words]
+
+def lemmatize_text(text):
+    """
+    Приводит каждое слово входящего текста к его базовой (лемматизированной) форме.
+    Если pymorphy2 недоступен, текст только приводится к нижнему регистру и разбивается на токены.
+    """
+    with tracing.span("lemmatize"):
+        tokens = tokenize(text)
+        with _stats_lock:
+            _stats["texts"] += 1
+            _stats["tokens"] += len(tokens)
+        if get_morph() is None:
+            return " ".join(tokens)
+        return " ".join(lemmatize_token(token) for token in tokens)
+
+def lemmatize_many(texts):
+    """
+    Лемматизирует сразу много текстов (например, при построении индексов по Bible):
+    каждый уникальный токен разбирается один раз. Возвращает список в том же порядке.
+    """
+    with tracing.span("lemmatize.batch"):
+        tokenized = [tokenize(text) for text in texts]
+        with _stats_lock:
+            _stats["texts"] += len(tokenized)
+            _stats["tokens"] += sum(len(tokens) for tokens in tokenized)
+        if get_morph() is None:
+            return [" ".join(tokens) for tokens in tokenized]
+        lemmas = {token: lemmatize_token(token) for tokens in tokenized for token in tokens}
+        return [" ".join(lemmas[token] for token in tokens) for tokens in tokenized]
+
+def get_lemmatizer_stats():
+    """Возвращает статистику кэша лемм: попадания, промахи, долю попаданий и размер."""
+    info = lemmatize_token.cache_info()
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = info.hits + info.misses
+    stats.update({
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": round(info.hits / lookups, 4) if lookups else None,
+        "size": info.currsize,
+        "maxsize": info.maxsize,
+        "morph_loaded": _resources["morph"] is not None,
+    })
+    return stats
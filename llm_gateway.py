@@ -0,0 +1,326 @@
+import os
+import time
+import queue
+import random
+import asyncio
+import logging
+import threading
+import aiohttp
+import openai
+import tracing
+
+logger = logging.getLogger(__name__)
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+# Сколько запросов к OpenAI может выполняться одновременно (на процесс).
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# Таймаут одной попытки и общий срок на запрос со всеми повторами (в секундах).
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "40"))
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "60"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+# После стольких ошибок подряд запросы к OpenAI приостанавливаются на LLM_CIRCUIT_RESET_TIMEOUT секунд.
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+LLM_CIRCUIT_RESET_TIMEOUT = float(os.getenv("LLM_CIRCUIT_RESET_TIMEOUT", "30"))
+
+# Ошибки, которые не исправятся повтором запроса.
+NON_RETRYABLE_ERRORS = (
+    openai.error.InvalidRequestError,
+    openai.error.AuthenticationError,
+    openai.error.PermissionError,
+)
+
+class CircuitOpenError(Exception):
+    """Запросы к OpenAI временно приостановлены после серии ошибок."""
+
+class DeadlineExceededError(Exception):
+    """Срок на получение ответа от OpenAI истёк."""
+
+class CircuitBreaker:
+    """
+    Простой автомат состояний closed -> open -> half-open.
+    В состоянии open запросы сразу отклоняются; после reset_timeout пропускается одна пробная попытка.
+    """
+
+    def __init__(self, failure_threshold=LLM_CIRCUIT_FAILURE_THRESHOLD, reset_timeout=LLM_CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """
+        Снимает отметку пробной попытки, исход которой неизвестен (запрос отменён: клиент отключился,
+        future отменена). Иначе allow() отклонял бы все запросы до перезапуска процесса.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probe_in_flight or self._failures >= self.failure_threshold:
+                if self._opened_at is None or self._probe_in_flight:
+                    logger.error(f"OpenAI недоступен ({self._failures} ошибок подряд), запросы приостановлены.")
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+class LLMGateway:
+    """
+    Асинхронный шлюз к OpenAI. Работает на собственном цикле событий в фоновом потоке:
+    ограничивает число одновременных запросов семафором, повторяет неудачные попытки с
+    экспоненциальной задержкой и случайным разбросом (jitter), соблюдает общий срок запроса
+    и отклоняет запросы сразу, пока открыт circuit breaker.
+    Адрес API задаётся стандартной переменной OPENAI_API_BASE (например, для локальной заглушки).
+    """
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.breaker = CircuitBreaker()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+        self._semaphore = None
+        self._session = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "attempts": 0, "failures": 0, "rejected": 0, "gave_up": 0, "in_flight": 0}
+
+    def _count(self, key, delta=1):
+        with self._stats_lock:
+            self._stats[key] += delta
+
+    def get_loop(self):
+        """Возвращает цикл событий шлюза, запуская его фоновый поток при первом обращении (и после fork)."""
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-gateway", daemon=True).start()
+                self._loop = loop
+                self._pid = os.getpid()
+                self._semaphore = None
+                self._session = None
+        return self._loop
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+    async def _call(self, messages, max_tokens, timeout, stream=False):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        openai.aiosession.set(self._session)
+        return await openai.ChatCompletion.acreate(
+            model=OPENAI_MODEL,
+            messages=messages,
+            max_tokens=max_tokens,
+            request_timeout=timeout,
+            stream=stream
+        )
+
+    async def _limited_call(self, messages, max_tokens, timeout):
+        with tracing.span("openai.queue"):
+            await self._semaphore.acquire()
+        self._count("in_flight")
+        try:
+            with tracing.span("openai.chat_completion"):
+                return await self._call(messages, max_tokens, timeout)
+        finally:
+            self._count("in_flight", -1)
+            self._semaphore.release()
+
+    async def acomplete(self, messages, max_tokens=150, deadline=LLM_DEADLINE):
+        """
+        Выполняет запрос ChatCompletion. Должна выполняться на цикле шлюза (см. complete / submit).
+        Возвращает ответ OpenAI; при исчерпании попыток или срока выбрасывает исключение.
+        """
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        expires_at = loop.time() + deadline
+        self._count("requests")
+        last_error = None
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            if not self.breaker.allow():
+                self._count("rejected")
+                raise CircuitOpenError("Запросы к OpenAI временно приостановлены.")
+            remaining = expires_at - loop.time()
+            if remaining <= 0:
+                break
+            self._count("attempts")
+            try:
+                response = await asyncio.wait_for(
+                    self._limited_call(messages, max_tokens, min(LLM_ATTEMPT_TIMEOUT, remaining)),
+                    remaining
+                )
+                self.breaker.record_success()
+                return response
+            except NON_RETRYABLE_ERRORS:
+                self.breaker.record_success()
+                raise
+            except Exception as e:
+                last_error = e
+                self.breaker.record_failure()
+                self._count("failures")
+                logger.error(f"OpenAI error attempt {attempt+1}: {e!r}")
+            except BaseException:
+                # CancelledError и т.п. не являются Exception: исход попытки неизвестен.
+                self.breaker.release_probe()
+                raise
+            delay = min(self._backoff(attempt), expires_at - loop.time())
+            if delay <= 0 or attempt == LLM_MAX_ATTEMPTS - 1:
+                continue
+            await asyncio.sleep(delay)
+        self._count("gave_up")
+        raise DeadlineExceededError(f"Не удалось получить ответ OpenAI: {last_error!r}")
+
+    async def astream(self, messages, max_tokens=150, deadline=LLM_DEADLINE):
+        """
+        Потоковый запрос ChatCompletion (stream=True): асинхронный генератор фрагментов текста ответа.
+        Должен выполняться на цикле шлюза (см. stream). Повторные попытки делаются только до
+        получения первого фрагмента; LLM_ATTEMPT_TIMEOUT ограничивает ожидание каждого фрагмента.
+        """
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        expires_at = loop.time() + deadline
+        self._count("requests")
+        last_error = None
+        for attempt in range(LLM_MAX_ATTEMPTS):
+            if not self.breaker.allow():
+                self._count("rejected")
+                raise CircuitOpenError("Запросы к OpenAI временно приостановлены.")
+            remaining = expires_at - loop.time()
+            if remaining <= 0:
+                break
+            self._count("attempts")
+            started = False
+            try:
+                async with self._semaphore:
+                    self._count("in_flight")
+                    try:
+                        with tracing.span("openai.chat_completion.stream_open"):
+                            chunks = await asyncio.wait_for(
+                                self._call(messages, max_tokens, min(LLM_ATTEMPT_TIMEOUT, remaining), stream=True),
+                                remaining
+                            )
+                        while True:
+                            remaining = expires_at - loop.time()
+                            if remaining <= 0:
+                                raise asyncio.TimeoutError()
+                            try:
+                                chunk = await asyncio.wait_for(chunks.__anext__(), min(LLM_ATTEMPT_TIMEOUT, remaining))
+                            except StopAsyncIteration:
+                                break
+                            delta = chunk["choices"][0].get("delta", {}).get("content")
+                            if delta:
+                                started = True
+                                yield delta
+                    finally:
+                        self._count("in_flight", -1)
+                self.breaker.record_success()
+                return
+            except NON_RETRYABLE_ERRORS:
+                self.breaker.record_success()
+                raise
+            except Exception as e:
+                last_error = e
+                self.breaker.record_failure()
+                self._count("failures")
+                logger.error(f"OpenAI stream error attempt {attempt+1}: {e!r}")
+                if started:
+                    # Часть ответа уже отдана клиенту – повторять запрос нельзя.
+                    raise
+            except BaseException:
+                # Потребитель закрыл генератор (GeneratorExit) или задача отменена (CancelledError).
+                self.breaker.release_probe()
+                raise
+            delay = min(self._backoff(attempt), expires_at - loop.time())
+            if delay <= 0 or attempt == LLM_MAX_ATTEMPTS - 1:
+                continue
+            await asyncio.sleep(delay)
+        self._count("gave_up")
+        raise DeadlineExceededError(f"Не удалось получить ответ OpenAI: {last_error!r}")
+
+    def stream(self, messages, max_tokens=150, deadline=LLM_DEADLINE):
+        """
+        Синхронная обёртка над astream для потоков Flask: генератор фрагментов ответа.
+        Если потребитель прекращает чтение, запрос к OpenAI отменяется.
+        """
+        chunks = queue.Queue()
+
+        async def pump():
+            try:
+                async for delta in self.astream(messages, max_tokens=max_tokens, deadline=deadline):
+                    chunks.put(("delta", delta))
+                chunks.put(("done", None))
+            except Exception as e:
+                chunks.put(("error", e))
+
+        future = self.submit(pump())
+        try:
+            while True:
+                try:
+                    kind, value = chunks.get(timeout=deadline + 5)
+                except queue.Empty:
+                    raise DeadlineExceededError("Срок на получение ответа OpenAI истёк.")
+                if kind == "delta":
+                    yield value
+                elif kind == "error":
+                    raise value
+                else:
+                    return
+        finally:
+            future.cancel()
+
+    def submit(self, coro):
+        """Запускает корутину на цикле шлюза и возвращает concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(tracing.propagate(coro), self.get_loop())
+
+    def complete(self, messages, max_tokens=150, deadline=LLM_DEADLINE):
+        """Синхронная обёртка над acomplete для вызова из потоков Flask."""
+        future = self.submit(self.acomplete(messages, max_tokens=max_tokens, deadline=deadline))
+        return future.result(timeout=deadline + 5)
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["circuit"] = self.breaker.state
+        stats["max_concurrency"] = self.max_concurrency
+        return stats
+
+gateway = LLMGateway()
+
+def chat_completion(messages, max_tokens=150, deadline=LLM_DEADLINE):
+    """Возвращает ответ OpenAI через общий шлюз процесса (исключение, если ответа нет)."""
+    return gateway.complete(messages, max_tokens=max_tokens, deadline=deadline)
+
+def get_llm_stats():
+    return gateway.get_stats()
@@ -0,0 +1,42 @@
+import os
+import sqlite3
+import threading
+import logging
+from config import LOCAL_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("LOCAL_DB_PATH", LOCAL_DB_PATH)
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schemas_applied = set()
+
+def get_connection():
+    """
+    Возвращает соединение с локальной SQLite-базой для текущего потока.
+    База работает в режиме WAL, поэтому читатели не блокируют писателей, а несколько
+    процессов (воркеров) могут писать в неё одновременно.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        db_dir = os.path.dirname(DB_PATH)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+def ensure_schema(name, ddl):
+    """Создаёт таблицы модуля (один раз на процесс) и возвращает соединение текущего потока."""
+    conn = get_connection()
+    if name not in _schemas_applied:
+        with _schema_lock:
+            if name not in _schemas_applied:
+                conn.executescript(ddl)
+                _schemas_applied.add(name)
+    return conn
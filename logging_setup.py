@@ -0,0 +1,134 @@
+import os
+import re
+import queue
+import atexit
+import random
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Файл лога; "{slot}" заменяется на номер места воркера gunicorn (LOG_SLOT, см. gunicorn.conf.py),
+# чтобы у каждого воркера был свой файл, а перезапущенный воркер продолжал файл предшественника.
+LOG_FILE = os.getenv("LOG_FILE", "server.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_TO_CONSOLE = os.getenv("LOG_TO_CONSOLE", "1") == "1"
+# Сообщения длиннее этого числа символов обрезаются (полные запросы, ответы, данные API).
+LOG_MAX_MESSAGE_LENGTH = int(os.getenv("LOG_MAX_MESSAGE_LENGTH", "2000"))
+# Доля записываемых сообщений, помеченных как выборочные (построчные логи, см. SAMPLED).
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+# Размер очереди сообщений; при переполнении сообщения отбрасываются, а не блокируют запрос.
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Маскировать ли в сообщениях персональные данные: адреса email и значения полей REDACTED_FIELDS.
+LOG_REDACT = os.getenv("LOG_REDACT", "1") == "1"
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Поля запросов и записей клиентов, значения которых не попадают в журнал (ключи словарей и JSON).
+REDACTED_FIELDS = ("name", "email", "phone", "code", "message", "text")
+_REDACTED_FIELD_RE = re.compile(
+    r"""(?P<key>(['"])(?:%s)\2\s*:\s*)(?:'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|[^,}\]\s]+)""" % "|".join(REDACTED_FIELDS),
+    re.IGNORECASE,
+)
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+# Передаётся как extra=SAMPLED в построчные логи: в журнал попадает только доля LOG_SAMPLE_RATE таких сообщений.
+SAMPLED = {"sampled": True}
+
+_lock = threading.Lock()
+_state = {"pid": None, "listener": None, "dropped": 0}
+
+def redact(message):
+    """Заменяет в тексте значения полей REDACTED_FIELDS (в записи словаря или JSON) и адреса email на '***'."""
+    message = _REDACTED_FIELD_RE.sub(lambda match: match.group("key") + "'***'", message)
+    return _EMAIL_RE.sub("***@***", message)
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return not getattr(record, "sampled", False) or random.random() < self.rate
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler, который форматирует, маскирует (см. redact) и обрезает сообщение в потоке запроса,
+    а запись в файл и консоль оставляет потоку QueueListener. При переполненной очереди сообщение отбрасывается.
+    """
+
+    def __init__(self, log_queue, max_length=LOG_MAX_MESSAGE_LENGTH, redact_messages=LOG_REDACT):
+        super().__init__(log_queue)
+        self.max_length = max_length
+        self.redact_messages = redact_messages
+
+    def prepare(self, record):
+        # Маскируется и обрезается только текст сообщения; трассировка исключения сохраняется целиком.
+        message = record.getMessage()
+        if self.redact_messages:
+            message = redact(message)
+        if self.max_length and len(message) > self.max_length:
+            message = f"{message[:self.max_length]}... [обрезано, всего {len(message)} символов]"
+        record.msg = message
+        record.args = None
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _state["dropped"] += 1
+
+def _log_file_path():
+    path = LOG_FILE.replace("{slot}", os.getenv("LOG_SLOT", "0"))
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return path
+
+def setup_logging():
+    """
+    Настраивает логирование процесса (один раз; после fork – заново): корневой логгер пишет
+    в очередь, а отдельный поток переносит сообщения в файл с ротацией по размеру и в консоль.
+    """
+    if _state["pid"] == os.getpid():
+        return
+    with _lock:
+        if _state["pid"] == os.getpid():
+            return
+        formatter = logging.Formatter(LOG_FORMAT)
+        handlers = []
+        if LOG_FILE:
+            file_handler = RotatingFileHandler(
+                _log_file_path(), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+            )
+            handlers.append(file_handler)
+        if LOG_TO_CONSOLE:
+            handlers.append(logging.StreamHandler())
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter())
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(LOG_LEVEL)
+        # Клиент Telegram логирует каждый HTTP-запрос на уровне INFO.
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        _state["listener"] = listener
+        _state["pid"] = os.getpid()
+
+def get_logging_stats():
+    return {
+        "dropped": _state["dropped"],
+        "sample_rate": LOG_SAMPLE_RATE,
+        "max_message_length": LOG_MAX_MESSAGE_LENGTH,
+        "redact": LOG_REDACT,
+    }
@@ -0,0 +1,210 @@
+import os
+import re
+import html
+import time
+import queue
+import atexit
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Размер очереди уведомлений; при переполнении новые уведомления отбрасываются, а не ждут.
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "1000"))
+# Одинаковые (с точностью до чисел и идентификаторов) уведомления отправляются не чаще раза за это время (с).
+NOTIFY_DEDUP_WINDOW = float(os.getenv("NOTIFY_DEDUP_WINDOW", "300"))
+# Сколько секунд собирать уведомления, пришедшие подряд, в одно сообщение-сводку.
+NOTIFY_BATCH_WINDOW = float(os.getenv("NOTIFY_BATCH_WINDOW", "2"))
+# Минимальная пауза между сообщениями в Telegram (лимит API – около 20 сообщений в минуту на чат).
+NOTIFY_MIN_INTERVAL = float(os.getenv("NOTIFY_MIN_INTERVAL", "3"))
+# Таймаут запроса к Telegram API (с).
+NOTIFY_TIMEOUT = float(os.getenv("NOTIFY_TIMEOUT", "5"))
+# Ограничение Telegram на длину одного сообщения.
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+# Максимальная длина одного уведомления в сводке (после экранирования).
+NOTIFY_DIGEST_ITEM_LENGTH = int(os.getenv("NOTIFY_DIGEST_ITEM_LENGTH", "600"))
+
+_FINGERPRINT_RE = re.compile(r"[0-9a-f]{8,}|\d+", re.IGNORECASE)
+
+_queue = queue.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+_dedup_lock = threading.Lock()
+_recent = {}  # отпечаток -> {"sent_at": время, "suppressed": сколько повторов подавлено}
+_worker_lock = threading.Lock()
+_worker = {"thread": None, "pid": None, "last_sent": 0.0}
+_stats_lock = threading.Lock()
+_stats = {"queued": 0, "deduplicated": 0, "dropped": 0, "sent_messages": 0, "digests": 0, "send_errors": 0}
+
+def _count(key, value=1):
+    with _stats_lock:
+        _stats[key] += value
+
+def _credentials():
+    return os.getenv("TELEGRAM_BOT_TOKEN"), os.getenv("TELEGRAM_CHAT_ID")
+
+def fingerprint(message):
+    """Отпечаток уведомления: текст без чисел и идентификаторов (коды клиентов, id файлов, время)."""
+    normalized = _FINGERPRINT_RE.sub("#", str(message)).strip().lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+def notify(message):
+    """
+    Ставит уведомление администратору в очередь фоновой отправки в Telegram и сразу возвращается.
+    Повтор уже отправленного уведомления в пределах NOTIFY_DEDUP_WINDOW только подсчитывается
+    и упоминается в следующем таком уведомлении. Возвращает True, если уведомление поставлено в очередь.
+    """
+    token, chat_id = _credentials()
+    if not (token and chat_id):
+        return False
+    key = fingerprint(message)
+    now = time.monotonic()
+    with _dedup_lock:
+        entry = _recent.get(key)
+        if entry is not None and now - entry["sent_at"] < NOTIFY_DEDUP_WINDOW:
+            entry["suppressed"] += 1
+            _count("deduplicated")
+            return False
+        suppressed = entry["suppressed"] if entry is not None else 0
+        text = str(message)
+        if suppressed:
+            text += f"\n(ещё {suppressed} таких же уведомлений за последние {int(NOTIFY_DEDUP_WINDOW)} с)"
+        try:
+            _queue.put_nowait(text)
+        except queue.Full:
+            # Отпечаток не запоминается: уведомление не доставлено, и следующий такой же повтор не подавляется.
+            _count("dropped")
+            logger.warning("Очередь уведомлений переполнена, уведомление отброшено.")
+            return False
+        _recent[key] = {"sent_at": now, "suppressed": 0}
+        if len(_recent) > NOTIFY_QUEUE_SIZE:
+            for old_key in [k for k, v in _recent.items() if now - v["sent_at"] >= NOTIFY_DEDUP_WINDOW]:
+                del _recent[old_key]
+    _count("queued")
+    start_notifier()
+    return True
+
+def _escape_truncated(text, limit):
+    """
+    Экранирует text для parse_mode=HTML, укладываясь в limit символов. Обрезается исходный текст,
+    а не результат экранирования, поэтому сущности вроде '&lt;' никогда не разрезаются.
+    """
+    escaped = html.escape(text)
+    if len(escaped) <= limit:
+        return escaped
+    suffix = "… (обрезано)"
+    parts, size = [], len(suffix)
+    for char in text:
+        piece = html.escape(char)
+        if size + len(piece) > limit:
+            break
+        parts.append(piece)
+        size += len(piece)
+    return "".join(parts) + suffix
+
+def _format_batch(messages):
+    """Одно сообщение – как есть; несколько – сводка. Результат не длиннее лимита Telegram."""
+    if len(messages) == 1:
+        return _escape_truncated(messages[0], TELEGRAM_MAX_MESSAGE_LENGTH)
+    text = f"<b>Уведомлений: {len(messages)}</b>"
+    # Запас под строку о не вошедших в сводку уведомлениях.
+    budget = TELEGRAM_MAX_MESSAGE_LENGTH - 64
+    for position, message in enumerate(messages):
+        item = "\n\n• " + _escape_truncated(message, NOTIFY_DIGEST_ITEM_LENGTH)
+        if len(text) + len(item) > budget:
+            text += f"\n\n… и ещё {len(messages) - position}"
+            break
+        text += item
+    return text
+
+def _post(session, text):
+    token, chat_id = _credentials()
+    if not (token and chat_id):
+        return
+    url = f"https://api.telegram.org/bot{token}/sendMessage"
+    payload = {"chat_id": chat_id, "text": text, "parse_mode": "HTML"}
+    for attempt in range(2):
+        wait = NOTIFY_MIN_INTERVAL - (time.monotonic() - _worker["last_sent"])
+        if wait > 0:
+            time.sleep(wait)
+        response = session.post(url, json=payload, timeout=NOTIFY_TIMEOUT)
+        _worker["last_sent"] = time.monotonic()
+        if response.status_code == 429 and attempt == 0:
+            retry_after = response.json().get("parameters", {}).get("retry_after", NOTIFY_MIN_INTERVAL)
+            time.sleep(min(float(retry_after), 60))
+            continue
+        response.raise_for_status()
+        return
+
+def _collect_batch(first):
+    messages = [first]
+    deadline = time.monotonic() + NOTIFY_BATCH_WINDOW
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            messages.append(_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return messages
+
+def _send_batch(session, messages):
+    try:
+        _post(session, _format_batch(messages))
+        _count("sent_messages")
+        if len(messages) > 1:
+            _count("digests")
+    except Exception as e:
+        _count("send_errors")
+        logger.error(f"Ошибка при отправке уведомления ({len(messages)} шт.): {e}")
+
+def _run_worker():
+    import requests
+    session = requests.Session()
+    while True:
+        messages = _collect_batch(_queue.get())
+        _send_batch(session, messages)
+
+def flush_notifications(timeout=NOTIFY_TIMEOUT):
+    """Отправляет уведомления, оставшиеся в очереди (при завершении процесса), не дольше timeout секунд."""
+    messages = []
+    while True:
+        try:
+            messages.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    if not messages:
+        return
+    import requests
+    deadline = time.monotonic() + timeout
+    with requests.Session() as session:
+        batch = []
+        for message in messages:
+            batch.append(message)
+            if len(batch) >= 50:
+                _send_batch(session, batch)
+                batch = []
+                if time.monotonic() >= deadline:
+                    return
+        if batch:
+            _send_batch(session, batch)
+
+def start_notifier():
+    """Запускает фоновую отправку уведомлений в текущем процессе (один раз; после fork – заново)."""
+    if _worker["pid"] == os.getpid() and _worker["thread"] is not None:
+        return
+    with _worker_lock:
+        if _worker["pid"] == os.getpid() and _worker["thread"] is not None:
+            return
+        thread = threading.Thread(target=_run_worker, name="telegram-notifier", daemon=True)
+        thread.start()
+        if _worker["pid"] is None:
+            atexit.register(flush_notifications)
+        _worker["thread"] = thread
+        _worker["pid"] = os.getpid()
+
+def get_notifier_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["pending"] = _queue.qsize()
+    return stats
@@ -1,36 +1,111 @@
+import os
+import re
+import time
+import hashlib
+import threading
 import requests
 from bs4 import BeautifulSoup
 import logging
+import tracing
+from logging_setup import SAMPLED
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-TARIFF_URL = "https://e60shipping.com/en/32/static/tariff.html"
+TARIFF_URL = os.getenv("TARIFF_URL", "https://e60shipping.com/en/32/static/tariff.html")
+# Время (в секундах), в течение которого снимок тарифов считается свежим.
+TARIFF_CACHE_TTL = float(os.getenv("TARIFF_CACHE_TTL", "600"))
+# Через сколько секунд повторить попытку, если сайт тарифов недоступен.
+TARIFF_RETRY_INTERVAL = float(os.getenv("TARIFF_RETRY_INTERVAL", "60"))
+TARIFF_REQUEST_TIMEOUT = float(os.getenv("TARIFF_REQUEST_TIMEOUT", "10"))
 
-def get_ferry_prices():
+# Направления перевозки и соответствующие им столбцы таблицы тарифов.
+DIRECTIONS = ("Ro_Ge", "Ge_Ro")
+# Обозначения валют, встречающиеся в ценах на сайте.
+CURRENCY_MARKERS = (
+    ("€", "EUR"), ("eur", "EUR"), ("евро", "EUR"),
+    ("$", "USD"), ("usd", "USD"),
+    ("₾", "GEL"), ("gel", "GEL"), ("лари", "GEL"),
+    ("ron", "RON"), ("lei", "RON"),
+)
+_TIMESTAMP_RE = re.compile(r'^\d{2}\.\d{2}\.\d{2}\s+\d{2}:\d{2}\s*-\s*')
+_AMOUNT_RE = re.compile(r'\d[\d\s\u00a0.,]*')
+
+_session = requests.Session()
+_snapshot_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+_snapshot = {
+    "prices": None,
+    "by_name": {},
+    "version": None,
+    "etag": None,
+    "last_modified": None,
+    "checked_at": 0.0,
+    "next_check": 0.0,
+    "refreshing": False,
+}
+_snapshot_stats = {
+    "hits": 0,
+    "stale_hits": 0,
+    "misses": 0,
+    "not_modified": 0,
+    "unchanged": 0,
+    "parses": 0,
+    "errors": 0,
+    "backoff_skips": 0,
+}
+
+def _parse_number(text):
+    """Разбирает число с разделителями тысяч/дробной части ('1 200', '1,200.50', '1.200,50', '850,5')."""
+    number = re.sub(r'[\s\u00a0]', '', text).rstrip('.,')
+    if ',' in number and '.' in number:
+        # Дробную часть отделяет последний из разделителей, другой – разделитель тысяч.
+        decimal = ',' if number.rfind(',') > number.rfind('.') else '.'
+        thousands = '.' if decimal == ',' else ','
+        number = number.replace(thousands, '').replace(decimal, '.')
+    else:
+        for separator in (',', '.'):
+            if separator not in number:
+                continue
+            integer, _, fraction = number.rpartition(separator)
+            # Несколько разделителей или группа из трёх цифр после него – это разделитель тысяч.
+            if number.count(separator) > 1 or len(fraction) == 3:
+                number = number.replace(separator, '')
+            else:
+                number = f"{integer}.{fraction}"
+    try:
+        return float(number)
+    except ValueError:
+        return None
+
+def parse_price_cell(text):
     """
-    Делает HTTP-запрос к странице тарифов паромного сервиса и извлекает информацию о ценах.
-    Возвращает словарь вида:
+    Разбирает ячейку цены таблицы тарифов. Возвращает словарь
+    {"amount": число или None, "currency": код валюты или None, "text": цена без отметки времени}.
+    """
+    text = _TIMESTAMP_RE.sub('', text or '').strip()
+    match = _AMOUNT_RE.search(text)
+    amount = _parse_number(match.group(0)) if match else None
+    lowered = text.lower()
+    currency = next((code for marker, code in CURRENCY_MARKERS if marker in lowered), None)
+    return {"amount": amount, "currency": currency, "text": text}
+
+def parse_tariff_html(html):
+    """
+    Извлекает таблицу тарифов из HTML страницы. Возвращает словарь вида:
     {
         "VehicleType1": {
-            "price_Ro_Ge": "Цена для направления Romania -> Georgia",
-            "price_Ge_Ro": "Цена для направления Georgia -> Romania",
+            "prices": {
+                "Ro_Ge": {"amount": 1200.0, "currency": "EUR", "text": "1200 EUR"},  # Romania -> Georgia
+                "Ge_Ro": {"amount": 1100.0, "currency": "EUR", "text": "1100 EUR"},  # Georgia -> Romania
+            },
             "remark": "Remark",
             "condition": "Condition"
         },
         ...
     }
+    Цены разбираются один раз на снимок страницы, поэтому при ответах клиентам строки не разбираются.
     """
-    try:
-        response = requests.get(TARIFF_URL)
-        response.raise_for_status()
-        logger.info("Запрос к тарифной странице выполнен успешно.")
-    except Exception as e:
-        logger.error(f"Ошибка при запросе тарифов с сайта: {e}")
-        raise Exception(f"Ошибка при запросе тарифов с сайта: {e}")
-
-    soup = BeautifulSoup(response.text, 'html.parser')
+    soup = BeautifulSoup(html, 'html.parser')
     table = soup.find('table')
     if not table:
         logger.error("Таблица тарифов не найдена на странице.")
@@ -48,22 +123,149 @@ def get_ferry_prices():
         if len(cols) < 5:
             continue  # пропустить некорректные строки
         vehicle_type = cols[0].get_text(strip=True)
-        price_Ro_Ge = cols[1].get_text(strip=True)
-        price_Ge_Ro = cols[2].get_text(strip=True)
         remark = cols[3].get_text(strip=True)
         condition = cols[4].get_text(strip=True)
         prices[vehicle_type] = {
-            "price_Ro_Ge": price_Ro_Ge,
-            "price_Ge_Ro": price_Ge_Ro,
+            "prices": {
+                "Ro_Ge": parse_price_cell(cols[1].get_text(strip=True)),
+                "Ge_Ro": parse_price_cell(cols[2].get_text(strip=True)),
+            },
             "remark": remark,
             "condition": condition
         }
-        logger.info(f"Найден тариф для '{vehicle_type}': {prices[vehicle_type]}")
+        logger.info("Найден тариф для '%s': %s", vehicle_type, prices[vehicle_type], extra=SAMPLED)
     # Логируем список всех типов ТС, найденных на сайте
     logger.info(f"Загружены тарифы для категорий: {list(prices.keys())}")
     return prices
 
+def _refresh_snapshot():
+    """
+    Запрашивает страницу тарифов условным запросом (ETag / If-Modified-Since).
+    Страница разбирается заново только если изменился хэш её содержимого.
+    При ошибке остаётся последний удачный снимок, а исключение пробрасывается дальше.
+    """
+    with _snapshot_lock:
+        headers = {}
+        if _snapshot["prices"] is not None:
+            if _snapshot["etag"]:
+                headers["If-None-Match"] = _snapshot["etag"]
+            if _snapshot["last_modified"]:
+                headers["If-Modified-Since"] = _snapshot["last_modified"]
+    try:
+        with tracing.span("tariff.http"):
+            response = _session.get(TARIFF_URL, headers=headers, timeout=TARIFF_REQUEST_TIMEOUT)
+        if response.status_code == 304:
+            with _snapshot_lock:
+                _snapshot["checked_at"] = time.monotonic()
+                _snapshot["next_check"] = _snapshot["checked_at"] + TARIFF_CACHE_TTL
+                _snapshot_stats["not_modified"] += 1
+            logger.info("Страница тарифов не изменилась (304).")
+            return
+        response.raise_for_status()
+        logger.info("Запрос к тарифной странице выполнен успешно.")
+        version = hashlib.sha1(response.content).hexdigest()[:12]
+        with _snapshot_lock:
+            unchanged = version == _snapshot["version"]
+        prices = None if unchanged else parse_tariff_html(response.text)
+    except Exception as e:
+        logger.error(f"Ошибка при запросе тарифов с сайта: {e}")
+        with _snapshot_lock:
+            _snapshot_stats["errors"] += 1
+            _snapshot["next_check"] = time.monotonic() + TARIFF_RETRY_INTERVAL
+        raise Exception(f"Ошибка при запросе тарифов с сайта: {e}")
+
+    with _snapshot_lock:
+        if unchanged:
+            _snapshot_stats["unchanged"] += 1
+        else:
+            _snapshot["prices"] = prices
+            _snapshot["by_name"] = {name.lower(): name for name in prices}
+            _snapshot["version"] = version
+            _snapshot_stats["parses"] += 1
+        _snapshot["etag"] = response.headers.get("ETag")
+        _snapshot["last_modified"] = response.headers.get("Last-Modified")
+        _snapshot["checked_at"] = time.monotonic()
+        _snapshot["next_check"] = _snapshot["checked_at"] + TARIFF_CACHE_TTL
+
+def _background_refresh():
+    try:
+        with _refresh_lock:
+            _refresh_snapshot()
+    except Exception:
+        pass  # ошибка уже залогирована, продолжаем отдавать последний удачный снимок
+    finally:
+        with _snapshot_lock:
+            _snapshot["refreshing"] = False
+
+def _check_retry_backoff():
+    """Вызывается под _snapshot_lock, пока удачного снимка нет: после неудачного запроса к сайту не ждём его снова."""
+    if time.monotonic() < _snapshot["next_check"]:
+        _snapshot_stats["backoff_skips"] += 1
+        raise Exception("Ошибка при запросе тарифов с сайта: сайт недоступен, повторная попытка позже.")
+
+def get_tariff_snapshot():
+    """
+    Возвращает снимок тарифов: {"prices": ..., "version": ...}.
+    Пока снимок свежий, сайт не запрашивается. После истечения TARIFF_CACHE_TTL отдаётся последний
+    удачный снимок, а проверка обновлений идёт в фоне. Сайт запрашивается синхронно только если
+    удачного снимка ещё нет; если такой запрос не удался, до истечения TARIFF_RETRY_INTERVAL
+    исключение выбрасывается сразу, без повторного обращения к сайту.
+    """
+    with _snapshot_lock:
+        if _snapshot["prices"] is not None:
+            if time.monotonic() < _snapshot["next_check"]:
+                _snapshot_stats["hits"] += 1
+            else:
+                _snapshot_stats["stale_hits"] += 1
+                if not _snapshot["refreshing"]:
+                    _snapshot["refreshing"] = True
+                    threading.Thread(target=_background_refresh, daemon=True).start()
+            return {"prices": _snapshot["prices"], "version": _snapshot["version"]}
+        _check_retry_backoff()
+
+    with _refresh_lock:
+        with _snapshot_lock:
+            if _snapshot["prices"] is not None:
+                _snapshot_stats["hits"] += 1
+                return {"prices": _snapshot["prices"], "version": _snapshot["version"]}
+            # Пока поток ждал блокировку, запрос к сайту не удался – повторять его сразу не нужно.
+            _check_retry_backoff()
+            _snapshot_stats["misses"] += 1
+        _refresh_snapshot()
+    with _snapshot_lock:
+        return {"prices": _snapshot["prices"], "version": _snapshot["version"]}
+
+def get_ferry_prices():
+    """
+    Возвращает словарь тарифов из последнего снимка страницы тарифов (см. parse_tariff_html).
+    Возвращаемый словарь общий для всех потоков – изменять его нельзя.
+    """
+    return get_tariff_snapshot()["prices"]
+
+def find_tariff(vehicle_type):
+    """
+    Возвращает (категория, тариф) для типа ТС без учёта регистра или (None, None), если категории нет.
+    Тариф имеет вид, описанный в parse_tariff_html.
+    """
+    prices = get_ferry_prices()
+    with _snapshot_lock:
+        category = _snapshot["by_name"].get(str(vehicle_type).strip().lower())
+    if category is None or category not in prices:
+        return None, None
+    return category, prices[category]
+
+def get_tariff_cache_stats():
+    """Возвращает счётчики кэша тарифов и возраст текущего снимка."""
+    with _snapshot_lock:
+        stats = dict(_snapshot_stats)
+        stats["version"] = _snapshot["version"]
+        stats["age_seconds"] = round(time.monotonic() - _snapshot["checked_at"], 1) if _snapshot["prices"] is not None else None
+        stats["ttl_seconds"] = TARIFF_CACHE_TTL
+    return stats
+
 if __name__ == "__main__":
+    from logging_setup import setup_logging
+    setup_logging()
     try:
         ferry_prices = get_ferry_prices()
         for vehicle, data in ferry_prices.items():
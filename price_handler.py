@@ -1,79 +1,76 @@
 import os
-import re
 import logging
-import time
-import openai
-import requests
 from bible import get_rule
+from llm_gateway import chat_completion
 
 try:
-    from price import get_ferry_prices
+    from price import find_tariff
 except ImportError:
-    get_ferry_prices = None  # Заглушка
+    find_tariff = None  # Заглушка
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-def remove_timestamp(text):
-    return re.sub(r'^\d{2}\.\d{2}\.\d{2}\s+\d{2}:\d{2}\s*-\s*', '', text)
-
-def parse_price(price_str):
-    try:
-        cleaned = re.sub(r'[^\d.]', '', price_str)
-        return float(cleaned) if cleaned else None
-    except Exception as e:
-        logger.error(f"{get_rule('price_parse_error')}: {e}")
-        return None
+# Доплата за перевозку ТС без водителя и коэффициент для опасных грузов (ADR).
+DRIVER_FEE = float(os.getenv("DRIVER_FEE", "100"))
+ADR_MULTIPLIER = float(os.getenv("ADR_MULTIPLIER", "1.2"))
 
 def get_guiding_question(condition_marker):
     return f"Уточните: {condition_marker}?"
 
 def get_openai_response(messages):
-    start_time = time.time()
-    attempt = 0
-    while True:
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=150,
-                timeout=40
-            )
-            return response
-        except Exception as e:
-            logger.error(f"OpenAI error attempt {attempt+1}: {e}")
-            attempt += 1
-            if time.time() - start_time > 180:
-                return get_rule("openai_timeout_message")
-            time.sleep(2)
+    """
+    Возвращает ответ OpenAI через общий шлюз llm_gateway (ограничение параллельности, повторы
+    с jitter, общий срок и circuit breaker). Если ответа нет, возвращает текст openai_timeout_message.
+    """
+    try:
+        return chat_completion(messages)
+    except Exception as e:
+        logger.error(f"OpenAI недоступен: {e}")
+        return get_rule("openai_timeout_message")
+
+def get_tariff_price(vehicle_type, direction="Ro_Ge"):
+    """
+    Возвращает цену из текущего снимка тарифов: {"amount", "currency", "text"} для типа ТС
+    и направления, или None, если такой категории нет. Исключение – если тарифы недоступны.
+    """
+    if find_tariff is None:
+        raise Exception("Функция find_tariff отсутствует, невозможно получить тарифы.")
+    _, tariff = find_tariff(vehicle_type)
+    if tariff is None:
+        return None
+    return tariff["prices"].get(direction)
+
+def calculate_final_cost(base_amount, without_driver=False, adr=False):
+    """Итоговая стоимость: доплата DRIVER_FEE за ТС без водителя, затем коэффициент ADR_MULTIPLIER для ADR."""
+    fee = DRIVER_FEE if without_driver else 0
+    multiplier = ADR_MULTIPLIER if adr else 1.0
+    return (base_amount + fee) * multiplier
 
 def check_ferry_price(vehicle_type, direction="Ro_Ge"):
-    if get_ferry_prices is None:
-        logger.error("Функция get_ferry_prices отсутствует, невозможно получить тарифы.")
+    if find_tariff is None:
+        logger.error("Функция find_tariff отсутствует, невозможно получить тарифы.")
         return get_rule("price_error_message")
 
     try:
-        website_prices = get_ferry_prices()
-        logger.info(f"Доступные категории: {list(website_prices.keys())}")
+        category, tariff = find_tariff(vehicle_type)
     except Exception as e:
         logger.error(f"Ошибка при получении тарифов с сайта: {e}")
         return get_rule("price_error_message")
-    
-    category = next((key for key in website_prices if key.lower() == vehicle_type.lower()), None)
-    if category is None:
+
+    if tariff is None:
         return get_rule("vehicle_type_not_found").format(vehicle_type=vehicle_type)
 
-    price_str = website_prices[category].get("price_Ro_Ge" if direction == "Ro_Ge" else "price_Ge_Ro", "")
-    price_str = remove_timestamp(price_str).strip()
-    if not re.search(r'\d', price_str):
+    price = tariff["prices"].get(direction)
+    if price is None or price["amount"] is None:
         return get_rule("invalid_price_returned").format(vehicle_type=vehicle_type)
 
-    remark = website_prices[category].get("remark", "")
-    conditions = website_prices[category].get("conditions", "")
+    remark = tariff.get("remark", "")
+    condition = tariff.get("condition", "")
 
-    response = f"Цена перевозки {vehicle_type} ({direction.replace('_', ' ')}) составляет {price_str}."
+    response = f"Цена перевозки {vehicle_type} ({direction.replace('_', ' ')}) составляет {price['text']}."
     if remark:
         response += f" Примечание: {remark}"
-    if conditions:
-        response += f" Доп. условия: {conditions}"
+    if condition:
+        response += f" Доп. условия: {condition}"
     return response
@@ -1,57 +1,38 @@
-import inspect
-# Monkey-patch: определяем getargspec, возвращающую ровно 4 значения.
-def getargspec(func):
-    fas = inspect.getfullargspec(func)
-    return fas.args, fas.varargs, fas.varkw, fas.defaults
-if not hasattr(inspect, 'getargspec'):
-    inspect.getargspec = getargspec
+import time
+_IMPORT_STARTED = time.perf_counter()
 
 import os
-import re
-import difflib
+import json
 import logging
+import logging_setup
+logging_setup.setup_logging()
 import asyncio
-import pprint
-import time
-from flask import Flask, request, jsonify
+import collections
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 import openai
-import requests
-from datetime import datetime
-from clientdata import register_or_update_client, verify_client_code, update_last_visit, update_activity_status
-from client_caec import add_message_to_client_file, find_client_file_id, get_sheets_service, CLIENT_FILES_DIR
-from bible import load_bible_data, save_bible_pair, get_rule
-from price_handler import check_ferry_price, parse_price, remove_timestamp, get_guiding_question, get_openai_response
+from clientdata import register_or_update_client, register_clients_bulk, verify_client_code, update_last_visit, update_activity_status, get_last_visit_stats
+from client_caec import add_message_to_client_file, warm_client_file_index
+from bible import load_bible_snapshot, save_bible_pair, get_rule, get_bible_cache_stats
+from alias_matcher import AliasMatcher
+from bulk_register import parse_clients
+from client_mirror import get_mirror_stats
+from fuzzy_index import TrigramIndex
+from conversation_journal import enqueue_turn, start_journal_worker, get_journal_stats
+from notifier import get_notifier_stats
+from conversation_store import append_turn, get_context_messages
+from llm_gateway import get_llm_stats, gateway as llm_gateway
+from answer_cache import lookup_answer, store_answer, get_answer_cache_stats
+from lemmatizer import lemmatize_text, lemmatize_many, get_lemmatizer_stats, warm_up as lemmatizer_warm_up
+from price_handler import check_ferry_price, get_tariff_price, calculate_final_cost
 from flask_cors import CORS
-import openpyxl
-
-# Обработка импорта nltk с fallback, если модуль отсутствует
-try:
-    import nltk
-    from nltk.corpus import stopwords
-    from nltk.stem import WordNetLemmatizer, SnowballStemmer
-    from nltk.tokenize import word_tokenize
-    nltk.download('punkt')
-    nltk.download('stopwords')
-    nltk.download('wordnet')
-    stop_words = set(stopwords.words('russian'))
-    USE_NLTK = True
-except ImportError as e:
-    logging.error("NLTK не установлен. Используется fallback-токенизация без стоп-слов.")
-    USE_NLTK = False
-    stop_words = set()
-    # Определим простую функцию-токенайзер
-    def word_tokenize(text):
-        return text.split()
-
-# Импортируем pymorphy2 для лемматизации
-try:
-    import pymorphy2
-    morph = pymorphy2.MorphAnalyzer()
-except Exception as e:
-    logging.error(f"Ошибка инициализации pymorphy2: {e}")
-    morph = None
-
-from telegram import Update, Bot
+import startup
+import tracing
+from session_store import create_session_store
+
+from telegram import Update
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -70,46 +51,43 @@ openai.api_key = os.getenv("OPENAI_API_KEY")
 app = Flask(__name__)
 CORS(app)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler("server.log"), logging.StreamHandler()]
-)
+@app.before_request
+def start_request_trace():
+    g.trace_token = tracing.start_trace()[1]
+
+@app.after_request
+def finish_request_trace(response):
+    token = g.pop("trace_token", None)
+    if token is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        trace, total = tracing.finish_trace(token, endpoint, response.status_code)
+        if trace is not None and tracing.TRACE_SERVER_TIMING:
+            response.headers["Server-Timing"] = trace.server_timing(total)
+    return response
+
+@app.teardown_request
+def reset_request_trace(exc=None):
+    token = g.pop("trace_token", None)
+    if token is not None:
+        tracing.finish_trace(token, request.url_rule.rule if request.url_rule else "unmatched", 500)
+
 logger = logging.getLogger(__name__)
-logger.info("Environment variables:")
-pprint.pprint(dict(os.environ))
 
-pending_guiding = {}
+# Сессии уточняющих вопросов хранятся вне памяти процесса, чтобы их видели все воркеры.
+pending_guiding = create_session_store()
 
 PRICE_KEYWORDS = ["цена", "прайс"]
+CHAT_ERROR_MESSAGE = "Извините, произошла ошибка при обработке запроса."
 
-def lemmatize_text(text):
-    """
-    Приводит каждое слово входящего текста к его базовой (лемматизированной) форме.
-    Если nltk установлен, используется nltk и pymorphy2; иначе – простое разделение по пробелам.
-    """
-    text = text.lower()
-    if USE_NLTK and morph:
-        tokens = word_tokenize(text)
-        # Убираем стоп-слова
-        tokens = [token for token in tokens if token not in stop_words]
-        lemmas = [morph.parse(token)[0].normal_form for token in tokens]
-        return " ".join(lemmas)
-    else:
-        # fallback: просто разделяем по пробелам
-        return " ".join(text.split())
+_alias_index = {"version": None, "alias_mapping": {}, "instructions": [], "matcher": AliasMatcher([])}
 
-def get_alias_mapping_and_instructions():
+def _parse_alias_rules(df):
     """
-    Загружает строки с Verification == "Rule" из Bible.xlsx и разбивает содержимое столбца Answers.
+    Разбирает строки с Verification == "Rule" из Bible.xlsx, содержимое столбца Answers.
     Если строка содержит знак '=', она считается правилом алиасов и парсится в формате:
         alias1, alias2, ... = normalized_value
     Если строка не содержит '=', она считается общей инструкцией для агента.
-    Возвращает два значения:
-        - alias_mapping: словарь, где ключи – варианты (алиасы), а значения – нормализованное наименование.
-        - instructions: список строк общей инструкции.
     """
-    df = load_bible_data()
     alias_mapping = {}
     instructions = []
     if df is not None and not df.empty:
@@ -128,109 +106,163 @@ def get_alias_mapping_and_instructions():
                         normalized_value = parts[1].strip().lower()
                         variants = [v.strip() for v in aliases_part.split(",")]
                         for variant in variants:
-                            alias_mapping[variant] = normalized_value
+                            if variant:
+                                alias_mapping[variant] = normalized_value
                     else:
                         instructions.append(line)
     return alias_mapping, instructions
 
+def get_alias_index():
+    """
+    Возвращает индекс алиасов: словарь алиасов, общие инструкции и скомпилированный AliasMatcher.
+    Индекс перестраивается только при изменении версии Bible.
+    """
+    global _alias_index
+    df, version = load_bible_snapshot()
+    index = _alias_index
+    if version is not None and version == index["version"]:
+        return index
+    alias_mapping, instructions = _parse_alias_rules(df)
+    # Текст клиента лемматизируется, поэтому в автомат добавляем и лемматизированные формы алиасов.
+    patterns = list(alias_mapping.items())
+    for (variant, normalized_value), lemma in zip(patterns, lemmatize_many(list(alias_mapping))):
+        if lemma and lemma != variant:
+            patterns.append((lemma, normalized_value))
+    index = {
+        "version": version,
+        "alias_mapping": alias_mapping,
+        "instructions": instructions,
+        "matcher": AliasMatcher(patterns),
+    }
+    _alias_index = index
+    logger.info(f"Индекс алиасов перестроен: {len(alias_mapping)} алиасов, версия Bible {version}")
+    return index
+
+_vehicle_index = {"version": None, "index": TrigramIndex([])}
+
+def get_vehicle_index():
+    """
+    Возвращает нечёткий индекс типов ТС из тарифов (исходные и лемматизированные названия).
+    Индекс перестраивается только при изменении версии снимка тарифов.
+    """
+    global _vehicle_index
+    from price import get_tariff_snapshot
+    snapshot = get_tariff_snapshot()
+    index = _vehicle_index
+    if snapshot["version"] is not None and snapshot["version"] == index["version"]:
+        return index["index"]
+    vehicle_types = list(snapshot["prices"])
+    entries = [(vt, [vt, lemma]) for vt, lemma in zip(vehicle_types, lemmatize_many(vehicle_types))]
+    index = {"version": snapshot["version"], "index": TrigramIndex(entries)}
+    _vehicle_index = index
+    logger.info(f"Индекс типов ТС перестроен: {len(vehicle_types)} типов, версия тарифов {snapshot['version']}")
+    return index["index"]
+
+def get_alias_mapping_and_instructions():
+    """
+    Возвращает два значения:
+        - alias_mapping: словарь, где ключи – варианты (алиасы), а значения – нормализованное наименование.
+        - instructions: список строк общей инструкции.
+    """
+    index = get_alias_index()
+    return index["alias_mapping"], index["instructions"]
+
 def get_vehicle_type(client_text):
     """
     Определяет тип транспортного средства на основе входящего текста.
-    Применяет лемматизацию и использует правила нормализации (алиасы), загруженные из Bible.xlsx.
+    Применяет лемматизацию и ищет все алиасы из Bible.xlsx за один проход (выигрывает самый длинный).
     Если найдено совпадение, возвращается нормализованное значение; иначе производится поиск по данным с сайта.
     """
     normalized_text = lemmatize_text(client_text)
-    logger.info(f"Normalized text: {normalized_text}")
+    logger.debug(f"Normalized text: {normalized_text}")
     
-    alias_mapping, _ = get_alias_mapping_and_instructions()
-    for variant, normalized_value in alias_mapping.items():
-        if variant in normalized_text:
-            logger.info(f"Alias mapping applied: найден '{variant}'; результат: '{normalized_value}'")
-            return normalized_value
-    # Если alias-правило не сработало, пробуем нечёткое сопоставление с данными с сайта
-    from price import get_ferry_prices
-    data = get_ferry_prices()
-    vehicle_types = list(data.keys())
-    matches = difflib.get_close_matches(client_text.lower(), [vt.lower() for vt in vehicle_types], n=1, cutoff=0.3)
-    if matches:
-        for vt in vehicle_types:
-            if vt.lower() == matches[0]:
-                logger.info(f"Тип транспортного средства найден по данным сайта: {vt}")
-                return vt.lower()
+    match = get_alias_index()["matcher"].best_match(normalized_text)
+    if match:
+        variant, normalized_value = match
+        logger.info(f"Alias mapping applied: найден '{variant}'; результат: '{normalized_value}'")
+        return normalized_value
+    # Если alias-правило не сработало, пробуем нечёткое сопоставление с типами ТС с сайта
+    candidates = get_vehicle_index().search(client_text, normalized_text)
+    if candidates:
+        vt, score = candidates[0]
+        logger.info(f"Тип транспортного средства найден по данным сайта: {vt} (оценка {score}, кандидаты: {candidates})")
+        return vt.lower()
     logger.info(get_rule("vehicle_type_not_identified"))
     return None
 
 def get_price_response(vehicle_type, direction="Ro_Ge"):
     return check_ferry_price(vehicle_type, direction)
 
-def get_openai_response(messages):
-    start_time = time.time()
-    attempt = 0
-    while True:
-        try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=messages,
-                max_tokens=150,
-                timeout=40
-            )
-            return response
-        except Exception as e:
-            logger.error(f"OpenAI error attempt {attempt+1}: {e}")
-            attempt += 1
-            if time.time() - start_time > 180:
-                return get_rule("openai_timeout_message")
-            time.sleep(2)
-
-def prepare_chat_context(client_code):
-    messages = []
-    alias_mapping, instructions = get_alias_mapping_and_instructions()
-    bible_df = load_bible_data()
-    if bible_df is None or bible_df.empty:
-        logger.warning(get_rule("bible_not_available"))
-        import pandas as pd
-        bible_df = pd.DataFrame(columns=["FAQ", "Answers", "Verification", "rule"])
+def build_chat_messages(instructions, history, user_message):
+    """Собирает запрос к OpenAI: общие инструкции Bible, история переписки клиента и новый вопрос."""
     # Используем общие инструкции (без '=') для формирования системного контекста
-    system_rule_text = "\n".join(instructions)
-    system_message = {"role": "system", "content": system_rule_text}
-    messages.append(system_message)
-    
-    spreadsheet_id = find_client_file_id(client_code)
-    if spreadsheet_id:
-        sheets_service = get_sheets_service()
-        result = sheets_service.spreadsheets().values().get(
-            spreadsheetId=spreadsheet_id,
-            range="Sheet1!A:B"
-        ).execute()
-        values = result.get("values", [])
-        if len(values) >= 2:
-            conversation_rows = values[2:]
-            logger.info(get_rule("client_conversation_found").format(count=len(conversation_rows), client=client_code))
-            for row in conversation_rows:
-                if len(row) >= 1 and row[0].strip():
-                    messages.append({"role": "user", "content": row[0].strip()})
-                if len(row) >= 2 and row[1].strip():
-                    messages.append({"role": "assistant", "content": row[1].strip()})
-    else:
-        logger.info(get_rule("client_file_not_found"))
+    messages = [{"role": "system", "content": "\n".join(instructions)}]
+    messages.extend(history)
+    messages.append({"role": "user", "content": user_message})
     return messages
 
+def load_chat_history(client_code):
+    try:
+        history = get_context_messages(client_code)
+        if history:
+            logger.info(get_rule("client_conversation_found").format(count=len(history), client=client_code))
+        return history
+    except Exception as e:
+        logger.error(f"Ошибка загрузки истории переписки клиента {client_code}: {e}")
+        return []
+
+def save_chat_turn(client_code, user_message, response_message):
+    """
+    Сохраняет пару вопрос/ответ в локальную историю и в журнал переписки;
+    в файл клиента её запишет фоновый воркер.
+    Если локальный журнал недоступен, переписка записывается в файл клиента синхронно.
+    """
+    try:
+        append_turn(client_code, user_message, response_message)
+    except Exception as e:
+        logger.error(f"Ошибка записи в локальную историю переписки клиента {client_code}: {e}")
+    try:
+        enqueue_turn(client_code, user_message, response_message)
+    except Exception as e:
+        logger.error(f"Ошибка записи в журнал переписки, пишем в файл клиента напрямую: {e}")
+        add_message_to_client_file(client_code, user_message, is_assistant=False)
+        add_message_to_client_file(client_code, response_message, is_assistant=True)
+
 @app.route('/register-client', methods=['POST'])
 def register_client():
     try:
         data = request.json
-        logger.info(f"Запрос на регистрацию клиента: {data}")
+        logger.info("Запрос на регистрацию клиента: %s", data)
         result = register_or_update_client(data)
         return jsonify(result), 200
     except Exception as e:
         logger.error(f"Ошибка в /register-client: {e}")
         return jsonify({'error': str(e)}), 400
 
+@app.route('/register-clients', methods=['POST'])
+def register_clients():
+    """
+    Массовая регистрация клиентов: JSON-список (или {"clients": [...]}) либо CSV (Content-Type: text/csv)
+    со столбцами name, email, phone. Параметр create_files=0 отключает создание файлов переписки.
+    """
+    try:
+        if request.mimetype == "text/csv":
+            clients = parse_clients(request.get_data(as_text=True), "csv")
+        else:
+            clients = parse_clients(request.get_data(as_text=True), "json")
+        logger.info(f"Запрос на массовую регистрацию: {len(clients)} клиентов")
+        create_files = request.args.get("create_files", "1") != "0"
+        result = register_clients_bulk(clients, create_files=create_files)
+        return jsonify(result), 200
+    except Exception as e:
+        logger.error(f"Ошибка в /register-clients: {e}")
+        return jsonify({'error': str(e)}), 400
+
 @app.route('/verify-code', methods=['POST'])
 def verify_code():
     try:
         data = request.json
-        logger.info(f"Запрос на верификацию кода: {data}")
+        logger.info("Запрос на верификацию кода: %s", data)
         code = data.get('code', '')
         client_data = verify_client_code(code)
         if client_data:
@@ -240,91 +272,227 @@ def verify_code():
         logger.error(f"Ошибка в /verify-code: {e}")
         return jsonify({'error': str(e)}), 400
 
+def answer_guiding_question(client_code, pending, user_message):
+    """Обрабатывает ответ клиента на уточняющий вопрос и возвращает следующий вопрос или итоговую цену."""
+    pending.setdefault("answers", []).append(user_message)
+    pending["current_index"] += 1
+    if pending["current_index"] < len(pending["guiding_questions"]):
+        pending_guiding.set(client_code, pending)
+        return pending["guiding_questions"][pending["current_index"]]
+    direction = pending.get("direction", "Ro_Ge")
+    try:
+        price = get_tariff_price(pending["vehicle_type"], direction)
+    except Exception as e:
+        logger.error(f"Ошибка при получении тарифов с сайта: {e}")
+        price = None
+    adr = False
+    driver_info = None
+    for ans in pending["answers"]:
+        if get_rule("driver_without").lower() in ans.lower():
+            driver_info = "without"
+        elif get_rule("driver_with").lower() in ans.lower():
+            driver_info = "with"
+        if get_rule("adr_condition").lower() in ans.lower():
+            adr = True
+    if price and price["amount"] is not None:
+        base_price = price["amount"]
+        final_cost = calculate_final_cost(base_price, without_driver=driver_info == "without", adr=adr)
+        final_price = get_rule("tariff_response_template").format(base_price=base_price, final_cost=final_cost)
+    else:
+        base_price_str = price["text"] if price else pending.get("base_price", "")
+        final_price = get_rule("fallback_price_message").format(base_price=base_price_str, answers=", ".join(pending['answers']))
+    pending_guiding.delete(client_code)
+    return f"{get_rule('thank_you_message')} {final_price}"
+
+def is_price_question(user_message):
+    return any(keyword in user_message.lower() for keyword in PRICE_KEYWORDS)
+
+def answer_price_question(user_message):
+    """Определяет направление и тип ТС по тексту вопроса и возвращает ответ с ценой."""
+    msg_lower = user_message.lower()
+    if "поти" in msg_lower and "констанц" in msg_lower:
+        if msg_lower.index("поти") < msg_lower.index("констанц"):
+            direction = "Ge_Ro"
+        else:
+            direction = "Ro_Ge"
+    else:
+        direction = "Ro_Ge"
+
+    vehicle_type = get_vehicle_type(user_message)
+    if not vehicle_type:
+        return get_rule("vehicle_type_not_found")
+    base_price_str = get_price_response(vehicle_type, direction)
+    if base_price_str:
+        return base_price_str
+    return get_rule("tariff_info_missing").format(vehicle_type=vehicle_type)
+
+# Размер общего пула потоков для блокирующих шагов async-обработчиков (/chat).
+CHAT_EXECUTOR_WORKERS = int(os.getenv("CHAT_EXECUTOR_WORKERS", "16"))
+
+_executor_lock = threading.Lock()
+_executor = {"pool": None, "pid": None}
+
+def get_chat_executor():
+    """
+    Общий пул потоков процесса. Flask выполняет каждый async-обработчик в новом цикле событий
+    (asyncio.run), поэтому пул по умолчанию (run_in_executor(None, ...)) создавался бы заново
+    на каждый запрос. У каждого воркера gunicorn пул свой (создаётся заново после fork).
+    """
+    if _executor["pid"] != os.getpid():
+        with _executor_lock:
+            if _executor["pid"] != os.getpid():
+                _executor["pool"] = ThreadPoolExecutor(max_workers=CHAT_EXECUTOR_WORKERS, thread_name_prefix="chat")
+                _executor["pid"] = os.getpid()
+    return _executor["pool"]
+
+async def _in_thread(func, *args):
+    """Выполняет блокирующую функцию в общем пуле потоков (с контекстом запроса для tracing) и возвращает её результат."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(get_chat_executor(), context.run, func, *args)
+
+async def prepare_chat_async(client_code, user_message):
+    """
+    Асинхронная подготовка ответа /chat: независимые операции (сессия уточняющих вопросов,
+    Bible и индекс алиасов, история переписки, лемматизация вопроса) выполняются одновременно,
+    поэтому задержка определяется самой медленной из них, а не их суммой.
+    Возвращает {"reply": текст}, если ответ готов без OpenAI (уточняющие вопросы, цены, кэш),
+    иначе {"messages": запрос к OpenAI, "question_key": ..., "bible_version": ..., "history": ...}.
+    """
+    price_question = is_price_question(user_message)
+    # Отметка Last Visit только запоминается в памяти – запись в Google Sheets выполняется пачками в фоне.
+    update_last_visit(client_code)
+    pending_task = asyncio.ensure_future(_in_thread(pending_guiding.get, client_code))
+    alias_index_task = asyncio.ensure_future(_in_thread(get_alias_index))
+    llm_tasks = None
+    if not price_question:
+        llm_tasks = (
+            asyncio.ensure_future(_in_thread(load_bible_snapshot)),
+            asyncio.ensure_future(_in_thread(lemmatize_text, user_message)),
+            asyncio.ensure_future(_in_thread(load_chat_history, client_code)),
+        )
+    try:
+        pending = await pending_task
+        if pending:
+            return {"reply": await _in_thread(answer_guiding_question, client_code, pending, user_message)}
+        if price_question:
+            await alias_index_task
+            return {"reply": await _in_thread(answer_price_question, user_message)}
+
+        (bible_df, bible_version), question_key, history = await asyncio.gather(*llm_tasks)
+        cached_reply = await _in_thread(lookup_answer, question_key, bible_df, bible_version, lemmatize_many, history)
+        if cached_reply:
+            logger.info(f"Ответ клиенту {client_code} найден в кэше ответов.")
+            return {"reply": cached_reply}
+        if bible_df is None or bible_df.empty:
+            logger.warning(get_rule("bible_not_available"))
+        index = await alias_index_task
+        return {
+            "messages": build_chat_messages(index["instructions"], history, user_message),
+            "question_key": question_key,
+            "bible_version": bible_version,
+            "history": history,
+        }
+    finally:
+        # Дожидаемся фоновых операций, чтобы их ошибки не терялись.
+        pending_tasks = [alias_index_task] + list(llm_tasks or [])
+        for result in await asyncio.gather(*pending_tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка фоновой операции /chat: {result}")
+
+async def handle_chat_async(client_code, user_message):
+    """Возвращает ответ ассистента на сообщение клиента; запрос к OpenAI выполняется на цикле llm_gateway."""
+    prepared = await prepare_chat_async(client_code, user_message)
+    if "reply" in prepared:
+        return prepared["reply"]
+    try:
+        openai_resp = await asyncio.wrap_future(llm_gateway.submit(llm_gateway.acomplete(prepared["messages"])))
+        assistant_reply = openai_resp['choices'][0]['message']['content']
+        store_answer(prepared["question_key"], prepared["bible_version"], assistant_reply, prepared["history"])
+    except Exception as e:
+        logger.error(f"Ошибка OpenAI: {e}")
+        assistant_reply = CHAT_ERROR_MESSAGE
+    return assistant_reply
+
 @app.route('/chat', methods=['POST'])
-def chat():
+async def chat():
     try:
         data = request.json
-        logger.info(f"Запрос на чат: {data}")
+        logger.info("Запрос на чат: %s", data)
         user_message = data.get("message", "")
         client_code = data.get("client_code", "")
         if not user_message or not client_code:
             logger.error(get_rule("empty_message_error"))
             return jsonify({'error': get_rule("empty_message_error")}), 400
 
-        update_last_visit(client_code)
         update_activity_status()
-        
-        if client_code in pending_guiding:
-            pending = pending_guiding[client_code]
-            pending.setdefault("answers", []).append(user_message)
-            pending["current_index"] += 1
-            if pending["current_index"] < len(pending["guiding_questions"]):
-                response_message = pending["guiding_questions"][pending["current_index"]]
-            else:
-                base_price_str = pending.get("base_price", get_price_response(pending["vehicle_type"], direction="Ro_Ge"))
-                try:
-                    base_price = parse_price(base_price_str)
-                    multiplier = 1.0
-                    fee = 0
-                    driver_info = None
-                    for ans in pending["answers"]:
-                        if get_rule("driver_without").lower() in ans.lower():
-                            driver_info = "without"
-                        elif get_rule("driver_with").lower() in ans.lower():
-                            driver_info = "with"
-                        if get_rule("adr_condition").lower() in ans.lower():
-                            multiplier = 1.2
-                    if driver_info == "without":
-                        fee = 100
-                    final_cost = (base_price + fee) * multiplier
-                    final_price = get_rule("tariff_response_template").format(base_price=base_price, final_cost=final_cost)
-                except Exception as ex:
-                    final_price = get_rule("fallback_price_message").format(base_price=base_price_str, answers=", ".join(pending['answers']))
-                response_message = f"{get_rule('thank_you_message')} {final_price}"
-                del pending_guiding[client_code]
-        elif any(keyword in user_message.lower() for keyword in PRICE_KEYWORDS):
-            msg_lower = user_message.lower()
-            if "поти" in msg_lower and "констанц" in msg_lower:
-                if msg_lower.index("поти") < msg_lower.index("констанц"):
-                    direction = "Ge_Ro"
-                else:
-                    direction = "Ro_Ge"
-            else:
-                direction = "Ro_Ge"
+        response_message = await handle_chat_async(client_code, user_message)
+        logger.info("Ответ клиенту %s: %s символов", client_code, len(response_message))
+        response = jsonify({'reply': response_message})
+        # Переписка сохраняется после отправки ответа клиенту
+        response.call_on_close(lambda: save_chat_turn(client_code, user_message, response_message))
+        return response, 200
+    except Exception as e:
+        logger.error(f"Ошибка в /chat: {e}")
+        return jsonify({'error': str(e)}), 500
 
-            vehicle_type = get_vehicle_type(user_message)
-            if not vehicle_type:
-                response_message = get_rule("vehicle_type_not_found")
-            else:
-                base_price_str = get_price_response(vehicle_type, direction)
-                if base_price_str:
-                    response_message = base_price_str
-                else:
-                    response_message = get_rule("tariff_info_missing").format(vehicle_type=vehicle_type)
-        else:
-            messages = prepare_chat_context(client_code)
-            messages.append({"role": "user", "content": user_message})
-            try:
-                openai_resp = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=messages,
-                    max_tokens=150,
-                    timeout=30
-                )
-                assistant_reply = openai_resp['choices'][0]['message']['content']
-            except Exception as e:
-                logger.error(f"Ошибка OpenAI: {e}")
-                assistant_reply = "Извините, произошла ошибка при обработке запроса."
-            response_message = assistant_reply
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
-        add_message_to_client_file(client_code, user_message, is_assistant=False)
-        add_message_to_client_file(client_code, response_message, is_assistant=True)
-        logger.info(f"Ответ: {response_message}")
-        return jsonify({'reply': response_message}), 200
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Потоковый вариант /chat (Server-Sent Events): части ответа OpenAI отправляются клиенту
+    по мере генерации (event: delta), в конце – полный ответ (event: done).
+    Готовые ответы (уточняющие вопросы, цены, кэш) отправляются одним событием delta.
+    Переписка сохраняется после завершения потока.
+    """
+    try:
+        data = request.json
+        logger.info("Запрос на потоковый чат: %s", data)
+        user_message = data.get("message", "")
+        client_code = data.get("client_code", "")
+        if not user_message or not client_code:
+            logger.error(get_rule("empty_message_error"))
+            return jsonify({'error': get_rule("empty_message_error")}), 400
+
+        update_activity_status()
+        prepared = app.ensure_sync(prepare_chat_async)(client_code, user_message)
     except Exception as e:
-        logger.error(f"Ошибка в /chat: {e}")
+        logger.error(f"Ошибка в /chat/stream: {e}")
         return jsonify({'error': str(e)}), 500
 
+    def generate():
+        parts = []
+        completed = False
+        try:
+            if "reply" in prepared:
+                parts.append(prepared["reply"])
+                yield _sse("delta", {"text": prepared["reply"]})
+            else:
+                try:
+                    for delta in llm_gateway.stream(prepared["messages"]):
+                        parts.append(delta)
+                        yield _sse("delta", {"text": delta})
+                    store_answer(prepared["question_key"], prepared["bible_version"], "".join(parts), prepared["history"])
+                except Exception as e:
+                    logger.error(f"Ошибка OpenAI: {e}")
+                    if not parts:
+                        parts.append(CHAT_ERROR_MESSAGE)
+                        yield _sse("delta", {"text": CHAT_ERROR_MESSAGE})
+                    yield _sse("error", {"error": str(e)})
+            completed = True
+            yield _sse("done", {"reply": "".join(parts)})
+        finally:
+            response_message = "".join(parts)
+            if not completed:
+                logger.warning(f"Клиент {client_code} прервал потоковый ответ после {len(response_message)} символов.")
+            logger.info("Ответ клиенту %s: %s символов", client_code, len(response_message))
+            if response_message:
+                save_chat_turn(client_code, user_message, response_message)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=headers)
+
 @app.route('/get-price', methods=['POST'])
 def get_price():
     try:
@@ -347,6 +515,29 @@ def get_price():
 def home():
     return jsonify({"status": get_rule("server_running")}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Гистограммы длительности запросов и внешних вызовов в формате Prometheus (по всем воркерам, см. tracing.METRICS_STORE)."""
+    return Response(tracing.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    from price import get_tariff_cache_stats
+    return jsonify({
+        "bible": get_bible_cache_stats(),
+        "tariffs": get_tariff_cache_stats(),
+        "journal": get_journal_stats(),
+        "last_visit": get_last_visit_stats(),
+        "client_mirror": get_mirror_stats(),
+        "llm": get_llm_stats(),
+        "answers": get_answer_cache_stats(),
+        "lemmatizer": get_lemmatizer_stats(),
+        "startup": startup.get_timings(),
+        "logging": logging_setup.get_logging_stats(),
+        "notifications": get_notifier_stats(),
+        "telegram": get_telegram_stats(),
+    }), 200
+
 from telegram.ext import ConversationHandler
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -356,6 +547,13 @@ if not TELEGRAM_BOT_TOKEN:
 
 BIBLE_ASK_ACTION, BIBLE_ASK_QUESTION, BIBLE_ASK_ANSWER = range(3)
 
+# Состояние диалога /bible хранится в общем хранилище сессий, а не в памяти ConversationHandler:
+# обновления Telegram одного чата могут приходить в разные воркеры gunicorn.
+bible_sessions = create_session_store()
+
+def _bible_session_key(update):
+    return f"telegram_bible:{update.effective_chat.id}"
+
 async def bible_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text(get_rule("telegram_bible_start"))
     return BIBLE_ASK_ACTION
@@ -383,7 +581,8 @@ async def ask_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     question = context.user_data.get('question')
     logger.info(f"Сохранение пары: {question} | {answer}")
     try:
-        save_bible_pair(question, answer)
+        # Запись в Google Sheets не должна блокировать цикл событий, на котором обрабатываются другие обновления.
+        await asyncio.to_thread(save_bible_pair, question, answer)
     except Exception as e:
         logger.error(f"Ошибка при сохранении пары в Bible: {e}")
     await update.message.reply_text(get_rule("telegram_pair_saved"))
@@ -393,41 +592,194 @@ async def cancel_bible(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     await update.message.reply_text(get_rule("telegram_cancel"))
     return ConversationHandler.END
 
-bible_conv_handler = ConversationHandler(
-    entry_points=[CommandHandler("bible", bible_start)],
-    states={
-        BIBLE_ASK_ACTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_action)],
-        BIBLE_ASK_QUESTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_question)],
-        BIBLE_ASK_ANSWER: [MessageHandler(filters.TEXT & ~filters.COMMAND, ask_answer)],
-    },
-    fallbacks=[CommandHandler("cancel", cancel_bible)]
-)
+BIBLE_STEPS = {
+    BIBLE_ASK_ACTION: ask_action,
+    BIBLE_ASK_QUESTION: ask_question,
+    BIBLE_ASK_ANSWER: ask_answer,
+}
 
-application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
-bot = application.bot
-application.add_handler(bible_conv_handler)
+async def _run_bible_step(update, context, step, session):
+    """
+    Выполняет шаг диалога /bible с данными сессии в context.user_data и сохраняет
+    следующее состояние в общем хранилище (или удаляет сессию по завершении диалога).
+    """
+    key = _bible_session_key(update)
+    context.user_data.clear()
+    context.user_data.update(session.get("data", {}))
+    state = await step(update, context)
+    if state == ConversationHandler.END:
+        await asyncio.to_thread(bible_sessions.delete, key)
+    else:
+        await asyncio.to_thread(bible_sessions.set, key, {"state": state, "data": dict(context.user_data)})
+
+async def bible_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await _run_bible_step(update, context, bible_start, {})
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    session = await asyncio.to_thread(bible_sessions.get, _bible_session_key(update))
+    if session is not None:
+        await _run_bible_step(update, context, cancel_bible, session)
+
+async def bible_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    session = await asyncio.to_thread(bible_sessions.get, _bible_session_key(update))
+    if session is None:
+        return
+    await _run_bible_step(update, context, BIBLE_STEPS[session["state"]], session)
+
+bible_handlers = [
+    CommandHandler("bible", bible_command),
+    CommandHandler("cancel", cancel_command),
+    MessageHandler(filters.TEXT & ~filters.COMMAND, bible_message),
+]
+
+_telegram_lock = threading.Lock()
+_telegram = {"application": None}
+
+def get_telegram_application():
+    """Создаёт Telegram Application при первом обращении (а не при импорте модуля)."""
+    if _telegram["application"] is None:
+        with _telegram_lock:
+            if _telegram["application"] is None:
+                application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+                application.add_handlers(bible_handlers)
+                _telegram["application"] = application
+    return _telegram["application"]
+
+_telegram_loop = {"loop": None, "pid": None, "initialized": None}
+
+def get_telegram_loop():
+    """
+    Возвращает цикл событий Telegram текущего процесса. Цикл работает в отдельном потоке;
+    у каждого воркера gunicorn он свой (создаётся заново после fork).
+    """
+    if _telegram_loop["pid"] != os.getpid():
+        with _telegram_lock:
+            if _telegram_loop["pid"] != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="telegram-loop", daemon=True).start()
+                _telegram_loop.update({"loop": loop, "pid": os.getpid(), "initialized": None})
+    return _telegram_loop["loop"]
+
+def run_telegram(coro, timeout=60):
+    """Выполняет корутину на цикле Telegram текущего процесса и ждёт результат."""
+    return asyncio.run_coroutine_threadsafe(coro, get_telegram_loop()).result(timeout=timeout)
+
+async def _ensure_telegram_initialized(application):
+    if _telegram_loop["initialized"] is None:
+        _telegram_loop["initialized"] = asyncio.ensure_future(application.initialize())
+    try:
+        await _telegram_loop["initialized"]
+    except Exception:
+        _telegram_loop["initialized"] = None
+        raise
+
+async def _process_telegram_update(application, update):
+    await _ensure_telegram_initialized(application)
+    await application.process_update(update)
+
+# Сколько обновлений Telegram может ждать обработки; сверх этого вебхук отвечает 503 и Telegram повторит доставку.
+TELEGRAM_UPDATE_QUEUE_SIZE = int(os.getenv("TELEGRAM_UPDATE_QUEUE_SIZE", "1000"))
+# Сколько обновлений обрабатывается одновременно (обновления одного чата – всегда по очереди).
+TELEGRAM_UPDATE_CONCURRENCY = int(os.getenv("TELEGRAM_UPDATE_CONCURRENCY", "16"))
+
+_telegram_updates_lock = threading.Lock()
+_telegram_updates = {
+    "pending": 0, "received": 0, "processed": 0, "failed": 0, "duplicates": 0, "rejected": 0,
+    "recent_ids": collections.deque(maxlen=1000), "pid": None,
+}
+# Состояние цикла Telegram (создаётся на нём): семафор параллельности и блокировки чатов.
+_telegram_workers = {"semaphore": None, "chat_locks": {}}
+
+async def _handle_queued_update(application, update):
+    """Обрабатывает обновление из очереди: параллельно с другими чатами, по порядку внутри чата."""
+    if _telegram_workers["semaphore"] is None:
+        _telegram_workers["semaphore"] = asyncio.Semaphore(TELEGRAM_UPDATE_CONCURRENCY)
+    chat_locks = _telegram_workers["chat_locks"]
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    entry = chat_locks.setdefault(chat_id, {"lock": asyncio.Lock(), "users": 0})
+    entry["users"] += 1
+    failed = False
+    try:
+        # Блокировка чата захватывается первой: asyncio.Lock честный, поэтому порядок обновлений сохраняется.
+        async with entry["lock"], _telegram_workers["semaphore"]:
+            await _process_telegram_update(application, update)
+    except Exception as e:
+        failed = True
+        logger.error(f"Ошибка обработки обновления Telegram {update.update_id}: {e}")
+    finally:
+        entry["users"] -= 1
+        if not entry["users"]:
+            chat_locks.pop(chat_id, None)
+        with _telegram_updates_lock:
+            _telegram_updates["pending"] -= 1
+            _telegram_updates["failed" if failed else "processed"] += 1
+
+def enqueue_telegram_update(application, update):
+    """
+    Ставит обновление в очередь цикла Telegram и сразу возвращается.
+    Возвращает False, если очередь переполнена; повторно доставленные обновления пропускаются.
+    """
+    with _telegram_updates_lock:
+        if _telegram_updates["pid"] != os.getpid():
+            # После fork счётчики и очередь процесса-родителя не относятся к этому воркеру.
+            _telegram_updates.update(pending=0, pid=os.getpid())
+            _telegram_updates["recent_ids"].clear()
+        if update.update_id in _telegram_updates["recent_ids"]:
+            _telegram_updates["duplicates"] += 1
+            return True
+        if _telegram_updates["pending"] >= TELEGRAM_UPDATE_QUEUE_SIZE:
+            _telegram_updates["rejected"] += 1
+            return False
+        _telegram_updates["recent_ids"].append(update.update_id)
+        _telegram_updates["pending"] += 1
+        _telegram_updates["received"] += 1
+    asyncio.run_coroutine_threadsafe(_handle_queued_update(application, update), get_telegram_loop())
+    return True
+
+def get_telegram_stats():
+    with _telegram_updates_lock:
+        return {key: value for key, value in _telegram_updates.items() if key not in ("recent_ids", "pid")}
 
 @app.route('/webhook', methods=['POST'])
 def telegram_webhook():
     try:
+        application = get_telegram_application()
         data = request.get_json(force=True)
-        update = Update.de_json(data, bot)
-        global_loop.run_until_complete(application.process_update(update))
+        update = Update.de_json(data, application.bot)
+        if not enqueue_telegram_update(application, update):
+            logger.warning("Очередь обновлений Telegram переполнена, обновление отклонено.")
+            return 'Busy', 503
         return 'OK', 200
     except Exception as e:
         logger.error(f"Ошибка обновления Telegram: {e}")
         return jsonify({'error': str(e)}), 500
 
-global_loop = asyncio.new_event_loop()
-asyncio.set_event_loop(global_loop)
+def get_warm_up_tasks():
+    """Тяжёлые ресурсы, которые прогреваются параллельно при старте (см. startup.STARTUP_WARMUP)."""
+    from clientdata import registry
+    return {
+        "lemmatizer": lemmatizer_warm_up,
+        "bible": get_alias_index,
+        "tariffs": get_vehicle_index,
+        "client_registry": registry.load,
+        "client_file_index": warm_client_file_index,
+        "telegram": get_telegram_application,
+    }
+
+startup.record("import.server", time.perf_counter() - _IMPORT_STARTED)
+logger.info(f"Модуль server импортирован за {time.perf_counter() - _IMPORT_STARTED:.2f} с.")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
     WEBHOOK_URL = os.getenv("WEBHOOK_URL")
     if not WEBHOOK_URL:
         logger.error(get_rule("webhook_url_missing"))
         exit(1)
-    global_loop.run_until_complete(application.initialize())
-    global_loop.run_until_complete(bot.set_webhook(WEBHOOK_URL))
+    startup.start_warm_up(get_warm_up_tasks())
+    start_journal_worker()
+    application = get_telegram_application()
+    run_telegram(_ensure_telegram_initialized(application))
+    run_telegram(application.bot.set_webhook(WEBHOOK_URL))
     logger.info(f"Webhook установлен: {WEBHOOK_URL}")
     logger.info(f"Сервер запущен на порту {port}")
     app.run(host='0.0.0.0', port=port, debug=False, threaded=True)
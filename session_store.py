@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import logging
+import threading
+from abc import ABC, abstractmethod
+from local_db import ensure_schema
+
+logger = logging.getLogger(__name__)
+
+# Хранилище сессий уточняющих вопросов: sqlite (общее для всех воркеров) или memory (только один процесс).
+GUIDING_SESSION_STORE = os.getenv("GUIDING_SESSION_STORE", "sqlite")
+# Через сколько секунд бездействия сессия уточняющих вопросов забывается.
+GUIDING_SESSION_TTL = float(os.getenv("GUIDING_SESSION_TTL", "3600"))
+
+class GuidingSessionStore(ABC):
+    """
+    Интерфейс хранилища сессий уточняющих вопросов (client_code -> словарь состояния).
+    Для другого бэкенда (например, Redis) достаточно реализовать get/set/delete
+    и зарегистрировать фабрику через register_session_store.
+    """
+
+    @abstractmethod
+    def get(self, client_code):
+        pass
+
+    @abstractmethod
+    def set(self, client_code, session):
+        pass
+
+    @abstractmethod
+    def delete(self, client_code):
+        pass
+
+    def __contains__(self, client_code):
+        return self.get(client_code) is not None
+
+class MemorySessionStore(GuidingSessionStore):
+    """Сессии в памяти процесса – подходит только для запуска в одном процессе."""
+
+    def __init__(self, ttl=GUIDING_SESSION_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def get(self, client_code):
+        with self._lock:
+            item = self._sessions.get(client_code)
+            if item is None:
+                return None
+            session, expires_at = item
+            if time.time() >= expires_at:
+                del self._sessions[client_code]
+                return None
+            return json.loads(session)
+
+    def set(self, client_code, session):
+        with self._lock:
+            self._sessions[client_code] = (json.dumps(session, ensure_ascii=False), time.time() + self.ttl)
+
+    def delete(self, client_code):
+        with self._lock:
+            self._sessions.pop(client_code, None)
+
+class SQLiteSessionStore(GuidingSessionStore):
+    """Сессии в локальной SQLite-базе (LOCAL_DB_PATH) – общие для всех воркеров на одной машине."""
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS guiding_sessions (
+        client_code TEXT PRIMARY KEY,
+        session TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, ttl=GUIDING_SESSION_TTL):
+        self.ttl = ttl
+
+    def _conn(self):
+        return ensure_schema("guiding_sessions", self._SCHEMA)
+
+    def get(self, client_code):
+        row = self._conn().execute(
+            "SELECT session, expires_at FROM guiding_sessions WHERE client_code = ?", (str(client_code),)
+        ).fetchone()
+        if row is None:
+            return None
+        if time.time() >= row[1]:
+            self.delete(client_code)
+            return None
+        return json.loads(row[0])
+
+    def set(self, client_code, session):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO guiding_sessions (client_code, session, expires_at) VALUES (?, ?, ?)",
+            (str(client_code), json.dumps(session, ensure_ascii=False), time.time() + self.ttl)
+        )
+
+    def delete(self, client_code):
+        self._conn().execute("DELETE FROM guiding_sessions WHERE client_code = ?", (str(client_code),))
+
+_factories = {
+    "memory": MemorySessionStore,
+    "sqlite": SQLiteSessionStore,
+}
+
+def register_session_store(name, factory):
+    """Регистрирует дополнительную реализацию хранилища, выбираемую через GUIDING_SESSION_STORE."""
+    _factories[name] = factory
+
+def create_session_store(name=None):
+    name = name or GUIDING_SESSION_STORE
+    if name not in _factories:
+        raise ValueError(f"Неизвестное хранилище сессий: {name}")
+    logger.info(f"Хранилище сессий уточняющих вопросов: {name}")
+    return _factories[name]()
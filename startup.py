@@ -0,0 +1,54 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Режим прогрева при старте: background – в фоне, blocking – до начала приёма запросов, off – без прогрева.
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background")
+
+_lock = threading.Lock()
+_timings = {}
+
+def record(name, seconds):
+    """Запоминает длительность этапа запуска (в секундах)."""
+    with _lock:
+        _timings[name] = round(seconds, 3)
+
+def _run_task(name, func):
+    started = time.perf_counter()
+    try:
+        func()
+        status = "ok"
+    except Exception as e:
+        status = f"error: {e}"
+        logger.error(f"Ошибка прогрева '{name}': {e}")
+    record(f"warmup.{name}", time.perf_counter() - started)
+    return name, status
+
+def run_warm_up(tasks):
+    """
+    Параллельно выполняет задачи прогрева ({имя: функция}) и логирует время каждой.
+    Ошибка одной задачи не мешает остальным: ресурс будет загружен лениво при первом запросе.
+    """
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, len(tasks)), thread_name_prefix="warmup") as executor:
+        results = dict(executor.map(lambda item: _run_task(*item), tasks.items()))
+    record("warmup.total", time.perf_counter() - started)
+    logger.info(f"Прогрев завершён за {time.perf_counter() - started:.2f} с: {results}; время этапов: {get_timings()}")
+    return results
+
+def start_warm_up(tasks, mode=STARTUP_WARMUP):
+    """Запускает прогрев в выбранном режиме (STARTUP_WARMUP)."""
+    if mode == "off":
+        logger.info("Прогрев при старте отключён (STARTUP_WARMUP=off).")
+    elif mode == "blocking":
+        run_warm_up(tasks)
+    else:
+        threading.Thread(target=run_warm_up, args=(tasks,), name="warmup", daemon=True).start()
+
+def get_timings():
+    with _lock:
+        return dict(_timings)
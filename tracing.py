@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Добавлять ли к ответам заголовок Server-Timing с разбивкой времени запроса по внешним вызовам.
+# Заголовок видят все клиенты, поэтому по умолчанию он выключен (включать для отладки).
+TRACE_SERVER_TIMING = os.getenv("TRACE_SERVER_TIMING", "0") == "1"
+# Границы корзин гистограмм (в секундах).
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Где собираются гистограммы /metrics: sqlite – общие для всех воркеров gunicorn (каждый процесс
+# раз в METRICS_FLUSH_INTERVAL секунд добавляет свои приращения в LOCAL_DB_PATH), memory – только текущий процесс.
+METRICS_STORE = os.getenv("METRICS_STORE", "sqlite")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+logger = logging.getLogger(__name__)
+
+_METRICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics_histograms (
+    metric TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (metric, labels, bucket)
+);
+"""
+# Служебные номера "корзин" для общего числа наблюдений и их суммы.
+_COUNT_BUCKET = -1
+_SUM_BUCKET = -2
+
+class Trace:
+    """Разбивка времени одного запроса: {имя операции: [число вызовов, суммарное время]}."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = {}
+
+    def add(self, name, seconds):
+        with self._lock:
+            item = self.spans.setdefault(name, [0, 0.0])
+            item[0] += 1
+            item[1] += seconds
+
+    def server_timing(self, total=None):
+        """Значение заголовка Server-Timing: 'sheets.spreadsheets.values.get;dur=12.3;desc="x2", ...'."""
+        with self._lock:
+            spans = sorted(self.spans.items(), key=lambda item: -item[1][1])
+        parts = [f'{name};dur={seconds * 1000:.1f};desc="x{count}"' for name, (count, seconds) in spans]
+        if total is not None:
+            parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+class Histogram:
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+
+    def merge(self, other):
+        for i, value in enumerate(other.counts):
+            self.counts[i] += value
+        self.count += other.count
+        self.sum += other.sum
+
+_current = ContextVar("caec_trace", default=None)
+_metrics_lock = threading.Lock()
+# В режиме sqlite – приращения, ещё не записанные в общую базу; в режиме memory – все значения процесса.
+_histograms = {}
+_flusher_lock = threading.Lock()
+_flusher = {"pid": None}
+
+def _observe(metric, labels, seconds):
+    if METRICS_STORE == "sqlite" and _flusher["pid"] != os.getpid():
+        start_metrics_flusher()
+    key = (metric, labels)
+    with _metrics_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+def _metrics_conn():
+    from local_db import ensure_schema
+    return ensure_schema("metrics_histograms", _METRICS_SCHEMA)
+
+def flush_metrics():
+    """Добавляет накопленные процессом приращения гистограмм в общую базу (режим sqlite)."""
+    with _metrics_lock:
+        pending = dict(_histograms)
+        _histograms.clear()
+    if not pending:
+        return
+    rows = []
+    for (metric, labels), histogram in pending.items():
+        key = json.dumps(labels, ensure_ascii=False)
+        rows += [(metric, key, i, value) for i, value in enumerate(histogram.counts) if value]
+        rows.append((metric, key, _COUNT_BUCKET, histogram.count))
+        rows.append((metric, key, _SUM_BUCKET, histogram.sum))
+    try:
+        conn = _metrics_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO metrics_histograms (metric, labels, bucket, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(metric, labels, bucket) DO UPDATE SET value = value + excluded.value",
+                rows
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    except Exception:
+        # Приращения возвращаются и будут записаны при следующей попытке.
+        with _metrics_lock:
+            for key, histogram in pending.items():
+                _histograms.setdefault(key, Histogram()).merge(histogram)
+        raise
+
+def _run_metrics_flusher():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush_metrics()
+        except Exception as e:
+            logger.error(f"Ошибка записи метрик в локальную базу: {e}")
+
+def start_metrics_flusher():
+    """Запускает фоновую запись метрик в общую базу в текущем процессе (один раз; после fork – заново)."""
+    with _flusher_lock:
+        if _flusher["pid"] == os.getpid():
+            return
+        if _flusher["pid"] is not None:
+            # Приращения родительского процесса уже учтёт он сам.
+            with _metrics_lock:
+                _histograms.clear()
+        else:
+            atexit.register(flush_metrics)
+        threading.Thread(target=_run_metrics_flusher, name="metrics-flusher", daemon=True).start()
+        _flusher["pid"] = os.getpid()
+
+def _load_shared_histograms():
+    """Суммарные гистограммы всех процессов из общей базы."""
+    histograms = {}
+    for metric, labels, bucket, value in _metrics_conn().execute(
+        "SELECT metric, labels, bucket, value FROM metrics_histograms"
+    ):
+        key = (metric, tuple(tuple(pair) for pair in json.loads(labels)))
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram()
+        if bucket == _COUNT_BUCKET:
+            histogram.count = int(value)
+        elif bucket == _SUM_BUCKET:
+            histogram.sum = value
+        elif bucket < len(histogram.counts):
+            histogram.counts[bucket] = int(value)
+    return histograms
+
+def current_trace():
+    return _current.get()
+
+def start_trace():
+    """Начинает разбивку времени для текущего запроса. Возвращает (trace, token для finish_trace)."""
+    trace = Trace()
+    return trace, _current.set(trace)
+
+def finish_trace(token, endpoint, status):
+    """Завершает разбивку текущего запроса и учитывает его длительность в гистограмме запросов."""
+    trace = _current.get()
+    _current.reset(token)
+    if trace is None:
+        return None, 0.0
+    total = time.perf_counter() - trace.started
+    _observe("caec_http_request_duration_seconds", (("endpoint", endpoint), ("status", str(status))), total)
+    return trace, total
+
+@contextmanager
+def span(name):
+    """
+    Замеряет внешний вызов или шаг обработки: время попадает в гистограмму /metrics и,
+    если вызов выполняется в рамках запроса, в его разбивку (заголовок Server-Timing).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        _observe("caec_span_duration_seconds", (("span", name),), seconds)
+        trace = _current.get()
+        if trace is not None:
+            trace.add(name, seconds)
+
+def propagate(coro):
+    """
+    Оборачивает корутину так, чтобы её вызовы учитывались в разбивке текущего запроса,
+    даже если она выполняется на цикле событий другого потока (например, llm_gateway).
+    """
+    trace = _current.get()
+    if trace is None:
+        return coro
+
+    async def traced():
+        token = _current.set(trace)
+        try:
+            return await coro
+        finally:
+            _current.reset(token)
+    return traced()
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels, extra=()):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in list(labels) + list(extra)) + "}"
+
+def render_prometheus():
+    """
+    Гистограммы в текстовом формате Prometheus. В режиме sqlite – суммарные значения всех
+    процессов (воркеров gunicorn) с момента создания базы, в режиме memory – текущего процесса.
+    Если база занята или недоступна, выводится то, что уже накоплено, а не ошибка.
+    """
+    if METRICS_STORE == "sqlite":
+        try:
+            flush_metrics()
+        except Exception as e:
+            logger.error(f"Ошибка записи метрик в локальную базу: {e}")
+        try:
+            histograms = _load_shared_histograms()
+        except Exception as e:
+            logger.error(f"Ошибка чтения метрик из локальной базы: {e}")
+            histograms = {}
+        # Приращения этого процесса, которые не удалось записать в базу, добавляются к выводу.
+        with _metrics_lock:
+            for key, histogram in _histograms.items():
+                histograms.setdefault(key, Histogram()).merge(histogram)
+    else:
+        with _metrics_lock:
+            histograms = dict(_histograms)
+    with _metrics_lock:
+        snapshot = sorted(
+            (metric, labels, list(h.counts), h.count, h.sum, h.buckets) for (metric, labels), h in histograms.items()
+        )
+    lines = []
+    described = set()
+    for metric, labels, counts, count, total, buckets in snapshot:
+        if metric not in described:
+            lines.append(f"# TYPE {metric} histogram")
+            described.add(metric)
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{metric}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+        lines.append(f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+        lines.append(f"{metric}_sum{_format_labels(labels)} {total:.6f}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"